@@ -1,61 +1,54 @@
 """
 inspect_mlpackage.py
 
-A utility script to inspect the input and output specifications of a Core ML model package (.mlpackage).
+A utility script to inspect the input and output specifications of Core ML models (.mlpackage / .mlmodel).
+
+The model spec is decoded directly (see knowmaps_tools/mlmodels.py), so coremltools is not required;
+it is only used as a fallback for specs the decoder cannot read.
 
 Prerequisites:
     - Python 3
-    - coremltools (`pip install coremltools`)
 
 Usage:
-    Run this script from the directory containing the model package, or pass the path as an argument.
+    Pass one or more model paths, or nothing to inspect every model under Model/ML.
     Example:
         python inspect_mlpackage.py MyModel.mlpackage
+        python inspect_mlpackage.py --json
 """
 
-import coremltools as ct
-import sys
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", ".."))
 
-# Default model path if none is provided via command line
-default_model_path = "MiniLM-L12-Embedding.mlpackage"
+from knowmaps_tools.mlmodels import format_summary, inspect_models
+
+# Every model in the app when no path is given
+default_model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ML")
 
 def inspect_model(path):
     """
-    Loads a Core ML model package and prints its input and output specifications.
+    Decodes a Core ML model's description and prints its input and output specifications.
     """
     if not os.path.exists(path):
         print(f"Error: Model not found at '{path}'")
         print(f"Usage: python {sys.argv[0]} [path/to/model.mlpackage]")
         return
 
-    print(f"Loading model from: {path}")
-    
     try:
-        # Load the model
-        mlmodel = ct.models.MLModel(path)
-        spec = mlmodel.get_spec()
-
-        # Print Description if available
-        description = spec.description.metadata.shortDescription
-        if description:
-            print("\n=== DESCRIPTION ===")
-            print(description)
-
-        print("\n=== INPUTS ===")
-        for inp in spec.description.input:
-            print(f"- name: {inp.name}")
-            print(f"  type: {inp.type}")
-
-        print("\n=== OUTPUTS ===")
-        for out in spec.description.output:
-            print(f"- name: {out.name}")
-            print(f"  type: {out.type}")
-            
+        summaries, _, _ = inspect_models([path])
     except Exception as e:
         print(f"An error occurred while inspecting the model: {e}")
+        return
+
+    for summary in summaries:
+        for line in format_summary(summary):
+            print(line)
 
 if __name__ == "__main__":
-    # Use command line argument if available, otherwise default
-    target_path = sys.argv[1] if len(sys.argv) > 1 else default_model_path
-    inspect_model(target_path)
+    from knowmaps_tools.mlmodels import main
+    # Use command line arguments if available, otherwise every model in Model/ML
+    args = sys.argv[1:]
+    if not [a for a in args if not a.startswith("--")]:
+        args.append(os.path.normpath(default_model_dir))
+    sys.exit(main(args))
@@ -1,8 +1,6 @@
 import re
-import hashlib
 
-def generate_id(seed):
-    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+from knowmaps_tools.edit_buffer import write_if_changed
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
@@ -34,7 +32,6 @@ sources_pattern = r'(' + sources_phase_id + r' /\* Sources \*/ = \{\n\s+isa = PB
 if b_id not in content:
     content = re.sub(sources_pattern, r'\1' + f'                {b_id} /* {filename} in Sources */,\n', content)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("PlaceDetailSheet added to project.")
@@ -1,8 +1,7 @@
 import re
-import hashlib
 
-def generate_id(seed):
-    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+from knowmaps_tools.edit_buffer import write_if_changed
+from knowmaps_tools.ids import generate_id
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
@@ -32,7 +31,6 @@ sources_pattern = r'(' + sources_pid + r' /\* Sources \*/ = \{\n\s+isa = PBXSour
 if b_id not in content:
     content = re.sub(sources_pattern, r'\1' + f'                {b_id} /* {filename} in Sources */,\n', content)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("UnifiedSearchView added to project.")
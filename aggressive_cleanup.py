@@ -1,9 +1,8 @@
-import re
-import os
+from knowmaps_tools.pbxproj import PBXProject
+from knowmaps_tools.references import ReferenceIndex
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
-with open(pbxpath, 'r') as f:
-    content = f.read()
+project = PBXProject.load(pbxpath)
 
 # Files we KNOW are gone from the target's "active" perspective
 missing_root = 'Know-Maps/Know Maps Prod/View'
@@ -18,32 +17,14 @@ missing_files = [
     'AddPromptView.swift', 'AddPlaceView.swift', 'AddCategoryView.swift'
 ]
 
-# Find their IDs
-file_ids = []
-for filename in missing_files:
-    # Match ref id
-    match = re.search(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference;', content)
-    if match:
-        file_ids.append((match.group(1), filename))
+# Cascade: file refs -> build files -> Sources phase entries and group children
+refs = ReferenceIndex(project)
+for object_id in refs.purge(missing_files):
+    print(f"Removing {object_id} /* {project.removed[object_id].comment} */")
 
-# Remove matching BuildFiles
-for f_id, filename in file_ids:
-    # Find build file IDs for this file ref
-    bf_matches = re.findall(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} in Sources \*/ = {{isa = PBXBuildFile; fileRef = {f_id}', content)
-    for bf_id in bf_matches:
-        print(f"Removing build file {bf_id} for {filename}")
-        # Remove from PBXBuildFile section
-        content = re.sub(rf'^\s*{bf_id} /\* {filename} in Sources \*/ = {{isa = PBXBuildFile; fileRef = {f_id} /\* {filename} \*/; }};\n', '', content, flags=re.MULTILINE)
-        # Remove from Sources build phases
-        content = re.sub(rf'^\s*{bf_id} /\* {filename} in Sources \*/,\n', '', content, flags=re.MULTILINE)
+for kind, object_id, missing_id in refs.orphans():
+    print(f"Orphan {kind}: {object_id} references missing {missing_id}")
 
-    # Remove from Group children lists
-    content = re.sub(rf'^\s*{f_id} /\* {filename} \*/,\n', '', content, flags=re.MULTILINE)
-    
-    # Remove from PBXFileReference section
-    content = re.sub(rf'^\s*{f_id} /\* {filename} \*/ = {{isa = PBXFileReference; .*? path = {re.escape(filename)}; .*? }};\n', '', content, flags=re.MULTILINE)
-
-with open(pbxpath, 'w') as f:
-    f.write(content)
+project.save()
 
 print("Aggressive cleanup complete.")
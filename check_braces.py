@@ -1,30 +1,16 @@
+import sys
+
+from knowmaps_tools.swift_syntax import check_text, main
 
 def check_braces(filename):
     with open(filename, 'r') as f:
-        lines = f.readlines()
-    
-    stack = []
-    
-    for i, line in enumerate(lines):
-        line = line.strip()
-        # Remove comments
-        if "//" in line:
-            line = line.split("//")[0]
-        
-        for char in line:
-            if char == '{':
-                stack.append(i + 1)
-            elif char == '}':
-                if not stack:
-                    print(f"Extraneous }} at line {i + 1}")
-                    return
-                stack.pop()
-                if not stack:
-                     print(f"Stack became empty at line {i + 1}")
-    
-    if stack:
-        print(f"Unclosed {{ at lines: {stack}")
-    else:
+        issues = check_text(f.read(), filename)
+
+    for issue in issues:
+        print(issue)
+    if not issues:
         print("Braces are balanced.")
 
-check_braces("/Users/voxels/Documents/dev/Know-Maps/Know-Maps/Know-Maps/Know Maps Prod/View/PlaceDetailSheet.swift")
+# With no arguments, checks every Swift file under Know Maps Prod and knowmapsTests
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 import re
-import os
+
+from knowmaps_tools.disk_index import DiskIndex
+from knowmaps_tools.edit_buffer import write_if_changed
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
@@ -13,13 +15,11 @@ for match in re.finditer(pattern, content):
     ref_id, name, path, tree = match.groups()
     file_refs[ref_id] = {'name': name, 'path': path, 'tree': tree}
 
-# Helper to find absolute path (simplified)
+# Helper to find absolute path (simplified); the index is built once and cached between runs
+disk_index = DiskIndex.build('Know-Maps/Know Maps Prod')
+
 def get_disk_path(filename):
-    root = 'Know-Maps/Know Maps Prod'
-    for r, d, f in os.walk(root):
-        if filename in f:
-            return os.path.join(r, filename)
-    return None
+    return disk_index.find(filename)
 
 build_files_to_remove = []
 # Pattern for BuildFiles
@@ -39,9 +39,7 @@ for bf_id, ref_id, name in build_files_to_remove:
     content = re.sub(rf'^\s*{bf_id} /\* {name} in Sources \*/,\n', '', content, flags=re.MULTILINE)
 
 # 2. Add MainUI.swift
-import hashlib
-def generate_id(seed):
-    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+from knowmaps_tools.ids import generate_id
 
 filename = "MainUI.swift"
 f_id = generate_id(filename + "_ref_v3")
@@ -67,7 +65,6 @@ if b_id not in content:
     sources_pattern = r'(' + sources_pid + r' /\* Sources \*/ = \{\n\s+isa = PBXSourcesBuildPhase;\n\s+buildActionMask = [0-9]+;\n\s+files = \(\n)'
     content = re.sub(sources_pattern, r'\1' + f'                {b_id} /* {filename} in Sources */,\n', content)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Cleanup and Add complete.")
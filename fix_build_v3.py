@@ -1,6 +1,10 @@
 import re
 import os
 
+from knowmaps_tools.edit_buffer import write_if_changed
+from knowmaps_tools.pbxproj import PBXProject
+from knowmaps_tools.references import ReferenceIndex
+
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
     content = f.read()
@@ -18,22 +22,11 @@ files_to_purge = [
     'AddPromptView.swift', 'AddPlaceView.swift', 'AddCategoryView.swift'
 ]
 
-for filename in files_to_purge:
-    # Find FileRef ID
-    match = re.search(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference;', content)
-    if match:
-        f_id = match.group(1)
-        # Find BuildFile IDs
-        bf_matches = re.findall(rf'([A-F0-9]{{24}}) /\* {filename} in Sources \*/ = {{isa = PBXBuildFile; fileRef = {f_id}', content)
-        for bf_id in bf_matches:
-            # Remove BuildFile from section
-            content = re.sub(rf'^\s*{bf_id} /\* {filename} in Sources \*/ = {{isa = PBXBuildFile; .*? }};\n', '', content, flags=re.MULTILINE)
-            # Remove from Sources build phases
-            content = re.sub(rf'^\s*{bf_id} /\* {filename} in Sources \*/,\n', '', content, flags=re.MULTILINE)
-        # Remove from Groups
-        content = re.sub(rf'^\s*{f_id} /\* {filename} \*/,\n', '', content, flags=re.MULTILINE)
-        # Remove FileRef
-        content = re.sub(rf'^\s*{f_id} /\* {filename} \*/ = {{isa = PBXFileReference; .*? }};\n', '', content, flags=re.MULTILINE)
+# One parse, one cascade over file refs -> build files -> phases and groups
+project = PBXProject(content, pbxpath)
+refs = ReferenceIndex(project)
+refs.purge(files_to_purge)
+content = project.serialize()
 
 # 2. Ensure MainUI.swift and UnifiedSearchView.swift are correctly added
 # We'll use a specific group ID 1EA7F76E2B050065002AE371 (View)
@@ -60,7 +53,6 @@ def add_file_safely(fname, f_id, b_id):
 add_file_safely("MainUI.swift", "4B7F052D107C8CE1FA277503", "BFEAFC35CF441B682B90C252")
 add_file_safely("UnifiedSearchView.swift", "5C7F052D107C8CE1FA277501", "CFEAFC35CF441B682B90C251")
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Build fix v3 applied.")
@@ -1,6 +1,10 @@
 import re
 import os
 
+from knowmaps_tools.edit_buffer import write_if_changed
+from knowmaps_tools.pbxproj import PBXProject
+from knowmaps_tools.references import ReferenceIndex
+
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
     content = f.read()
@@ -19,26 +23,12 @@ files_to_purge = [
     'AddPromptView.swift', 'AddPlaceView.swift', 'AddCategoryView.swift'
 ]
 
-# Specifically check for references that might be using the "Old" directory in their path
-for filename in files_to_purge:
-    # Match any PBXFileReference for this filename
-    matches = re.finditer(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference;.*?path = (.*?\b{re.escape(filename)});', content)
-    for match in matches:
-        f_id = match.group(1)
-        path = match.group(2)
-        print(f"Found reference to {filename} at {path} with ID {f_id}")
-        
-        # Find BuildFile IDs
-        bf_matches = re.findall(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} in Sources \*/ = {{isa = PBXBuildFile; fileRef = {f_id}', content)
-        for bf_id in bf_matches:
-            print(f"  Removing BuildFile {bf_id}")
-            content = re.sub(rf'^\s*{bf_id} /\* {re.escape(filename)} in Sources \*/ = {{isa = PBXBuildFile; .*? }};\n', '', content, flags=re.MULTILINE)
-            content = re.sub(rf'^\s*{bf_id} /\* {re.escape(filename)} in Sources \*/,\n', '', content, flags=re.MULTILINE)
-        
-        # Remove from Groups
-        content = re.sub(rf'^\s*{f_id} /\* {re.escape(filename)} \*/,\n', '', content, flags=re.MULTILINE)
-        # Remove FileRef
-        content = re.sub(rf'^\s*{f_id} /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference; .*? }};\n', '', content, flags=re.MULTILINE)
+# One parse, one cascade over file refs -> build files -> phases and groups
+project = PBXProject(content, pbxpath)
+refs = ReferenceIndex(project)
+for object_id in refs.purge(files_to_purge):
+    print(f"  Removing {project.removed[object_id].comment} ({object_id})")
+content = project.serialize()
 
 # 2. Re-add MainUI.swift and UnifiedSearchView.swift with FRESH IDs to avoid conflicts
 # And make sure they are in the "View" group (1EA7F76E2B050065002AE371)
@@ -77,7 +67,6 @@ for bid in ["BFEAFC35CF441B682B90C252", "CFEAFC35CF441B682B90C251", main_ui_bid,
 add_file("MainUI.swift", main_ui_fid, main_ui_bid)
 add_file("UnifiedSearchView.swift", unified_search_fid, unified_search_bid)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Build fix v4 applied.")
@@ -1,6 +1,10 @@
 import re
 import os
 
+from knowmaps_tools.edit_buffer import write_if_changed
+from knowmaps_tools.pbxproj import PBXProject
+from knowmaps_tools.references import ReferenceIndex
+
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
     content = f.read()
@@ -17,20 +21,11 @@ stale_files = [
     'AddPromptView.swift', 'AddPlaceView.swift', 'AddCategoryView.swift'
 ]
 
-for filename in stale_files:
-    # Match any PBXFileReference for this filename
-    matches = re.finditer(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference;', content)
-    for match in list(matches):
-        f_id = match.group(1)
-        # Remove matching BuildFiles
-        bf_matches = re.findall(rf'([A-F0-9]{{24}}) /\* {re.escape(filename)} in Sources \*/ = {{isa = PBXBuildFile; fileRef = {f_id}', content)
-        for bf_id in bf_matches:
-            content = re.sub(rf'^\s*{bf_id} /\* {re.escape(filename)} in Sources \*/ = {{isa = PBXBuildFile; .*? }};\n', '', content, flags=re.MULTILINE)
-            content = re.sub(rf'^\s*{bf_id} /\* {re.escape(filename)} in Sources \*/,\n', '', content, flags=re.MULTILINE)
-        # Remove from Groups
-        content = re.sub(rf'^\s*{f_id} /\* {re.escape(filename)} \*/,\n', '', content, flags=re.MULTILINE)
-        # Remove FileRef
-        content = re.sub(rf'^\s*{f_id} /\* {re.escape(filename)} \*/ = {{isa = PBXFileReference; .*? }};\n', '', content, flags=re.MULTILINE)
+# One parse, one cascade over file refs -> build files -> phases and groups
+project = PBXProject(content, pbxpath)
+refs = ReferenceIndex(project)
+refs.purge(stale_files)
+content = project.serialize()
 
 # 2. Add Active Files with FIXED IDs to ensure they are present
 active_files = {
@@ -64,7 +59,6 @@ for fname, (fid, bid) in active_files.items():
     build_line = f'                {bid} /* {fname} in Sources */,\n'
     content = re.sub(rf'({sources_phase_id} /\* Sources \*/ = \{{.*?files = \(\n)', r'\1' + build_line, content, flags=re.DOTALL)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Build fix v5 complete.")
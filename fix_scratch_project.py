@@ -1,9 +1,8 @@
 import re
 import os
 
-def generate_id(seed):
-    import hashlib
-    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+from knowmaps_tools.edit_buffer import write_if_changed
+from knowmaps_tools.ids import generate_id
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
@@ -57,7 +56,6 @@ content = re.sub(prod_group_pattern, r'\1' + group_entries['Know Maps Prod'], co
 sources_pattern = r'(1E15EDE12EF96C59009384CA /\* Sources \*/ = \{\n\s+isa = PBXSourcesBuildPhase;\n\s+buildActionMask = [0-9]+;\n\s+files = \(\n)'
 content = re.sub(sources_pattern, r'\1' + sources_entries, content)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Updated project.pbxproj")
@@ -1,5 +1,6 @@
 import re
 import os
+from knowmaps_tools.edit_buffer import write_if_changed
 
 pbxpath = 'Know-Maps/Know Maps.xcodeproj/project.pbxproj'
 with open(pbxpath, 'r') as f:
@@ -34,9 +35,7 @@ build_files = ""
 group_updates = {prod_gid: "", models_gid: "", view_gid: ""}
 sources_entries = ""
 
-import hashlib
-def generate_id(seed):
-    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+from knowmaps_tools.ids import generate_id
 
 for filename, gid, path in files_to_add:
     f_id = generate_id(filename + "_ref_v2")
@@ -62,7 +61,6 @@ for gid, entries in group_updates.items():
 sources_pattern = r'(1E15EDE12EF96C59009384CA /\* Sources \*/ = \{\n\s+isa = PBXSourcesBuildPhase;\n\s+buildActionMask = [0-9]+;\n\s+files = \(\n)'
 content = re.sub(sources_pattern, r'\1' + sources_entries, content)
 
-with open(pbxpath, 'w') as f:
-    f.write(content)
+write_if_changed(pbxpath, content)
 
 print("Updated project.pbxproj v2")
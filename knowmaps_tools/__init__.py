@@ -0,0 +1,7 @@
+"""
+knowmaps_tools
+
+Shared tooling for the Know Maps Xcode project, its Swift sources and its
+Core ML training data. The modules are importable from the repository root,
+which is where every maintenance script is run from.
+"""
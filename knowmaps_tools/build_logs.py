@@ -0,0 +1,450 @@
+"""
+build_logs.py
+
+Streaming xcodebuild transcript analyzer backed by SQLite.
+
+Each transcript (build.log, build_*.txt) is read line by line in a single
+pass, so memory stays flat regardless of log size. The parser extracts
+diagnostics (errors, warnings, notes), compile steps with their target and
+source files, the target dependency graph, resolved package versions, the
+"following build commands failed" block and the final BUILD result, and
+stores them in .knowmaps-cache/build-logs.sqlite. Logs whose size and mtime
+are unchanged are not re-read. A log whose content hash is already stored is
+not parsed: a rename (the old path is gone) only has its path updated, and a
+copy gets the stored rows duplicated under its own path.
+
+Diagnostics are keyed by their path relative to the source root and their
+message, without line numbers, so comparing two builds is not confused by
+edits that shift code around.
+
+Usage:
+    python -m knowmaps_tools.build_logs [ingest] [logs...]
+    python -m knowmaps_tools.build_logs logs
+    python -m knowmaps_tools.build_logs show build_v5_check_3 [--warnings]
+    python -m knowmaps_tools.build_logs diff build_v5_check build_v5_check_3 [--warnings]
+"""
+
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from .disk_index import CACHE_DIR
+
+DB_PATH = os.path.join(CACHE_DIR, 'build-logs.sqlite')
+DEFAULT_PATTERNS = ('build.log', 'build_*.txt')
+SCHEMA_VERSION = 2
+FLUSH_ROWS = 1000
+
+# Directories of the Xcode project that diagnostics paths are made relative to.
+SOURCE_ROOTS = ('Know Maps Prod/', 'knowmapsTests/', 'knowmapsUITests/')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    result TEXT,
+    command TEXT,
+    lines INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_sha1 ON logs (sha1);
+CREATE TABLE IF NOT EXISTS diagnostics (
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    severity TEXT NOT NULL,
+    file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    target TEXT,
+    count INTEGER NOT NULL DEFAULT 1,
+    UNIQUE (log_id, severity, file, line, col, message)
+);
+CREATE INDEX IF NOT EXISTS diagnostics_key ON diagnostics (log_id, severity, file, message);
+CREATE TABLE IF NOT EXISTS compile_steps (
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    step TEXT NOT NULL,
+    target TEXT NOT NULL,
+    project TEXT NOT NULL,
+    file TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS compile_steps_log ON compile_steps (log_id, file);
+CREATE TABLE IF NOT EXISTS target_deps (
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    target TEXT NOT NULL,
+    project TEXT NOT NULL,
+    dependency TEXT NOT NULL,
+    dependency_project TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS failed_commands (
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    command TEXT NOT NULL
+);
+"""
+
+_DIAGNOSTIC_RE = re.compile(r'^(?:(.+?):(\d+):(\d+): )?(error|warning|note): (.*)$')
+_IN_TARGET_RE = re.compile(r" \(in target '([^']*)' from project '([^']*)'\)$")
+_STEP_RE = re.compile(r'^([A-Z]\w+) (.*)$')
+_PACKAGE_RE = re.compile(r'^  (\S+): (\S+) @ (\S+)$')
+_TARGET_RE = re.compile(r"^    Target '([^']*)' in project '([^']*)'")
+_DEPENDENCY_RE = re.compile(r"^        \S+ (\w+) dependency on target '([^']*)' in project '([^']*)'")
+_UNESCAPED_SPACE_RE = re.compile(r'(?<!\\) ')
+
+COMPILE_STEPS = ('SwiftCompile', 'CompileC', 'CompileSwift')
+
+
+def source_key(path):
+    """Path relative to the project's source root, or the path unchanged."""
+    for root in SOURCE_ROOTS:
+        index = path.rfind('/' + root)
+        if index >= 0:
+            return path[index + 1:]
+    return path
+
+
+def connect(path, schema, version):
+    """Opens an SQLite store with foreign keys on; tables from another schema version are dropped first."""
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA foreign_keys = ON")
+    if db.execute("PRAGMA user_version").fetchone()[0] != version:
+        for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            db.execute(f"DROP TABLE {table}")
+        db.execute(f"PRAGMA user_version = {version}")
+    db.executescript(schema)
+    return db
+
+
+def find_by_name(db, table, name):
+    """Row id in `table` whose path, file name or file name without extension is `name`, or None."""
+    row = db.execute(
+        f"SELECT id FROM {table} WHERE path = ? OR name = ? OR name LIKE ? ESCAPE '\\' ORDER BY name LIMIT 1",
+        (os.path.abspath(name), name, name.replace('_', '\\_') + '.%')).fetchone()
+    return None if row is None else row[0]
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _step_files(args):
+    """Absolute source paths in a step's argument string, with `\\ ` unescaped."""
+    return [token.replace('\\ ', ' ') for token in _UNESCAPED_SPACE_RE.split(args) if token.startswith('/')]
+
+
+class LogParser:
+    """Single-pass parser for one xcodebuild transcript."""
+
+    def __init__(self, sink):
+        # `sink(table, row)` receives every extracted row.
+        self.sink = sink
+        self.result = None
+        self.command = None
+        self.lines = 0
+        self._block = None
+        self._target = None
+        self._current_target = None
+
+    def feed(self, line):
+        self.lines += 1
+        block = self._block
+        if block is not None:
+            if self._feed_block(block, line):
+                return
+            self._block = None
+
+        if not line:
+            return
+        if line.startswith('note: Target dependency graph'):
+            self._block = 'targets'
+            return
+        first = line[0]
+        if first == '/' or first == '@' or first == 'e' or first == 'w' or first == 'n' or first == '<':
+            m = _DIAGNOSTIC_RE.match(line)
+            if m is not None:
+                path, line_no, column, severity, message = m.groups()
+                self.sink('diagnostics', (severity, source_key(path) if path else '', int(line_no or 0),
+                                          int(column or 0), message, self._current_target))
+                return
+        if first == '*' and line.startswith('** '):
+            if 'SUCCEEDED' in line:
+                self.result = 'succeeded'
+            elif 'FAILED' in line:
+                self.result = 'failed'
+        elif line == 'Command line invocation:':
+            self._block = 'command'
+        elif line == 'Resolved source packages:':
+            self._block = 'packages'
+        elif line == 'The following build commands failed:':
+            self._block = 'failed'
+        elif first.isupper():
+            self._step(line)
+
+    def _feed_block(self, block, line):
+        """Consumes a line belonging to a multi-line block; False ends the block."""
+        if block == 'command':
+            if line.startswith('    '):
+                self.command = line.strip()
+                return True
+            return False
+        if block == 'packages':
+            m = _PACKAGE_RE.match(line)
+            if m is not None:
+                self.sink('packages', m.groups())
+                return True
+            return False
+        if block == 'targets':
+            m = _TARGET_RE.match(line)
+            if m is not None:
+                self._target = m.groups()
+                return True
+            m = _DEPENDENCY_RE.match(line)
+            if m is not None and self._target is not None:
+                kind, dependency, dependency_project = m.groups()
+                self.sink('target_deps', self._target + (dependency, dependency_project, kind.lower()))
+                return True
+            return False
+        if block == 'failed':
+            if line.startswith('\t'):
+                self.sink('failed_commands', (line.strip(),))
+                return True
+            return False
+        return False
+
+    def _step(self, line):
+        m = _IN_TARGET_RE.search(line)
+        if m is None:
+            return
+        target, project = m.groups()
+        self._current_target = target
+        step = _STEP_RE.match(line[:m.start()])
+        if step is None or step.group(1) not in COMPILE_STEPS:
+            return
+        for path in _step_files(step.group(2)):
+            self.sink('compile_steps', (step.group(1), target, project, source_key(path)))
+
+
+class BuildLogStore:
+    """SQLite store of parsed transcripts."""
+
+    INSERTS = {
+        'diagnostics': ("INSERT INTO diagnostics (log_id, severity, file, line, col, message, target) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (log_id, severity, file, line, col, message) DO UPDATE SET count = count + 1"),
+        'compile_steps': "INSERT INTO compile_steps VALUES (?, ?, ?, ?, ?)",
+        'target_deps': "INSERT INTO target_deps VALUES (?, ?, ?, ?, ?, ?)",
+        'packages': "INSERT INTO packages VALUES (?, ?, ?, ?)",
+        'failed_commands': "INSERT INTO failed_commands VALUES (?, ?)",
+    }
+
+    def __init__(self, path=DB_PATH):
+        self.db = connect(path, SCHEMA, SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # Ingest
+
+    def ingest(self, path):
+        """
+        Parses `path` into the store. Returns 'unchanged', 'moved' (same content
+        stored under a path that no longer exists), 'copied' (same content as
+        another stored log, whose rows are duplicated without parsing) or
+        'ingested'.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute("SELECT id, size, mtime_ns FROM logs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1:] == (st.st_size, st.st_mtime_ns):
+            return 'unchanged'
+        sha1 = _sha1(path)
+        same = [(log_id, other) for log_id, other in self.db.execute(
+            "SELECT id, path FROM logs WHERE sha1 = ? AND path != ?", (sha1, path))]
+
+        with self.db:
+            if row is not None:
+                self.db.execute("DELETE FROM logs WHERE id = ?", (row[0],))
+            for log_id, other in same:
+                if not os.path.exists(other):
+                    self.db.execute("UPDATE logs SET name = ?, path = ?, size = ?, mtime_ns = ? WHERE id = ?",
+                                    (os.path.basename(path), path, st.st_size, st.st_mtime_ns, log_id))
+                    return 'moved'
+            if same:
+                source_id = same[0][0]
+                log_id = self.db.execute("""
+                    INSERT INTO logs (name, path, sha1, size, mtime_ns, result, command, lines)
+                    SELECT ?, ?, sha1, ?, ?, result, command, lines FROM logs WHERE id = ?""",
+                    (os.path.basename(path), path, st.st_size, st.st_mtime_ns, source_id)).lastrowid
+                for table in self.INSERTS:
+                    columns = [c[1] for c in self.db.execute(f"PRAGMA table_info({table})") if c[1] != 'log_id']
+                    listed = ', '.join(columns)
+                    self.db.execute(f"INSERT INTO {table} (log_id, {listed}) "
+                                    f"SELECT ?, {listed} FROM {table} WHERE log_id = ?", (log_id, source_id))
+                return 'copied'
+
+            pending = {table: [] for table in self.INSERTS}
+            buffered = 0
+
+            def sink(table, values):
+                nonlocal buffered
+                pending[table].append(values)
+                buffered += 1
+                if buffered >= FLUSH_ROWS:
+                    flush()
+
+            def flush():
+                nonlocal buffered
+                for table, rows in pending.items():
+                    if rows:
+                        self.db.executemany(self.INSERTS[table], [(log_id,) + r for r in rows])
+                        rows.clear()
+                buffered = 0
+
+            log_id = self.db.execute(
+                "INSERT INTO logs (name, path, sha1, size, mtime_ns, lines) VALUES (?, ?, ?, ?, ?, 0)",
+                (os.path.basename(path), path, sha1, st.st_size, st.st_mtime_ns)).lastrowid
+            parser = LogParser(sink)
+            with open(path, 'rb') as f:
+                for raw in f:
+                    parser.feed(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            flush()
+            self.db.execute("UPDATE logs SET result = ?, command = ?, lines = ? WHERE id = ?",
+                            (parser.result, parser.command, parser.lines, log_id))
+        return 'ingested'
+
+    def ingest_many(self, paths):
+        counts = {}
+        for path in paths:
+            status = self.ingest(path)
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    # Queries
+
+    def log_id(self, name):
+        """Resolves a log by path, file name or file name without extension."""
+        log_id = find_by_name(self.db, 'logs', name)
+        if log_id is None:
+            raise KeyError(f"No ingested log named {name!r}")
+        return log_id
+
+    def summaries(self):
+        """(name, result, errors, warnings, compiled files) for every log."""
+        return self.db.execute("""
+            SELECT l.name, l.result,
+                   (SELECT COUNT(*) FROM diagnostics d WHERE d.log_id = l.id AND d.severity = 'error'),
+                   (SELECT COUNT(*) FROM diagnostics d WHERE d.log_id = l.id AND d.severity = 'warning'),
+                   (SELECT COUNT(DISTINCT file) FROM compile_steps c WHERE c.log_id = l.id)
+            FROM logs l ORDER BY l.name""").fetchall()
+
+    def diagnostics(self, log, severities=('error',)):
+        marks = ", ".join("?" * len(severities))
+        return self.db.execute(
+            f"SELECT severity, file, line, col, message FROM diagnostics "
+            f"WHERE log_id = ? AND severity IN ({marks}) ORDER BY file, line, col",
+            (self.log_id(log),) + tuple(severities)).fetchall()
+
+    def _only_in(self, log_id, other_id, severities):
+        marks = ", ".join("?" * len(severities))
+        return self.db.execute(
+            f"""SELECT severity, file, line, col, message FROM diagnostics d
+                WHERE d.log_id = ? AND d.severity IN ({marks}) AND NOT EXISTS (
+                    SELECT 1 FROM diagnostics o WHERE o.log_id = ? AND o.severity = d.severity
+                    AND o.file = d.file AND o.message = d.message)
+                ORDER BY file, line, col""",
+            (log_id,) + tuple(severities) + (other_id,)).fetchall()
+
+    def diff(self, before, after, severities=('error',)):
+        """Returns (introduced, resolved) diagnostics between two logs."""
+        before_id, after_id = self.log_id(before), self.log_id(after)
+        return (self._only_in(after_id, before_id, severities),
+                self._only_in(before_id, after_id, severities))
+
+    def packages(self, log):
+        return self.db.execute("SELECT name, url, version FROM packages WHERE log_id = ? ORDER BY name",
+                               (self.log_id(log),)).fetchall()
+
+
+def default_logs(root='.'):
+    paths = set()
+    for pattern in DEFAULT_PATTERNS:
+        paths.update(glob.glob(os.path.join(root, pattern)))
+    return sorted(paths)
+
+
+def _format(diagnostic):
+    severity, file, line, column, message = diagnostic
+    location = f"{file}:{line}:{column}: " if file else ""
+    return f"{location}{severity}: {message}"
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    severities = ('error', 'warning') if '--warnings' in args else ('error',)
+    positional = [a for a in args if not a.startswith('--')]
+    command = positional.pop(0) if positional and positional[0] in ('ingest', 'logs', 'show', 'diff') else 'ingest'
+
+    with BuildLogStore() as store:
+        if command == 'ingest':
+            paths = positional or default_logs()
+            start = time.perf_counter()
+            counts = store.ingest_many(paths)
+            elapsed = time.perf_counter() - start
+            detail = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+            print(f"{len(paths)} log(s): {detail or 'none'} in {elapsed:.3f}s")
+            return 0
+        if command == 'logs':
+            for name, result, errors, warnings, files in store.summaries():
+                print(f"{name:32} {result or '-':10} {errors:4} error(s) {warnings:4} warning(s) {files:4} file(s)")
+            return 0
+        try:
+            if command == 'show':
+                if len(positional) != 1:
+                    print("Usage: show LOG [--warnings]")
+                    return 2
+                for diagnostic in store.diagnostics(positional[0], severities):
+                    print(_format(diagnostic))
+                return 0
+            if len(positional) != 2:
+                print("Usage: diff BEFORE AFTER [--warnings]")
+                return 2
+            introduced, resolved = store.diff(positional[0], positional[1], severities)
+        except KeyError as e:
+            print(e.args[0])
+            return 1
+        print(f"Introduced in {positional[1]} ({len(introduced)}):")
+        for diagnostic in introduced:
+            print("  + " + _format(diagnostic))
+        print(f"Resolved since {positional[0]} ({len(resolved)}):")
+        for diagnostic in resolved:
+            print("  - " + _format(diagnostic))
+        return 1 if introduced else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
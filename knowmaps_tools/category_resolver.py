@@ -0,0 +1,363 @@
+"""
+category_resolver.py
+
+Fuzzy, multilingual free-text -> category resolver.
+
+Every label of every language in the taxonomy (en, vi, ms, th, tl, id, km)
+is normalized (case-folded, Latin diacritics removed, so "Café" meets
+"cafe") and broken into word-padded character trigrams. An inverted index
+maps each trigram id to the labels containing it, stored as one flat array
+of postings with offsets. A batch of queries is scored at once: the
+trigrams of all queries are mapped to ids with numpy, their postings are
+gathered into one array and counted with a single bincount into a (query,
+label) overlap table; pairs sharing too few trigrams to reach the minimum
+score are dropped, and the rest are scored with a Tversky similarity that
+forgives label words the query leaves out, then sorted once to cut the
+top-k labels of every query. Repeated queries in a batch are scored once,
+and exact matches skip the counting when only the best category is asked
+for.
+
+Throughput is bound by the postings: a typical query shares a trigram with
+about 4,500 labels, and gathering and counting those costs most of the
+~100 µs a distinct query takes. `bench` measures about 10,000 distinct
+lookups/s on one core, a tenth of 100,000/s; counting by sorting the
+(query, label) keys instead of the bincount is several times slower.
+
+Labels are read from the compiled taxonomy index (see taxonomy_index.py).
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.category_resolver resolve "coffee shops" Cafe "Thủy cung"
+    python -m knowmaps_tools.category_resolver corpus
+    python -m knowmaps_tools.category_resolver bench
+"""
+
+import csv
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+
+from .taxonomy_index import open_index
+from .training_data import iter_json_array
+
+ML_DIR = 'Know-Maps/Know Maps Prod/Model/ML'
+CLASSIFIER_CSV = os.path.join(ML_DIR, 'FoursquareClassifierTrainingData.csv')
+TAGGING_FILES = ('WordTaggingClassifierTrainingData.json', 'WordTaggingClassifierTrainingData_FULLSET.json')
+
+# Queries whose trigram postings are counted together; the count buffer is
+# CHUNK x labels wide and is cheapest while it stays in cache.
+CHUNK = 64
+# Tversky weight of label trigrams the query lacks: "sushi" should still rank
+# "Sushi Restaurant" highly, while query trigrams missing from a label count fully.
+LABEL_WEIGHT = 0.5
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Case-folds and strips diacritics from Latin letters; other scripts keep their marks."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    kept = []
+    latin = False
+    for char in decomposed:
+        if unicodedata.combining(char):
+            if latin:
+                continue
+        else:
+            latin = char < 'ɐ'
+        kept.append(char)
+    return ' '.join(_WORD_RE.findall(unicodedata.normalize('NFC', ''.join(kept))))
+
+
+def trigrams(normalized):
+    """Word-padded trigrams ("  c", " co", "cof", ...), as a set."""
+    grams = set()
+    for word in normalized.split(' '):
+        if word:
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _gram_code(gram):
+    """A trigram as one integer: 21 bits per code point."""
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+def _gram_codes(keys):
+    """
+    (rows, codes) of the distinct trigrams of every normalized key, as
+    _gram_code values and computed for all keys at once; `rows` is sorted.
+    """
+    import numpy as np
+
+    # "  coffee \n  shop \n  ..." -- no trigram spans a newline.
+    pieces = ['  ' + key.replace(' ', ' \n  ') + ' ' if key else '' for key in keys]
+    points = np.frombuffer('\n'.join(pieces).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    lengths = np.fromiter(map(len, pieces), dtype=np.int64, count=len(pieces)) + 1
+    first, second, third = points[:-2], points[1:-1], points[2:]
+    rows = np.repeat(np.arange(len(keys), dtype=np.int64), lengths)[:len(first)]
+    inside = (first != 10) & (second != 10) & (third != 10)
+    codes = ((first << 42) | (second << 21) | third)[inside]
+    rows = rows[inside]
+    distinct, inverse = np.unique(codes, return_inverse=True)
+    pairs = np.unique(rows * len(distinct) + inverse)
+    return pairs // len(distinct), distinct[pairs % len(distinct)]
+
+
+class Match(tuple):
+    """(category_id, score, label, language)."""
+
+    __slots__ = ()
+
+    def __new__(cls, category_id, score, label, language):
+        return tuple.__new__(cls, (category_id, score, label, language))
+
+    category_id = property(lambda self: self[0])
+    score = property(lambda self: self[1])
+    label = property(lambda self: self[2])
+    language = property(lambda self: self[3])
+
+
+class CategoryResolver:
+    """Trigram inverted index over every label of every language."""
+
+    def __init__(self, labels):
+        """`labels` is an iterable of (category_id, language, label text)."""
+        import numpy as np
+
+        by_text = {}
+        for category_id, language, text in labels:
+            key = normalize(text)
+            if key:
+                # English first, then taxonomy order: the first owner of a text wins ties.
+                by_text.setdefault(key, []).append((category_id, text, language))
+        self.texts = sorted(by_text)
+        self.owners = [sorted(by_text[t], key=lambda o: o[2] != 'en') for t in self.texts]
+        self.exact = {text: i for i, text in enumerate(self.texts)}
+
+        postings = {}
+        sizes = []
+        for i, text in enumerate(self.texts):
+            grams = trigrams(text)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.sizes = np.asarray(sizes, dtype=np.float32)
+        self.rank = np.asarray([owners[0][2] != 'en' for owners in self.owners], dtype=np.int8)
+        # Postings in CSR form: the labels of gram id g are
+        # posting_labels[posting_starts[g]:posting_starts[g + 1]], gram ids in code order.
+        grams = sorted(postings, key=_gram_code)
+        self.gram_codes = np.asarray([_gram_code(gram) for gram in grams], dtype=np.int64)
+        lengths = np.asarray([len(postings[gram]) for gram in grams], dtype=np.int64)
+        self.posting_starts = np.concatenate(([0], np.cumsum(lengths)))
+        self.posting_labels = np.asarray([i for gram in grams for i in postings[gram]], dtype=np.int32)
+
+    @classmethod
+    def from_index(cls, index):
+        return cls((category_id, language, text)
+                   for category_id in index.ids()
+                   for language, text in index.labels(category_id).items())
+
+    @classmethod
+    def load(cls):
+        with open_index() as index:
+            return cls.from_index(index)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _matches(self, label_ids, scores, k):
+        """Expands label hits to categories, keeping each category's best label."""
+        seen = set()
+        matches = []
+        for label_id, score in zip(label_ids, scores):
+            for category_id, text, language in self.owners[label_id]:
+                if category_id not in seen:
+                    seen.add(category_id)
+                    matches.append(Match(category_id, round(float(score), 4), text, language))
+                    if len(matches) == k:
+                        return matches
+        return matches
+
+    def resolve(self, text, k=5, min_score=0.3):
+        return self.resolve_many([text], k, min_score)[0]
+
+    def resolve_many(self, texts, k=5, min_score=0.3):
+        """Ranked top-k matches for each text, best first; [] when nothing scores min_score."""
+        import numpy as np
+
+        keys = [normalize(text) for text in texts]
+        unique = dict.fromkeys(keys)
+        pending = []
+        for key in unique:
+            label_id = self.exact.get(key)
+            if label_id is not None and k == 1:
+                unique[key] = self._matches([label_id], [1.0], k)
+            else:
+                pending.append(key)
+
+        count = len(self.texts)
+        # Ask for extra labels: several may belong to the same category.
+        width = k * 3
+        for start in range(0, len(pending), CHUNK):
+            chunk = pending[start:start + CHUNK]
+            for key in chunk:
+                unique[key] = []
+            rows, codes = _gram_codes(chunk)
+            query_sizes = np.bincount(rows, minlength=len(chunk)).astype(np.float32)
+            # Query trigrams no label has count towards the query size only.
+            grams = np.searchsorted(self.gram_codes, codes)
+            known = grams < len(self.gram_codes)
+            known[known] = self.gram_codes[grams[known]] == codes[known]
+            rows, grams = rows[known], grams[known]
+            lengths = self.posting_starts[grams + 1] - self.posting_starts[grams]
+            total = int(lengths.sum())
+            if not total:
+                continue
+            # Gather every posting of the chunk in one go, keyed by (query, label).
+            ends = np.cumsum(lengths)
+            at = np.arange(total) + np.repeat(self.posting_starts[grams] - (ends - lengths), lengths)
+            counts = np.bincount(self.posting_labels[at] + np.repeat(rows * count, lengths),
+                                 minlength=len(chunk) * count)
+            # A score never exceeds overlap / query size, so labels sharing fewer
+            # trigrams than that allows are dropped before they are scored.
+            need = np.maximum(np.ceil(min_score * query_sizes - 1e-6), 1).astype(np.int64)
+            hits = np.flatnonzero(counts.reshape(len(chunk), count) >= need[:, None])
+            rows, labels = np.divmod(hits, count)
+            overlap = counts[hits].astype(np.float32)
+            query_only = query_sizes[rows] - overlap
+            label_only = self.sizes[labels] - overlap
+            scores = overlap / (overlap + query_only + LABEL_WEIGHT * label_only)
+            keep = scores >= min_score
+            rows, labels, scores = rows[keep], labels[keep], scores[keep]
+            # Per query: best score first, then English labels, then label order.
+            order = np.lexsort((labels, self.rank[labels], -scores, rows))
+            rows, labels, scores = rows[order], labels[order], scores[order]
+            bounds = np.searchsorted(rows, np.arange(len(chunk) + 1))
+            for row, key in enumerate(chunk):
+                first, last = bounds[row], min(bounds[row + 1], bounds[row] + width)
+                unique[key] = self._matches(labels[first:last], scores[first:last], k)
+        return [unique[key] for key in keys]
+
+
+# Corpora
+
+def classifier_rows(path=CLASSIFIER_CSV):
+    """(text, label) rows of FoursquareClassifierTrainingData.csv."""
+    with open(path, newline='', encoding='utf-8') as f:
+        return [(row['text'], row['label']) for row in csv.DictReader(f)]
+
+
+def tagged_spans(path, kinds=('TASTE',)):
+    """
+    Runs of consecutive tokens tagged with one of `kinds`, joined with spaces.
+    Returns (spans, problems); records that do not parse are skipped and each
+    is reported as "<file>:<line>: <error>".
+    """
+    spans = []
+    problems = []
+    for line, record, error in iter_json_array(path):
+        if error is not None:
+            problems.append(f"{os.path.basename(path)}:{line}: {error}")
+            continue
+        current = []
+        for token, label in zip(record['tokens'], record['labels']):
+            if label in kinds:
+                current.append(token)
+            elif current:
+                spans.append(' '.join(current))
+                current = []
+        if current:
+            spans.append(' '.join(current))
+    return spans, problems
+
+
+def corpus_labels(ml_dir=ML_DIR):
+    """
+    Every classifier label and text and every TASTE span. Returns (texts,
+    skipped), where skipped describes each unreadable file and malformed record.
+    """
+    texts = []
+    for text, label in classifier_rows(os.path.join(ml_dir, os.path.basename(CLASSIFIER_CSV))):
+        texts.extend((label, text))
+    skipped = []
+    for name in TAGGING_FILES:
+        try:
+            spans, problems = tagged_spans(os.path.join(ml_dir, name))
+        except OSError as e:
+            skipped.append(f"{name}: {e}")
+            continue
+        texts.extend(spans)
+        skipped.extend(problems)
+    return texts, skipped
+
+
+def _misspell(text, rng):
+    """`text` with one character dropped, doubled, or swapped with the next."""
+    i = rng.randrange(len(text))
+    edit = rng.randrange(3)
+    if edit == 0:
+        return text[:i] + text[i + 1:]
+    if edit == 1:
+        return text[:i] + text[i] + text[i:]
+    return text[:i] + text[i + 1:i + 2] + text[i] + text[i + 2:]
+
+
+def bench(resolver, count=20000, seed=0):
+    """
+    Returns (queries, lookups per second) for `count` distinct queries: the
+    corpus texts, then misspelled labels. No query repeats another after
+    normalization, so resolve_many scores every one of them.
+    """
+    texts, _ = corpus_labels()
+    rng = random.Random(seed)
+    queries = dict.fromkeys(key for key in map(normalize, texts) if key)
+    while len(queries) < count:
+        key = normalize(_misspell(rng.choice(resolver.texts), rng))
+        if key:
+            queries.setdefault(key)
+    batch = list(queries)[:count]
+    rng.shuffle(batch)
+    start = time.perf_counter()
+    resolver.resolve_many(batch)
+    return len(batch), len(batch) / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    command = args[0] if args else 'corpus'
+    resolver = CategoryResolver.load()
+    if command == 'resolve':
+        for text, matches in zip(args[1:], resolver.resolve_many(args[1:])):
+            print(text)
+            for category_id, score, label, language in matches:
+                print(f"  {score:.3f} {category_id:>6} {label} [{language}]")
+        return 0
+    if command == 'corpus':
+        texts, skipped = corpus_labels()
+        start = time.perf_counter()
+        results = resolver.resolve_many(texts, k=1)
+        elapsed = time.perf_counter() - start
+        resolved = sum(1 for matches in results if matches)
+        for text, matches in zip(texts, results):
+            if matches and len(text) < 40:
+                print(f"{text!r:40} -> {matches[0].category_id} {matches[0].label} ({matches[0].score:.2f})")
+        for reason in skipped:
+            print(f"Skipped {reason}")
+        print(f"{resolved}/{len(texts)} resolved in {elapsed:.3f}s ({len(texts) / elapsed:,.0f}/s)")
+        return 0
+    if command == 'bench':
+        queries, rate = bench(resolver)
+        print(f"{len(resolver)} labels indexed; {queries:,} distinct lookups: {rate:,.0f}/s")
+        return 0
+    print("Usage: python -m knowmaps_tools.category_resolver resolve|corpus|bench [texts...]")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
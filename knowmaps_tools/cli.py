@@ -0,0 +1,264 @@
+"""
+cli.py
+
+Single entry point for the Know Maps tooling.
+
+Every command maps to the `main(argv)` of the module that implements it,
+and that module is imported only when its command runs: listing commands,
+`--help` and the light commands never pay for sqlite3, process pools,
+numpy or coremltools. The table below is plain data for the same reason.
+
+With --profile the instrumented functions (see profiling.py) are wrapped
+before the command runs, and a JSON trace with per-phase (read, parse,
+transform, write) and per-function timings and call counts is written to
+--trace, by default .knowmaps-cache/profile-<command>.json. A one-line
+summary goes to stderr.
+
+Commands run relative to the current directory, which for the default paths
+is the repository root; -C DIR runs them as if started in DIR.
+
+Usage:
+    python -m knowmaps_tools [--profile] [--trace PATH] [-C DIR] COMMAND [SUBCOMMAND] [args...]
+    python -m knowmaps_tools --help
+    python -m knowmaps_tools project --help
+"""
+
+import os
+import sys
+
+from .common import option
+
+# command -> (module:function, arguments, summary), or a dict of subcommands
+COMMANDS = {
+    'project': {
+        'sync': ('knowmaps_tools.sync:main', '[--dry-run] [Know-Maps]',
+                 'Sync target membership in project.pbxproj with project.yml'),
+        'add': ('knowmaps_tools.cli:project_add', '[--dry-run] [--project DIR] PATH...',
+                'Add source files to the targets project.yml assigns them to'),
+        'purge': ('knowmaps_tools.cli:project_purge', '[--dry-run] [--project DIR] NAME...',
+                  'Remove every reference to the named files'),
+        'watch': ('knowmaps_tools.watch:main',
+                  '[run|status|bench] [--dry-run] [--apply-initial] [--poll] [--status PATH]',
+                  'Keep the project and syntax checks in step with the tree'),
+        'duplicates': ('knowmaps_tools.duplicates:main', '[roots...] [--threshold 0.8] [--json] [--no-cache]',
+                       'Find duplicate and diverged copies of files'),
+        'bench': ('knowmaps_tools.project_bench:main', '[--sizes N,...] [--ops OP,...] [--budget PATH] ...',
+                  'Benchmark the pbxproj tooling on synthetic projects'),
+    },
+    'check-syntax': ('knowmaps_tools.swift_syntax:main', '[--no-cache] [paths...]',
+                     'Check bracket balance in Swift sources'),
+    'symbols': ('knowmaps_tools.swift_index:main', '[update] | deps FILE [--target NAME] | users FILE | '
+                'defines NAME | symbols FILE | bench',
+                'Swift symbol index and the files each file needs'),
+    'inspect-model': ('knowmaps_tools.mlmodels:main', '[--json] [--no-cache] [paths...]',
+                      'Summarize Core ML models without coremltools'),
+    'logs': ('knowmaps_tools.build_logs:main', '[ingest [logs...] | logs | show LOG | diff BEFORE AFTER]',
+             'Index xcodebuild logs and query their diagnostics'),
+    'compile-times': ('knowmaps_tools.compile_times:main', '[ingest | files | functions | summary | trend] ...',
+                      'Swift compile-time hotspots from timing logs'),
+    'taxonomy': {
+        'index': ('knowmaps_tools.taxonomy_index:main', '[build|verify|bench]',
+                  'Compile the category taxonomy into its binary index'),
+        'hierarchy': ('knowmaps_tools.taxonomy_hierarchy:main', 'descendants|ancestors|lca|verify|bench [IDs...]',
+                      'Ancestor, descendant and LCA queries'),
+        'resolve': ('knowmaps_tools.category_resolver:main', 'resolve|corpus|bench [texts...]',
+                    'Fuzzy category lookup for free text'),
+    },
+    'dataset': {
+        'validate': ('knowmaps_tools.training_data:main', '[validate] [files...] [--threshold 0.8] | bench',
+                     'Validate and deduplicate the training corpora'),
+        'leakage': ('knowmaps_tools.leakage:main', '[REFERENCE PROBE] [--threshold 0.8] | bench',
+                    'Find test examples that leak from training data'),
+        'shards': ('knowmaps_tools.corpus_shards:main', 'export|info|createml|bench ...',
+                   'Export corpora to sharded, split datasets'),
+        'tokenize': ('knowmaps_tools.wordpiece:main', 'encode|parity|bench [texts...]',
+                     'WordPiece tokenization matching MiniLMTokenizer'),
+    },
+    'embeddings': {
+        'store': ('knowmaps_tools.embedding_store:main', 'import|export|compact|bench ...',
+                  'Binary append-only embedding store'),
+        'search': ('knowmaps_tools.similarity:main', 'build|neighbors|verify|bench ...',
+                   'Cosine top-k search over stored embeddings'),
+    },
+}
+
+PROG = 'python -m knowmaps_tools'
+
+
+def _usage(table, prefix):
+    lines = []
+    width = max(len(name) for name in table) + 2
+    for name, entry in table.items():
+        if isinstance(entry, dict):
+            lines.append(f"  {name:{width}}{', '.join(entry)}")
+        else:
+            lines.append(f"  {name:{width}}{entry[2]}")
+    head = f"Usage: {PROG} [--profile] [--trace PATH] [-C DIR] " if not prefix else f"Usage: {PROG} {prefix} "
+    return [head + "COMMAND [args...]", '', "Commands:"] + lines
+
+
+def resolve(args):
+    """(command path, (target, arguments, summary) or subcommand table, remaining args)."""
+    path = []
+    entry = COMMANDS
+    while isinstance(entry, dict) and args and args[0] in entry:
+        path.append(args[0])
+        entry = entry[args[0]]
+        args = args[1:]
+    return path, entry, args
+
+
+def load(target):
+    import importlib
+    module_name, function = target.split(':')
+    return getattr(importlib.import_module(module_name), function)
+
+
+def _without(args, *flags):
+    """`args` minus the given valued options."""
+    out = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in flags:
+            skip = True
+        else:
+            out.append(arg)
+    return out
+
+
+# Project commands
+
+def project_add(argv=None):
+    """Adds the given on-disk sources to the targets that declare their directory."""
+    from .sync import PROJECT_DIR, ProjectSync
+
+    args = sys.argv[1:] if argv is None else list(argv)
+    project_dir = option(args, '--project', PROJECT_DIR)
+    paths = [a for a in _without(args, '--project') if not a.startswith('--')]
+    if not paths:
+        print(f"Usage: {PROG} project add [--dry-run] [--project DIR] PATH...")
+        return 2
+    root = os.path.abspath(project_dir)
+    wanted = set()
+    for path in paths:
+        rel = os.path.relpath(os.path.abspath(path), root)
+        if rel.startswith(os.pardir) or not os.path.exists(path):
+            print(f"Error: {path} is not a file inside {project_dir}")
+            return 1
+        wanted.add(rel)
+    sync = ProjectSync(project_dir)
+    plan = sync.compute(only=wanted)
+    sync.plan = {name: (phase_id, inserts, []) for name, (phase_id, inserts, _) in plan.items() if inserts}
+    reported = {path for _, inserts, _ in sync.plan.values() for path in inserts}
+    reported.update(path for copies in sync.skipped.values() for path, _ in copies)
+    for line in sync.skipped_report():
+        print(line)
+    for path in sorted(wanted - reported):
+        print(f"Skipped {path}: already in its target, or not a source of any target in project.yml")
+    if not sync.plan:
+        return 0
+    for line in sync.report():
+        print(line)
+    if sync.apply(dry_run='--dry-run' in args):
+        print("Project file updated.")
+    return 0
+
+
+def project_purge(argv=None):
+    """Removes the file references with the given basenames, their build files and group entries."""
+    from .pbxproj import PBXPROJ_NAME, PROJECT_DIR, PBXProject
+    from .references import ReferenceIndex
+
+    args = sys.argv[1:] if argv is None else list(argv)
+    project_dir = option(args, '--project', PROJECT_DIR)
+    names = [os.path.basename(a) for a in _without(args, '--project') if not a.startswith('--')]
+    if not names:
+        print(f"Usage: {PROG} project purge [--dry-run] [--project DIR] NAME...")
+        return 2
+    project = PBXProject.load(os.path.join(project_dir, PBXPROJ_NAME))
+    refs = ReferenceIndex(project)
+    found = [name for name in names if refs.find_file_refs(name)]
+    for name in sorted(set(names) - set(found)):
+        print(f"No reference to {name}")
+    comments = {object_id: project.comment_for(object_id) for object_id in project.objects}
+    removed = refs.purge(found)
+    for object_id in removed:
+        print(f"  - {object_id} /* {comments[object_id]} */")
+    print(f"{len(removed)} object(s) for {len(found)} file name(s).")
+    if removed and '--dry-run' not in args and project.save():
+        print("Project file updated.")
+    return 0
+
+
+# Entry point
+
+def _profiled(label, function, argv, trace_path):
+    import json
+    import resource
+    import time
+
+    from .disk_index import CACHE_DIR
+    from .profiling import Profiler
+
+    start = time.perf_counter()
+    profiler = Profiler()
+    profiler.install()
+    installed = time.perf_counter()
+    try:
+        code = function(argv)
+    finally:
+        wall = time.perf_counter() - installed
+        trace = profiler.trace(wall)
+        profiler.uninstall()
+        trace.update({
+            'command': label,
+            'argv': argv,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'instrument s': round(installed - start, 6),
+            'peak rss MB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+        trace_path = trace_path or os.path.join(CACHE_DIR, f"profile-{label.replace(' ', '-')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+        with open(trace_path, 'w') as f:
+            json.dump(trace, f, indent=1)
+        phases = ', '.join(f"{name} {entry['seconds'] * 1000:.1f} ms/{entry['calls']}"
+                           for name, entry in trace['phases'].items())
+        print(f"profile: {wall * 1000:.1f} ms ({phases}); trace in {trace_path}", file=sys.stderr)
+    return code
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    profile = False
+    trace_path = None
+    while args and args[0].startswith('-') and args[0] not in ('-h', '--help'):
+        flag = args.pop(0)
+        if flag == '--profile':
+            profile = True
+        elif flag == '--trace' and args:
+            profile = True
+            trace_path = args.pop(0)
+        elif flag == '-C' and args:
+            os.chdir(args.pop(0))
+        else:
+            print(f"Unknown option {flag}")
+            return 2
+    path, entry, rest = resolve(args)
+    if isinstance(entry, dict):
+        for line in _usage(entry, ' '.join(path)):
+            print(line)
+        asked = not rest or rest[0] in ('-h', '--help')
+        if not asked:
+            print(f"\nUnknown command: {' '.join(path + rest[:1])}")
+        return 0 if asked else 2
+    target, arguments, summary = entry
+    if rest[:1] in (['-h'], ['--help']):
+        print(f"Usage: {PROG} {' '.join(path)} {arguments}")
+        print(f"\n{summary}.")
+        return 0
+    function = load(target)
+    if profile:
+        return _profiled(' '.join(path), function, rest, trace_path)
+    return function(rest)
@@ -0,0 +1,48 @@
+"""
+common.py
+
+Helpers shared by the knowmaps_tools commands: versioned JSON caches under
+.knowmaps-cache/ and the `--flag value` lookup every `main(argv)` uses.
+
+A JSON cache is one object {"version": N, <section>: {...}}. Loading a cache
+that is missing, unreadable or written by another version gives an empty
+section, so bumping a module's CACHE_VERSION is enough to invalidate it.
+Saving goes through a temp file and a rename, so readers never see a
+partial cache.
+
+Usage:
+    entries = load_json_cache(CACHE_PATH, CACHE_VERSION, 'files')
+    save_json_cache(CACHE_PATH, CACHE_VERSION, 'files', entries)
+    limit = int(option(args, '--limit', 20))
+"""
+
+import json
+import os
+
+
+def load_json_cache(path, version, section):
+    """The `section` of the cache at `path`, or {} if it is missing, unreadable or of another version."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data.get(section, {}) if data.get('version') == version else {}
+
+
+def save_json_cache(path, version, section, entries, **dump_options):
+    """Replaces the cache at `path`; `dump_options` go to json.dump."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version, section: entries}, f, **dump_options)
+    os.replace(tmp_path, path)
+
+
+def option(args, flag, default=None):
+    """The value following `flag` in `args`, or `default` if the flag or its value is missing."""
+    if flag in args:
+        index = args.index(flag)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return default
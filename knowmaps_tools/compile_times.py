@@ -0,0 +1,271 @@
+"""
+compile_times.py
+
+Per-file, per-function and per-expression Swift compile-time profiler.
+
+Reads xcodebuild transcripts captured with the type-checker timing flags and
+the build timing summary, aggregates the timings of each run into
+.knowmaps-cache/compile-times.sqlite, and prints ranked hotspot tables and
+the history of the slowest files across runs. Timings are keyed by the path
+relative to the source root, so runs from different checkouts line up.
+
+Capture a transcript next to the other build_*.txt logs with:
+
+    xcodebuild -project "Know-Maps/Know Maps.xcodeproj" -scheme "Know Maps" \\
+        -destination "platform=iOS Simulator,name=iPhone 17" -showBuildTimingSummary \\
+        OTHER_SWIFT_FLAGS='$(inherited) -Xfrontend -debug-time-function-bodies
+                           -Xfrontend -debug-time-expression-type-checking' \\
+        build > build_timing.txt 2>&1
+
+Usage:
+    python -m knowmaps_tools.compile_times [ingest] [logs...]
+    python -m knowmaps_tools.compile_times files|functions|expressions [--limit N] [--run LOG]
+    python -m knowmaps_tools.compile_times summary [--run LOG]
+    python -m knowmaps_tools.compile_times trend [--limit N]
+"""
+
+import os
+import re
+import sys
+
+from .build_logs import _sha1, connect, default_logs, find_by_name, source_key
+from .common import option
+from .disk_index import CACHE_DIR
+
+DB_PATH = os.path.join(CACHE_DIR, 'compile-times.sqlite')
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    total_seconds REAL,
+    timed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL,
+    samples INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_run ON timings (run_id, kind, file);
+CREATE TABLE IF NOT EXISTS task_summary (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    task TEXT NOT NULL,
+    tasks INTEGER NOT NULL,
+    seconds REAL NOT NULL
+);
+"""
+
+# `12.34ms\t/path/File.swift:45:10\tinstance method foo(bar:)` for function
+# bodies; expressions have no trailing name.
+_TIMING_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)ms\t([^\t]+):(\d+):(\d+)(?:\t(.*))?$')
+_SUMMARY_RE = re.compile(r'^(\S.*?) \((\d+) tasks?\) \| (\d+(?:\.\d+)?) seconds?$')
+_RESULT_RE = re.compile(r'^\*\* BUILD \w+ \*\* \[(\d+(?:\.\d+)?) sec\]')
+
+
+def parse_log(lines):
+    """
+    Aggregates one transcript. Returns (timings, summary, total_seconds), where
+    timings maps (kind, file, line, col, name) to [total_ms, max_ms, samples].
+    """
+    timings = {}
+    summary = []
+    total_seconds = None
+    for line in lines:
+        if not line:
+            continue
+        first = line[0]
+        if first.isdigit() or first == ' ':
+            m = _TIMING_RE.match(line)
+            if m is None:
+                continue
+            ms, path, line_no, column, name = m.groups()
+            kind = 'function' if name is not None else 'expression'
+            key = (kind, source_key(path), int(line_no), int(column), name or '')
+            ms = float(ms)
+            entry = timings.get(key)
+            if entry is None:
+                timings[key] = [ms, ms, 1]
+            else:
+                entry[0] += ms
+                entry[1] = max(entry[1], ms)
+                entry[2] += 1
+        elif first == '*':
+            m = _RESULT_RE.match(line)
+            if m is not None:
+                total_seconds = float(m.group(1))
+        elif ' | ' in line:
+            m = _SUMMARY_RE.match(line)
+            if m is not None:
+                summary.append((m.group(1), int(m.group(2)), float(m.group(3))))
+    return timings, summary, total_seconds
+
+
+def _lines(path):
+    with open(path, 'rb') as f:
+        for raw in f:
+            yield raw.decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+class CompileTimeStore:
+    """SQLite history of compile-time runs."""
+
+    def __init__(self, path=DB_PATH):
+        self.db = connect(path, SCHEMA, SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def ingest(self, path):
+        """
+        Records one transcript as a run. Returns 'unchanged', 'empty' (no timing
+        output in the log) or 'ingested'.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute("SELECT id, size, mtime_ns FROM runs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1:] == (st.st_size, st.st_mtime_ns):
+            return 'unchanged'
+        timings, summary, total_seconds = parse_log(_lines(path))
+        with self.db:
+            if row is not None:
+                self.db.execute("DELETE FROM runs WHERE id = ?", (row[0],))
+            # Logs without timing output are recorded too, so they are not re-read next time.
+            timed = bool(timings or summary)
+            run_id = self.db.execute(
+                "INSERT INTO runs (name, path, sha1, size, mtime_ns, total_seconds, timed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.basename(path), path, _sha1(path), st.st_size, st.st_mtime_ns, total_seconds,
+                 int(timed))).lastrowid
+            if not timed:
+                return 'empty'
+            self.db.executemany("INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(run_id,) + key + tuple(value) for key, value in timings.items()])
+            self.db.executemany("INSERT INTO task_summary VALUES (?, ?, ?, ?)",
+                                [(run_id,) + entry for entry in summary])
+        return 'ingested'
+
+    def run_id(self, name):
+        run_id = find_by_name(self.db, 'runs', name)
+        if run_id is None:
+            raise KeyError(f"No ingested run named {name!r}")
+        return run_id
+
+    def _scope(self, run):
+        """WHERE fragment and parameters restricting to one run, or all runs."""
+        if run is None:
+            return "1", ()
+        return "t.run_id = ?", (self.run_id(run),)
+
+    def file_hotspots(self, run=None, limit=20):
+        """(file, total ms, functions, runs) ranked by type-checking time per run."""
+        where, params = self._scope(run)
+        return self.db.execute(f"""
+            SELECT file, SUM(total_ms) / COUNT(DISTINCT run_id), COUNT(DISTINCT line || ':' || col),
+                   COUNT(DISTINCT run_id)
+            FROM timings t WHERE {where} AND kind = 'function'
+            GROUP BY file ORDER BY 2 DESC LIMIT ?""", params + (limit,)).fetchall()
+
+    def hotspots(self, kind, run=None, limit=20):
+        """(file, line, col, name, mean ms per run, max ms, runs) for one kind."""
+        where, params = self._scope(run)
+        return self.db.execute(f"""
+            SELECT file, line, col, name, SUM(total_ms) / COUNT(DISTINCT run_id), MAX(max_ms),
+                   COUNT(DISTINCT run_id)
+            FROM timings t WHERE {where} AND kind = ?
+            GROUP BY file, line, col, name ORDER BY 5 DESC LIMIT ?""", params + (kind, limit)).fetchall()
+
+    def task_summary(self, run=None):
+        where, params = self._scope(run)
+        return self.db.execute(f"""
+            SELECT task, SUM(tasks) * 1.0 / COUNT(DISTINCT run_id), SUM(seconds) / COUNT(DISTINCT run_id)
+            FROM task_summary t WHERE {where} GROUP BY task ORDER BY 3 DESC""", params).fetchall()
+
+    def runs(self):
+        """(id, name, total seconds) of the runs with timing data, oldest first."""
+        return self.db.execute(
+            "SELECT id, name, total_seconds FROM runs WHERE timed ORDER BY mtime_ns, name").fetchall()
+
+    def trend(self, limit=10):
+        """
+        Returns (run names, [(file, [ms per run or None])]) for the files that
+        are slowest on average, in run order.
+        """
+        runs = self.runs()
+        files = [row[0] for row in self.file_hotspots(limit=limit)]
+        history = {file: [None] * len(runs) for file in files}
+        position = {run_id: i for i, (run_id, _, _) in enumerate(runs)}
+        if files:
+            marks = ", ".join("?" * len(files))
+            for run_id, file, ms in self.db.execute(
+                    f"SELECT run_id, file, SUM(total_ms) FROM timings "
+                    f"WHERE kind = 'function' AND file IN ({marks}) GROUP BY run_id, file", files):
+                history[file][position[run_id]] = ms
+        return [name for _, name, _ in runs], [(file, history[file]) for file in files]
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    limit = int(option(args, '--limit', 20))
+    run = option(args, '--run')
+    options = {'--limit', '--run'}
+    positional = [a for i, a in enumerate(args) if not a.startswith('--') and (i == 0 or args[i - 1] not in options)]
+    commands = ('ingest', 'files', 'functions', 'expressions', 'summary', 'trend')
+    command = positional.pop(0) if positional and positional[0] in commands else 'ingest'
+
+    with CompileTimeStore() as store:
+        if command == 'ingest':
+            counts = {}
+            paths = positional or default_logs()
+            for path in paths:
+                status = store.ingest(path)
+                counts[status] = counts.get(status, 0) + 1
+            detail = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+            print(f"{len(paths)} log(s): {detail or 'none'}; {len(store.runs())} run(s) with timing data.")
+            return 0
+        try:
+            if command == 'files':
+                print(f"{'ms/run':>10} {'funcs':>6} {'runs':>5}  file")
+                for file, ms, functions, runs in store.file_hotspots(run, limit):
+                    print(f"{ms:10.1f} {functions:6} {runs:5}  {file}")
+            elif command in ('functions', 'expressions'):
+                print(f"{'ms/run':>10} {'max':>9} {'runs':>5}  location")
+                for file, line, column, name, ms, max_ms, runs in store.hotspots(command[:-1], run, limit):
+                    label = f"  {name}" if name else ""
+                    print(f"{ms:10.1f} {max_ms:9.1f} {runs:5}  {file}:{line}:{column}{label}")
+            elif command == 'summary':
+                for task, tasks, seconds in store.task_summary(run):
+                    print(f"{seconds:10.3f}s {tasks:6.1f} task(s)  {task}")
+            else:
+                names, rows = store.trend(limit)
+                if not names:
+                    print("No runs with timing data; capture one with -debug-time-function-bodies.")
+                    return 0
+                print("runs: " + ", ".join(f"[{i}] {name}" for i, name in enumerate(names)))
+                for file, history in rows:
+                    cells = " ".join("      -" if ms is None else f"{ms:7.0f}" for ms in history)
+                    print(f"{cells}  {file}")
+        except KeyError as e:
+            print(e.args[0])
+            return 1
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
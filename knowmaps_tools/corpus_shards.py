@@ -0,0 +1,420 @@
+"""
+corpus_shards.py
+
+Sharded, memory-mappable export of the tagger and classifier corpora with
+deterministic, label-stratified train/validation/test splits.
+
+A dataset is a directory of flat NumPy columns plus a manifest:
+
+    manifest.json               source, kind, label names, split ratios,
+                                per-split label counts and the shard list;
+                                written last, so a dataset without it is
+                                incomplete
+    <split>-<n>.lines.npy       int64 source line of each example
+    tagger shards:
+    <split>-<n>.tokens.npy      int32 token ids of all examples, concatenated
+    <split>-<n>.offsets.npy     int64 example boundaries (count + 1)
+    <split>-<n>.tags.npy        int32 tag id of each token
+    <split>-<n>.vocab.npy       uint8 UTF-8 token strings of the shard's ids
+    <split>-<n>.vocab_offsets.npy
+    classifier shards:
+    <split>-<n>.text.npy        uint8 UTF-8 texts, concatenated
+    <split>-<n>.offsets.npy     int64 text boundaries (count + 1)
+    <split>-<n>.labels.npy      int32 label id of each example
+
+The source is read once, as a stream (see training_data.py). Each example
+is stratified by its label (for the tagger, the set of tags other than NONE
+it uses) and goes to the split furthest below its share of that stratum,
+so splits are exact per stratum and the same input always splits the same
+way. Examples with the same normalized text always go to the same split, so
+duplicates cannot leak across splits. Records with schema or label errors,
+and unlabeled records, are skipped and counted. Finished batches are
+encoded and written by a process pool while reading continues.
+
+Opening a dataset reads only the manifest; columns are memory-mapped when a
+shard is first touched. Splits can be exported back to Create ML JSON or
+CSV.
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.corpus_shards export SOURCE DATASET_DIR [--ratios 0.8,0.1,0.1]
+    python -m knowmaps_tools.corpus_shards info DATASET_DIR
+    python -m knowmaps_tools.corpus_shards createml DATASET_DIR SPLIT OUTPUT
+    python -m knowmaps_tools.corpus_shards bench [--size 1000000]
+"""
+
+import csv
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .common import option
+from .edit_buffer import atomic_write
+from .training_data import (ERRORS, QUERY_LABELS, SECTION_LABELS, TAGGER_LABELS, check_record, corpus_schema,
+                            iter_csv, iter_json_array, normalize)
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+SPLITS = ('train', 'validation', 'test')
+RATIOS = (0.8, 0.1, 0.1)
+SHARD_SIZE = 1 << 18
+KNOWN_LABELS = {'tagger': TAGGER_LABELS, 'query': QUERY_LABELS, 'section': SECTION_LABELS}
+
+
+# Splitting
+
+class StratifiedSplitter:
+    """Streaming, deterministic assignment of examples to splits, exact per stratum."""
+
+    def __init__(self, ratios=RATIOS, splits=SPLITS):
+        if len(ratios) != len(splits) or abs(sum(ratios) - 1) > 1e-9 or min(ratios) < 0:
+            raise ValueError(f"Split ratios {ratios} must be {len(splits)} non-negative shares summing to 1")
+        self.ratios = ratios
+        self.splits = splits
+        self.counts = {}
+        self._assigned = {}
+
+    def assign(self, stratum, text):
+        """Index of the split for an example, reusing the split of an identical text."""
+        key = hashlib.blake2b(normalize(text).encode('utf-8'), digest_size=8).digest()
+        split = self._assigned.get(key)
+        counts = self.counts.setdefault(stratum, [0] * len(self.splits))
+        if split is None:
+            total = sum(counts) + 1
+            # The split furthest below its share; ties go to the earlier split.
+            split = max(range(len(self.splits)), key=lambda i: (self.ratios[i] * total - counts[i], -i))
+            self._assigned[key] = split
+        counts[split] += 1
+        return split
+
+
+def stratum(kind, label):
+    if kind == 'tagger':
+        return '+'.join(sorted(set(label) - {'NONE'})) or 'NONE'
+    return label
+
+
+# Shard writing (runs in worker processes)
+
+def _strings_column(strings):
+    import numpy as np
+
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _write_shard(root, name, kind, labels, examples):
+    """Writes one shard from [(line, text or tokens, label)]. Returns (name, count)."""
+    import numpy as np
+
+    label_ids = {label: i for i, label in enumerate(labels)}
+    columns = {'lines': np.fromiter((e[0] for e in examples), dtype=np.int64, count=len(examples))}
+    if kind == 'tagger':
+        vocab = {}
+        tokens = [vocab.setdefault(token, len(vocab)) for _, words, _ in examples for token in words]
+        columns['tokens'] = np.asarray(tokens, dtype=np.int32)
+        columns['tags'] = np.asarray([label_ids[tag] for _, _, tags in examples for tag in tags], dtype=np.int32)
+        columns['offsets'] = np.zeros(len(examples) + 1, dtype=np.int64)
+        columns['offsets'][1:] = np.cumsum([len(words) for _, words, _ in examples])
+        columns['vocab'], columns['vocab_offsets'] = _strings_column(vocab)
+    else:
+        columns['text'], columns['offsets'] = _strings_column([text for _, text, _ in examples])
+        columns['labels'] = np.asarray([label_ids[label] for _, _, label in examples], dtype=np.int32)
+    for column, values in columns.items():
+        np.save(os.path.join(root, f'{name}.{column}.npy'), values)
+    return name, len(examples)
+
+
+# Export
+
+def export(source, root, ratios=RATIOS, shard_size=SHARD_SIZE, workers=None):
+    """Converts a corpus file into a sharded dataset at `root`, replacing any dataset there. Returns the manifest."""
+    kind, _ = corpus_schema(source)
+    labels = sorted(KNOWN_LABELS[kind])
+    splitter = StratifiedSplitter(ratios)
+    root = os.path.abspath(root)
+    os.makedirs(os.path.dirname(root), exist_ok=True)
+    # Shards are written next to `root` and only moved in once the whole export succeeded.
+    staging = tempfile.mkdtemp(dir=os.path.dirname(root), prefix='.' + os.path.basename(root) + '.')
+    try:
+        manifest = _export(source, staging, kind, labels, splitter, ratios, shard_size, workers)
+        _replace_dataset(staging, root)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return manifest
+
+
+def _export(source, root, kind, labels, splitter, ratios, shard_size, workers):
+    pending = {split: [] for split in SPLITS}
+    shard_numbers = {split: 0 for split in SPLITS}
+    shards, futures, skipped = [], [], 0
+
+    def submit(pool, split):
+        name = f'{split}-{shard_numbers[split]:05d}'
+        shard_numbers[split] += 1
+        shards.append({'name': name, 'split': split})
+        args = (root, name, kind, labels, pending[split])
+        futures.append(pool.submit(_write_shard, *args) if pool else _write_shard(*args))
+        pending[split] = []
+
+    reader = iter_csv if kind == 'section' else iter_json_array
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        for line, record, error in reader(source):
+            if error is not None:
+                skipped += 1
+                continue
+            text, label, problems = check_record(kind, record, KNOWN_LABELS[kind])
+            if text is None or any(p in ERRORS or p == 'unlabeled' for p, _ in problems):
+                skipped += 1
+                continue
+            split = SPLITS[splitter.assign(stratum(kind, label), text)]
+            value = record['tokens'] if kind == 'tagger' else text
+            pending[split].append((line, value, label))
+            if len(pending[split]) == shard_size:
+                submit(pool, split)
+        for split in SPLITS:
+            if pending[split]:
+                submit(pool, split)
+        counts = dict(f.result() if pool else f for f in futures)
+    finally:
+        if pool:
+            pool.shutdown()
+    for shard in shards:
+        shard['count'] = counts[shard['name']]
+    manifest = {
+        'version': VERSION,
+        'source': os.path.basename(source),
+        'source_sha1': _sha1(source),
+        'kind': kind,
+        'labels': labels,
+        'splits': dict(zip(SPLITS, ratios)),
+        'strata': {s: dict(zip(SPLITS, c)) for s, c in sorted(splitter.counts.items())},
+        'skipped': skipped,
+        'shards': shards,
+    }
+    atomic_write(os.path.join(root, MANIFEST), (json.dumps(manifest, indent=2).encode('utf-8'),))
+    return manifest
+
+
+def _replace_dataset(staging, root):
+    os.makedirs(root, exist_ok=True)
+    manifest_path = os.path.join(root, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.unlink(manifest_path)
+    # Shards of an earlier, larger export would otherwise be left behind.
+    for name in os.listdir(root):
+        if name.endswith('.npy') and name.split('-', 1)[0] in SPLITS:
+            os.unlink(os.path.join(root, name))
+    for name in os.listdir(staging):
+        if name != MANIFEST:
+            os.replace(os.path.join(staging, name), os.path.join(root, name))
+    os.replace(os.path.join(staging, MANIFEST), manifest_path)
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Reading
+
+class Shard:
+    """One shard's columns, memory-mapped on first use."""
+
+    def __init__(self, root, name, kind, count):
+        self.root, self.name, self.kind, self.count = root, name, kind, count
+        self._columns = {}
+        self._vocab = None
+
+    def column(self, column):
+        array = self._columns.get(column)
+        if array is None:
+            import numpy as np
+
+            array = np.load(os.path.join(self.root, f'{self.name}.{column}.npy'), mmap_mode='r')
+            self._columns[column] = array
+        return array
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, data, offsets, i):
+        return bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def vocab(self):
+        if self._vocab is None:
+            data, offsets = self.column('vocab'), self.column('vocab_offsets')
+            self._vocab = [self._string(data, offsets, i) for i in range(len(offsets) - 1)]
+        return self._vocab
+
+    def example(self, i, labels):
+        """(line, text or tokens, label or tags) of the shard's i-th example."""
+        offsets = self.column('offsets')
+        line = int(self.column('lines')[i])
+        if self.kind == 'tagger':
+            start, end = offsets[i], offsets[i + 1]
+            data, vocab_offsets = self.column('vocab'), self.column('vocab_offsets')
+            tokens = [self._string(data, vocab_offsets, t) for t in self.column('tokens')[start:end].tolist()]
+            return line, tokens, [labels[t] for t in self.column('tags')[start:end].tolist()]
+        return line, self._string(self.column('text'), offsets, i), labels[self.column('labels')[i]]
+
+
+class ShardedCorpus:
+    """A dataset written by `export`; opening it reads only the manifest."""
+
+    def __init__(self, root):
+        try:
+            with open(os.path.join(root, MANIFEST), 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{root} has no {MANIFEST}; the export did not finish") from None
+        if self.manifest.get('version') != VERSION:
+            raise ValueError(f"{root} is not a version {VERSION} dataset")
+        self.root = root
+        self.kind = self.manifest['kind']
+        self.labels = self.manifest['labels']
+        self.shards = [Shard(root, s['name'], self.kind, s['count']) for s in self.manifest['shards']]
+
+    def split(self, split):
+        return [shard for shard in self.shards if shard.name.startswith(split + '-')]
+
+    def count(self, split=None):
+        return sum(len(s) for s in (self.shards if split is None else self.split(split)))
+
+    def examples(self, split):
+        """Yields (line, text or tokens, label or tags) for every example of a split, in source order per shard."""
+        for shard in self.split(split):
+            for i in range(len(shard)):
+                yield shard.example(i, self.labels)
+
+
+def export_createml(corpus, split, path):
+    """Writes one split as Create ML training data: JSON for text/word taggers, CSV for sections."""
+    if corpus.kind == 'section':
+        def rows():
+            yield 'text,label\r\n'
+            for _, text, label in corpus.examples(split):
+                yield _csv_row(text, label)
+        chunks = rows()
+    else:
+        def records():
+            yield '[\n'
+            first = True
+            for _, value, label in corpus.examples(split):
+                record = {'tokens': value, 'labels': label} if corpus.kind == 'tagger' else {'text': value, 'label': label}
+                yield ('' if first else ',\n') + '  ' + json.dumps(record, ensure_ascii=False)
+                first = False
+            yield '\n]\n'
+        chunks = records()
+    atomic_write(path, (chunk.encode('utf-8') for chunk in chunks))
+
+
+def _csv_row(text, label):
+    class _Line:
+        value = ''
+
+        def write(self, value):
+            self.value = value
+
+    out = _Line()
+    csv.writer(out, quoting=csv.QUOTE_ALL).writerow((text, label))
+    return out.value
+
+
+# Benchmarks
+
+def bench(size=1000000, seed=0):
+    """Returns {metric: value} for `size` synthetic tagger examples: JSON load vs dataset open and scan."""
+    import numpy as np
+
+    rng = random.Random(seed)
+    words = ['coffee', 'near', 'me', 'quiet', 'sushi', 'bar', 'open', 'late', 'with', 'wifi', 'in', 'Brooklyn']
+    tags = sorted(TAGGER_LABELS)
+    root = tempfile.mkdtemp(prefix='knowmaps-shards-')
+    results = {}
+    try:
+        source = os.path.join(root, 'WordTaggingClassifierTrainingData.json')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write('[\n')
+            for i in range(size):
+                length = rng.randint(4, 14)
+                record = {'tokens': rng.choices(words, k=length - 1) + [f'w{i}'], 'labels': rng.choices(tags, k=length)}
+                f.write(('' if i == 0 else ',\n') + json.dumps(record))
+            f.write('\n]\n')
+        results['source MB'] = os.path.getsize(source) / 1e6
+        start = time.perf_counter()
+        with open(source, 'r', encoding='utf-8') as f:
+            json.load(f)
+        results['json.load s'] = time.perf_counter() - start
+
+        dataset = os.path.join(root, 'dataset')
+        start = time.perf_counter()
+        export(source, dataset)
+        results['export s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        corpus = ShardedCorpus(dataset)
+        results['open ms'] = (time.perf_counter() - start) * 1e3
+        none_id = corpus.labels.index('NONE')
+        start = time.perf_counter()
+        tokens = tagged = 0
+        for shard in corpus.shards:
+            tags = shard.column('tags')
+            tokens += len(tags)
+            tagged += int(np.count_nonzero(tags != none_id))
+        results['tag scan ms'] = (time.perf_counter() - start) * 1e3
+        results['tokens'] = tokens
+        results['tagged tokens'] = tagged
+        start = time.perf_counter()
+        corpus.shards[-1].example(len(corpus.shards[-1]) - 1, corpus.labels)
+        results['random example ms'] = (time.perf_counter() - start) * 1e3
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    command = args[0] if args else ''
+    if command == 'export' and len(args) >= 3:
+        ratios = tuple(float(r) for r in option(args, '--ratios', ','.join(map(str, RATIOS))).split(','))
+        manifest = export(args[1], args[2], ratios)
+        for name, counts in manifest['strata'].items():
+            print(f"  {name:24} " + ' '.join(f"{split} {count:>6}" for split, count in counts.items()))
+        print(f"{sum(s['count'] for s in manifest['shards'])} examples in {len(manifest['shards'])} shard(s), "
+              f"{manifest['skipped']} skipped")
+        return 0
+    if command == 'info' and len(args) == 2:
+        corpus = ShardedCorpus(args[1])
+        print(f"{corpus.manifest['source']} ({corpus.kind}), labels {', '.join(corpus.labels)}")
+        for split in SPLITS:
+            print(f"  {split:10} {corpus.count(split):>9} examples in {len(corpus.split(split))} shard(s)")
+        return 0
+    if command == 'createml' and len(args) == 4:
+        corpus = ShardedCorpus(args[1])
+        export_createml(corpus, args[2], args[3])
+        print(f"Wrote {corpus.count(args[2])} {args[2]} examples to {args[3]}")
+        return 0
+    if command == 'bench':
+        results = bench(int(option(args, '--size', 1000000)))
+        print(", ".join(f"{name} {value:,.1f}" for name, value in results.items()))
+        return 0
+    print("Usage: python -m knowmaps_tools.corpus_shards export|info|createml|bench ...")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+disk_index.py
+
+A reusable index of the source tree for project/disk reconciliation.
+
+The tree is read with one `os.scandir` pass and every file is recorded with its
+(mtime, size, inode). The listing is persisted under .knowmaps-cache/ and later
+runs stat each directory once: directories whose mtime is unchanged reuse their
+cached listing, and only changed directories are scanned again. Because a
+directory's mtime only moves when entries are added, removed or renamed, the
+cached file stats of an unchanged directory can lag behind in-place edits;
+call `refresh(path)` when exact stats for a file matter.
+
+Usage:
+    index = DiskIndex.build("Know-Maps/Know Maps Prod")
+    index.paths("SearchView.swift")   # every copy on disk
+"""
+
+import hashlib
+import json
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(REPO_ROOT, '.knowmaps-cache')
+CACHE_VERSION = 1
+
+
+def default_cache_path(root):
+    key = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"disk-{key}.json")
+
+
+class DiskIndex:
+    """Basename and path lookups over one directory tree."""
+
+    def __init__(self, root, dirs=None):
+        self.root = root
+        # relative dir -> [mtime_ns, [subdir names], {file name: [mtime_ns, size, inode]}]
+        self.dirs = dirs or {}
+        self.scanned = 0
+        self._by_name = None
+
+    @classmethod
+    def build(cls, root, cache_path=None, use_cache=True):
+        """Loads the cached listing for `root`, brings it up to date and saves it."""
+        cache_path = cache_path or default_cache_path(root)
+        index = cls(root, cls._load(cache_path, root) if use_cache else None)
+        index.update()
+        if use_cache:
+            index.save(cache_path)
+        return index
+
+    @staticmethod
+    def _load(cache_path, root):
+        try:
+            with open(cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != CACHE_VERSION or data.get('root') != os.path.abspath(root):
+            return None
+        return data['dirs']
+
+    def save(self, cache_path=None):
+        cache_path = cache_path or default_cache_path(self.root)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'root': os.path.abspath(self.root), 'dirs': self.dirs}, f)
+        os.replace(tmp_path, cache_path)
+
+    def _scan_dir(self, rel, mtime_ns):
+        subdirs = []
+        files = {}
+        with os.scandir(os.path.join(self.root, rel) if rel else self.root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    files[entry.name] = [st.st_mtime_ns, st.st_size, st.st_ino]
+        subdirs.sort()
+        self.scanned += 1
+        return [mtime_ns, subdirs, files]
+
+    def update(self):
+        """Re-scans only the directories whose mtime changed since the last run."""
+        previous = self.dirs
+        current = {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                mtime_ns = os.stat(os.path.join(self.root, rel) if rel else self.root).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = previous.get(rel)
+            if cached is None or cached[0] != mtime_ns:
+                cached = self._scan_dir(rel, mtime_ns)
+            current[rel] = cached
+            stack.extend(os.path.join(rel, name) if rel else name for name in cached[1])
+        self.dirs = current
+        self._by_name = None
+        return self
+
+    def refresh(self, path):
+        """Re-stats a single file and returns its (mtime_ns, size, inode)."""
+        rel_dir, name = os.path.split(os.path.relpath(path, self.root))
+        st = os.stat(path)
+        entry = [st.st_mtime_ns, st.st_size, st.st_ino]
+        if rel_dir in self.dirs:
+            self.dirs[rel_dir][2][name] = entry
+            self._by_name = None
+        return tuple(entry)
+
+    # Lookup
+
+    def _names(self):
+        if self._by_name is None:
+            by_name = {}
+            for rel, (_, _, files) in self.dirs.items():
+                base = os.path.join(self.root, rel) if rel else self.root
+                for name in files:
+                    by_name.setdefault(name, []).append(os.path.join(base, name))
+            for paths in by_name.values():
+                paths.sort()
+            self._by_name = by_name
+        return self._by_name
+
+    def paths(self, basename):
+        """Every path on disk with this basename, duplicates included."""
+        return self._names().get(basename, [])
+
+    def find(self, basename):
+        paths = self.paths(basename)
+        return paths[0] if paths else None
+
+    def __contains__(self, basename):
+        return basename in self._names()
+
+    def basenames(self):
+        return self._names().keys()
+
+    def duplicates(self):
+        return {name: paths for name, paths in self._names().items() if len(paths) > 1}
+
+    def stat(self, path):
+        rel_dir, name = os.path.split(os.path.relpath(path, self.root))
+        listing = self.dirs.get('' if rel_dir == '.' else rel_dir)
+        entry = listing[2].get(name) if listing else None
+        return tuple(entry) if entry else None
+
+    def files(self, suffixes=None):
+        """Yields every file path, optionally filtered by suffix, in sorted order."""
+        for rel in sorted(self.dirs):
+            base = os.path.join(self.root, rel) if rel else self.root
+            for name in sorted(self.dirs[rel][2]):
+                if suffixes is None or name.endswith(suffixes):
+                    yield os.path.join(base, name)
+
+    def directories(self):
+        return [os.path.join(self.root, rel) if rel else self.root for rel in sorted(self.dirs)]
@@ -0,0 +1,339 @@
+"""
+duplicates.py
+
+Content-addressed duplicate-file detector for the Finder-style copies
+("SearchView 2.swift", "project 2.yml", "check_braces 2.py") in the tree.
+
+Files are narrowed down in three stages so that most are never read in
+full: only files sharing a size are candidates, only those that also share
+a partial hash (the first and last 4 KB) are hashed in full, and full
+hashes are cached under .knowmaps-cache/ by (mtime, size, inode). Hashing
+runs on a thread pool. Files with the same full hash are exact duplicates.
+
+Copies that are not byte-identical are compared by content: comments are
+dropped, the rest is tokenized, and token trigram sets are compared by
+Jaccard similarity, alongside a count of changed lines. Every Finder copy
+is paired with its original; other look-alike Swift files are found through
+MinHash/LSH (see training_data.py) and reported above a threshold. Empty
+copies are listed separately.
+
+Every file is matched against project.pbxproj by its full path, not just
+its basename, so the report shows which copy the project references and
+which one a Sources phase compiles. Byte-identical Finder copies that the
+project does not reference are marked as safe to delete.
+
+Usage:
+    python -m knowmaps_tools.duplicates [roots...] [--threshold 0.8] [--json] [--no-cache]
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import load_json_cache, option, save_json_cache
+from .disk_index import CACHE_DIR
+from .pbxproj import PBXProject
+from .sync import BUNDLE_SUFFIXES, PBXPROJ_NAME, PROJECT_DIR, resolve_paths
+
+CACHE_PATH = os.path.join(CACHE_DIR, 'file-hashes.json')
+CACHE_VERSION = 1
+PARTIAL_BYTES = 4096
+SKIP_DIRS = ('.git', '.knowmaps-cache', 'DerivedData', 'build', 'xcuserdata', '__pycache__')
+SKIP_FILES = ('.DS_Store',)
+THRESHOLD = 0.8
+_COPY_RE = re.compile(r'^(?P<stem>.+) (?P<number>\d+)(?P<ext>\.[^. ]+)?$')
+_SWIFT_TOKEN_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:[^"\\\n]|\\.)*"|[A-Za-z_]\w*|\d[\w.]*|\S', re.DOTALL)
+
+
+def finder_original(path):
+    """The path a Finder copy ("Name 2.ext") was made from, or None."""
+    directory, name = os.path.split(path)
+    match = _COPY_RE.match(name)
+    if match is None:
+        return None
+    return os.path.join(directory, match['stem'] + (match['ext'] or ''))
+
+
+def scan(roots):
+    """{path: (mtime_ns, size, inode)} for every regular file under `roots`."""
+    files = {}
+    for root in roots:
+        for directory, dirs, names in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.endswith(BUNDLE_SUFFIXES))
+            for name in names:
+                if name in SKIP_FILES:
+                    continue
+                path = os.path.normpath(os.path.join(directory, name))
+                st = os.stat(path, follow_symlinks=False)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    files[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return files
+
+
+def _partial_hash(path, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_BYTES))
+        if size > 2 * PARTIAL_BYTES:
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+        digest.update(f.read(PARTIAL_BYTES))
+    return digest.hexdigest()
+
+
+def _full_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_cache():
+    return load_json_cache(CACHE_PATH, CACHE_VERSION, 'files')
+
+
+def _save_cache(cache):
+    save_json_cache(CACHE_PATH, CACHE_VERSION, 'files', cache)
+
+
+def _groups(items):
+    groups = {}
+    for key, path in items:
+        groups.setdefault(key, []).append(path)
+    return [sorted(paths) for paths in groups.values() if len(paths) > 1]
+
+
+def exact_duplicates(files, use_cache=True, workers=None):
+    """
+    Groups of byte-identical, non-empty paths from a `scan` result. Returns
+    (groups, stats), where stats counts the files that went through each stage.
+    """
+    cache = _load_cache() if use_cache else {}
+    stats = {'files': len(files), 'same size': 0, 'partial hashed': 0, 'full hashed': 0, 'cached': 0}
+    by_size = _groups((stat[1], path) for path, stat in files.items() if stat[1])
+    candidates = [path for group in by_size for path in group]
+    stats['same size'] = len(candidates)
+    full = {}
+    uncached = []
+    for path in candidates:
+        entry = cache.get(os.path.abspath(path))
+        if entry is not None and tuple(entry[:3]) == files[path]:
+            full[path] = entry[3]
+            stats['cached'] += 1
+        else:
+            uncached.append(path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        partial = dict(zip(uncached, pool.map(lambda p: _partial_hash(p, files[p][1]), uncached)))
+        stats['partial hashed'] = len(partial)
+        # Files sharing a partial hash, or a size with a cached file, are read in full.
+        keyed = _groups(((files[p][1], h), p) for p, h in partial.items())
+        cached_sizes = {files[p][1] for p in full}
+        pending = sorted({p for group in keyed for p in group}
+                         | {p for p in uncached if files[p][1] in cached_sizes})
+        for path, digest in zip(pending, pool.map(_full_hash, pending)):
+            full[path] = digest
+        stats['full hashed'] = len(pending)
+    for path, digest in full.items():
+        cache[os.path.abspath(path)] = list(files[path]) + [digest]
+    if use_cache:
+        live = {os.path.abspath(p) for p in files}
+        _save_cache({path: entry for path, entry in cache.items() if path in live})
+    groups = _groups(((files[p][1], digest), p) for p, digest in full.items())
+    groups.sort(key=lambda group: (-files[group[0]][1], group))
+    return groups, stats
+
+
+# Swift similarity
+
+def swift_tokens(text):
+    return [t for t in _SWIFT_TOKEN_RE.findall(text) if not t.startswith(('//', '/*'))]
+
+
+def _trigrams(tokens):
+    return {hash((tokens[i], tokens[i + 1], tokens[i + 2])) for i in range(len(tokens) - 2)} or {hash(tuple(tokens))}
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def similarity(a, b):
+    """Jaccard similarity of two token trigram sets."""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def line_changes(a_text, b_text):
+    """(lines added, lines removed) going from `a_text` to `b_text`."""
+    added = removed = 0
+    for line in difflib.unified_diff(a_text.splitlines(), b_text.splitlines(), lineterm='', n=0):
+        if line.startswith('+') and not line.startswith('+++'):
+            added += 1
+        elif line.startswith('-') and not line.startswith('---'):
+            removed += 1
+    return added, removed
+
+
+def similar_files(files, threshold=THRESHOLD, exclude=()):
+    """
+    [(score, a, b)] for every non-empty Finder copy with its original, plus
+    pairs of other Swift files scoring at least `threshold`. Pairs in
+    `exclude` (byte-identical ones) are left out.
+    """
+    from .training_data import LshIndex, MinHasher
+
+    pairs = set()
+    for path, stat in files.items():
+        original = finder_original(path)
+        if stat[1] and original in files and files[original][1]:
+            pairs.add((path, original))
+    paths = sorted(p for p, stat in files.items() if p.endswith('.swift') and stat[1])
+    needed = set(paths) | {p for pair in pairs for p in pair}
+    tokens = {p: swift_tokens(_read_text(p)) for p in sorted(needed)}
+    trigrams = {p: _trigrams(t) for p, t in tokens.items()}
+    if paths:
+        hasher = MinHasher()
+        lsh = LshIndex(hasher.num_perm)
+        signatures = hasher.signatures([' '.join(tokens[p]) for p in paths])
+        for i, keys in enumerate(lsh.band_keys(signatures).tolist()):
+            for j in lsh.candidates(keys):
+                pairs.add((paths[i], paths[j]))
+            lsh.add(i, keys)
+    excluded = {frozenset(pair) for pair in exclude}
+    results = []
+    for a, b in pairs:
+        if frozenset((a, b)) in excluded:
+            continue
+        score = similarity(trigrams[a], trigrams[b])
+        if score >= threshold or finder_original(a) == b:
+            results.append((round(score, 4), a, b))
+    results.sort(key=lambda r: (-r[0], r[1], r[2]))
+    return results
+
+
+# Project references
+
+def project_references(project_dir=PROJECT_DIR):
+    """({path: file reference ID} for every file in the project, {compiled paths})."""
+    project = PBXProject.load(os.path.join(project_dir, PBXPROJ_NAME))
+    paths = resolve_paths(project)
+    referenced = {}
+    for ref in project.iter_isa('PBXFileReference'):
+        if ref.id in paths:
+            referenced[os.path.normpath(os.path.join(project_dir, paths[ref.id]))] = ref.id
+    compiled = set()
+    by_id = {ref_id: path for path, ref_id in referenced.items()}
+    for phase in project.iter_isa('PBXSourcesBuildPhase'):
+        for build_id in phase.get('files', ()):
+            build = project.get(build_id)
+            path = by_id.get(build.get('fileRef')) if build is not None else None
+            if path is not None:
+                compiled.add(path)
+    return referenced, compiled
+
+
+def status(path, referenced, compiled):
+    if path in compiled:
+        return 'compiled'
+    if path in referenced:
+        return 'referenced'
+    return 'unreferenced'
+
+
+def report(roots=('.',), threshold=THRESHOLD, use_cache=True, project_dir=PROJECT_DIR):
+    """Everything the CLI prints, as plain data."""
+    files = scan(roots)
+    groups, stats = exact_duplicates(files, use_cache)
+    try:
+        referenced, compiled = project_references(project_dir)
+    except FileNotFoundError:
+        referenced, compiled = {}, set()
+    identical = [(a, b) for group in groups for i, a in enumerate(group) for b in group[i + 1:]]
+    exact = []
+    for group in groups:
+        members = []
+        for path in group:
+            state = status(path, referenced, compiled)
+            original = finder_original(path)
+            members.append({
+                'path': path,
+                'status': state,
+                'copy_of': original if original in group else None,
+                'safe_to_delete': state == 'unreferenced' and original in group,
+            })
+        exact.append({'size': files[group[0]][1], 'files': members})
+    similar = []
+    for score, a, b in similar_files(files, threshold, identical):
+        copy, original = (a, b) if finder_original(a) == b else (b, a) if finder_original(b) == a else (a, b)
+        added, removed = line_changes(_read_text(original), _read_text(copy))
+        similar.append({
+            'score': score,
+            'copy': copy,
+            'original': original,
+            'copy_status': status(copy, referenced, compiled),
+            'original_status': status(original, referenced, compiled),
+            'lines_added': added,
+            'lines_removed': removed,
+        })
+    copies = sorted(p for p in files if finder_original(p) is not None)
+    empty = []
+    for path in copies:
+        original = finder_original(path)
+        if not files[path][1] and original in files:
+            state = status(path, referenced, compiled)
+            empty.append({
+                'copy': path,
+                'original': original,
+                'copy_status': state,
+                'original_status': status(original, referenced, compiled),
+                'original_size': files[original][1],
+                'safe_to_delete': state == 'unreferenced' and not files[original][1],
+            })
+    orphan_copies = [p for p in copies if finder_original(p) not in files]
+    return {'stats': stats, 'exact': exact, 'similar': similar, 'empty': empty, 'orphan_copies': orphan_copies}
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    threshold = float(option(args, '--threshold', THRESHOLD))
+    roots = [a for i, a in enumerate(args) if not a.startswith('--') and (i == 0 or args[i - 1] != '--threshold')]
+    result = report(roots or ('.',), threshold, use_cache='--no-cache' not in args)
+    if '--json' in args:
+        print(json.dumps(result, indent=2))
+        return 0
+    reclaimable = 0
+    print(f"Exact duplicates ({len(result['exact'])} group(s)):")
+    for group in result['exact']:
+        print(f"  {group['size']:,} bytes")
+        for member in group['files']:
+            note = ', safe to delete' if member['safe_to_delete'] else ''
+            print(f"    {member['path']} [{member['status']}{note}]")
+            if member['safe_to_delete']:
+                reclaimable += group['size']
+    print(f"Diverged copies and similar Swift files ({len(result['similar'])} pair(s)):")
+    for pair in result['similar']:
+        print(f"  {pair['score']:.2f} {pair['copy']} [{pair['copy_status']}]")
+        print(f"       ~ {pair['original']} [{pair['original_status']}] "
+              f"(+{pair['lines_added']} -{pair['lines_removed']} lines)")
+    if result['empty']:
+        print(f"Empty copies ({len(result['empty'])}):")
+        for pair in result['empty']:
+            note = ', safe to delete' if pair['safe_to_delete'] else ''
+            print(f"  {pair['copy']} [{pair['copy_status']}{note}] of {os.path.basename(pair['original'])} "
+                  f"[{pair['original_status']}, {pair['original_size']:,} bytes]")
+    if result['orphan_copies']:
+        print(f"Copies without an original ({len(result['orphan_copies'])}):")
+        for path in result['orphan_copies']:
+            print(f"  {path}")
+    stats = result['stats']
+    print(f"{stats['files']} files: {stats['same size']} share a size, {stats['partial hashed']} partially hashed, "
+          f"{stats['full hashed']} fully hashed, {stats['cached']} from cache; {reclaimable:,} bytes safe to delete")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
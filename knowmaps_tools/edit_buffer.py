@@ -0,0 +1,167 @@
+"""
+edit_buffer.py
+
+Span-based edits over a memory-mapped file, written atomically.
+
+Edits are recorded as (byte offset, length, replacement) spans against the
+original file, which stays memory-mapped and is never copied. Committing
+streams the untouched slices and the replacements into a temporary file in
+the same directory, fsyncs it and renames it over the original, so Xcode
+never sees a half-written project. An empty edit set (or one made only of
+no-op replacements) skips the write entirely.
+
+Usage:
+    with EditBuffer(PBXPROJ_PATH) as buf:
+        buf.replace(offset, length, b"...")
+        buf.commit()
+"""
+
+import mmap
+import os
+
+
+class EditConflict(ValueError):
+    """Raised when two recorded edits overlap."""
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, chunks):
+    """Writes an iterable of byte chunks to `path` via temp file, fsync and rename."""
+    import tempfile  # only writers pay for it
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_dir(path)
+
+
+def write_if_changed(path, content, encoding='utf-8'):
+    """
+    Atomically replaces `path` with `content` unless the file already holds
+    exactly that. Returns True when the file was written.
+    """
+    data = content.encode(encoding) if isinstance(content, str) else content
+    try:
+        with EditBuffer(path) as original:
+            if len(original) == len(data):
+                with memoryview(original.data) as view:
+                    if view == data:
+                        return False
+    except FileNotFoundError:
+        pass
+    atomic_write(path, (data,))
+    return True
+
+
+class EditBuffer:
+    """Records span edits over a read-only mapping of `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.edits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self._file.close()
+
+    def __len__(self):
+        return len(self.data)
+
+    def replace(self, offset, length, replacement):
+        if offset < 0 or length < 0 or offset + length > len(self.data):
+            raise IndexError(f"Span {offset}+{length} is outside the file")
+        if isinstance(replacement, str):
+            replacement = replacement.encode('utf-8')
+        self.edits.append((offset, length, replacement))
+
+    def insert(self, offset, data):
+        self.replace(offset, 0, data)
+
+    def delete(self, offset, length):
+        self.replace(offset, length, b'')
+
+    def effective_edits(self):
+        """Sorted edits with no-ops dropped; raises EditConflict on overlap."""
+        edits = sorted(self.edits, key=lambda e: (e[0], e[1]))
+        result = []
+        end = 0
+        for offset, length, replacement in edits:
+            if offset < end:
+                raise EditConflict(f"Edit at {offset} overlaps the edit ending at {end}")
+            end = offset + length
+            if length == len(replacement) and self.data[offset:offset + length] == replacement:
+                continue
+            result.append((offset, length, replacement))
+        return result
+
+    def chunks(self, edits=None):
+        """Yields the edited file as a sequence of slices and replacements."""
+        edits = self.effective_edits() if edits is None else edits
+        view = memoryview(self.data) if len(self.data) else memoryview(b'')
+        pos = 0
+        try:
+            for offset, length, replacement in edits:
+                if offset > pos:
+                    yield view[pos:offset]
+                if replacement:
+                    yield replacement
+                pos = offset + length
+            if pos < len(self.data):
+                yield view[pos:]
+        finally:
+            view.release()
+
+    def materialize(self):
+        return b''.join(self.chunks())
+
+    @property
+    def changed(self):
+        return bool(self.effective_edits())
+
+    def commit(self, path=None):
+        """Writes the edited file atomically. Returns False when nothing changed."""
+        edits = self.effective_edits()
+        if not edits:
+            return False
+        atomic_write(path or self.path, self.chunks(edits))
+        return True
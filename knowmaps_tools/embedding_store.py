@@ -0,0 +1,456 @@
+"""
+embedding_store.py
+
+Binary, append-only embedding store: reference implementation and converter
+for replacing EmbeddingCache's embedding-cache.json.
+
+A store is a directory holding one generation of two files plus a pointer:
+
+    CURRENT             the live generation number, replaced atomically
+    vectors.<gen>.f32   16-byte header (magic, version, dimension), then one
+                        little-endian float32 row per insert, memory-mapped
+    keys.<gen>.log      one record per insert: uint32 key length, UTF-8 key,
+                        uint32 row
+
+`set` appends a row and then its log record, so an insert costs two small
+appends instead of re-encoding every embedding. Opening a store replays the
+log into a key -> row dict; records that are torn or point past the last
+complete row are ignored, so a crash loses at most the insert in flight.
+Overwriting a key leaves its old row behind as garbage. `compact` copies the
+live rows into the next generation, optionally on a background thread while
+inserts continue, and switches CURRENT once the new files are durable.
+
+Values are stored as float32. A JSON round trip therefore returns the cached
+doubles rounded to float32, which the cosine scoring in the app does not
+distinguish.
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.embedding_store import embedding-cache.json STORE_DIR
+    python -m knowmaps_tools.embedding_store export STORE_DIR embedding-cache.json
+    python -m knowmaps_tools.embedding_store compact STORE_DIR
+    python -m knowmaps_tools.embedding_store bench [--sizes 10000,100000,1000000] [--dim 384]
+"""
+
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from .common import option
+from .edit_buffer import _fsync_dir, atomic_write
+
+MAGIC = b'KMEV'
+VERSION = 1
+HEADER = struct.Struct('<4sII4x')
+_U32 = struct.Struct('<I')
+DEFAULT_DIM = 384
+# Compact automatically once garbage rows outnumber live ones.
+GARBAGE_RATIO = 1.0
+MIN_COMPACT_ROWS = 1024
+
+
+class EmbeddingStoreError(ValueError):
+    """Raised for a store directory that is not readable as an embedding store."""
+
+
+def _vectors_path(root, generation):
+    return os.path.join(root, f'vectors.{generation}.f32')
+
+
+def _log_path(root, generation):
+    return os.path.join(root, f'keys.{generation}.log')
+
+
+def _read_generation(root):
+    try:
+        with open(os.path.join(root, 'CURRENT'), 'r') as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        raise EmbeddingStoreError(f"{root}/CURRENT is not a generation number") from None
+
+
+def _replay(data, rows):
+    """Key -> row from a log buffer; stops at the first torn or dangling record."""
+    index = {}
+    pos = 0
+    end = len(data)
+    valid = 0
+    while pos + 4 <= end:
+        length = int.from_bytes(data[pos:pos + 4], 'little')
+        record_end = pos + 8 + length
+        if record_end > end:
+            break
+        row = int.from_bytes(data[record_end - 4:record_end], 'little')
+        if row >= rows:
+            break
+        index[bytes(data[pos + 4:record_end - 4]).decode('utf-8')] = row
+        pos = valid = record_end
+    return index, valid
+
+
+def _record(key, row):
+    encoded = key.encode('utf-8')
+    return _U32.pack(len(encoded)) + encoded + _U32.pack(row)
+
+
+class EmbeddingStore:
+    """Memory-mapped float32 rows addressed through an append-only key log."""
+
+    def __init__(self, root, dim=None, auto_compact=True):
+        import numpy as np
+
+        self._np = np
+        self.root = root
+        self.auto_compact = auto_compact
+        self._lock = threading.RLock()
+        self._compactor = None
+        self._compactor_pending = []
+        os.makedirs(root, exist_ok=True)
+        generation = _read_generation(root)
+        if generation is None:
+            if dim is None:
+                raise EmbeddingStoreError(f"{root} is not an embedding store; pass dim= to create one")
+            self._create(0, dim)
+            atomic_write(os.path.join(root, 'CURRENT'), (b'0\n',))
+            generation = 0
+        self._open(generation)
+        if dim is not None and dim != self.dim:
+            raise EmbeddingStoreError(f"{root} holds {self.dim}-d vectors, not {dim}-d")
+
+    def _create(self, generation, dim):
+        with open(_vectors_path(self.root, generation), 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, dim))
+        open(_log_path(self.root, generation), 'wb').close()
+
+    def _open(self, generation):
+        self.generation = generation
+        vectors_path = _vectors_path(self.root, generation)
+        self._vectors = open(vectors_path, 'r+b')
+        header = self._vectors.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise EmbeddingStoreError(f"{vectors_path} has no header")
+        magic, version, self.dim = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise EmbeddingStoreError(f"{vectors_path} is not a version {VERSION} vector file")
+        self._row_bytes = self.dim * 4
+        size = os.fstat(self._vectors.fileno()).st_size
+        self.rows = (size - HEADER.size) // self._row_bytes
+        # Drop a torn trailing row so the next append is aligned.
+        self._vectors.truncate(HEADER.size + self.rows * self._row_bytes)
+        self._vectors.seek(0, os.SEEK_END)
+
+        log_path = _log_path(self.root, generation)
+        self._log = open(log_path, 'r+b')
+        data = self._log.read()
+        self.index, valid = _replay(memoryview(data), self.rows)
+        self._log.truncate(valid)
+        self._log.seek(0, os.SEEK_END)
+        self._map = None
+        self._mapped_rows = 0
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            self.flush()
+            self._map = None
+            self._vectors.close()
+            self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index)
+
+    @property
+    def garbage(self):
+        return self.rows - len(self.index)
+
+    def _matrix(self, rows):
+        """Memory map covering at least `rows` rows; remapped only after appends."""
+        if self._map is None or rows > self._mapped_rows:
+            self._vectors.flush()
+            self._mapped_rows = self.rows
+            self._map = self._np.memmap(self._vectors, dtype='<f4', mode='r', offset=HEADER.size,
+                                        shape=(self.rows, self.dim)) if self.rows else None
+        return self._map
+
+    # Reads
+
+    def get(self, key):
+        """The stored vector as a read-only float32 view, or None."""
+        with self._lock:
+            row = self.index.get(key)
+            if row is None:
+                return None
+            return self._matrix(row + 1)[row]
+
+    def get_many(self, keys):
+        """(found keys, float32 matrix of their vectors) for the keys that are stored."""
+        with self._lock:
+            found = [k for k in keys if k in self.index]
+            rows = [self.index[k] for k in found]
+            if not rows:
+                return [], self._np.zeros((0, self.dim), dtype=self._np.float32)
+            return found, self._matrix(max(rows) + 1)[rows]
+
+    def matrix(self):
+        """(keys, float32 matrix) of every live vector, in key order of insertion."""
+        return self.get_many(self.index)
+
+    # Writes
+
+    def set(self, key, vector):
+        vector = self._np.asarray(vector, dtype='<f4')
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected a {self.dim}-d vector, got shape {vector.shape}")
+        with self._lock:
+            self._vectors.write(vector.tobytes())
+            row = self.rows
+            self.rows += 1
+            self._log.write(_record(key, row))
+            self.index[key] = row
+            if self._compactor is not None:
+                self._compactor_pending.append(key)
+        if self.auto_compact and self.rows >= MIN_COMPACT_ROWS and self.garbage > GARBAGE_RATIO * len(self.index):
+            self.compact(background=True)
+
+    def set_many(self, items):
+        """Appends many (key, vector) pairs with one write to each file."""
+        np = self._np
+        keys, vectors = [], []
+        for key, vector in items:
+            keys.append(key)
+            vectors.append(vector)
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype='<f4').reshape(len(keys), -1)
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vectors, got {matrix.shape[1]}-d")
+        with self._lock:
+            first = self.rows
+            self._vectors.write(matrix.tobytes())
+            self.rows += len(keys)
+            self._log.write(b''.join(_record(key, first + i) for i, key in enumerate(keys)))
+            for i, key in enumerate(keys):
+                self.index[key] = first + i
+            if self._compactor is not None:
+                self._compactor_pending.extend(keys)
+
+    def flush(self, durable=True):
+        """Pushes appends to the OS, and to disk when `durable`: vectors before keys."""
+        with self._lock:
+            self._vectors.flush()
+            if durable:
+                os.fsync(self._vectors.fileno())
+            self._log.flush()
+            if durable:
+                os.fsync(self._log.fileno())
+
+    # Compaction
+
+    def compact(self, background=False):
+        """
+        Rewrites live rows into the next generation. With `background`, the
+        copy runs on a thread and inserts made meanwhile are carried over
+        before the switch. Returns the thread, or None when run inline.
+        """
+        while True:
+            with self._lock:
+                compactor = self._compactor
+                if compactor is None:
+                    self.flush()
+                    snapshot = dict(self.index)
+                    self._compactor_pending = []
+                    if not background:
+                        self._compactor = threading.current_thread()
+                        self._compact(snapshot, self.rows)
+                        return None
+                    self._compactor = threading.Thread(target=self._compact, args=(snapshot, self.rows), daemon=True)
+                    self._compactor.start()
+                    return self._compactor
+                if background or compactor is threading.current_thread():
+                    return compactor if background else None
+            # A running compaction needs the lock to switch generations, so wait for it
+            # without holding the lock, then compact again inline.
+            compactor.join()
+
+    def wait(self):
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+
+    def _compact(self, snapshot, snapshot_rows):
+        np = self._np
+        generation = self.generation + 1
+        vectors_path = _vectors_path(self.root, generation)
+        log_path = _log_path(self.root, generation)
+        try:
+            keys = list(snapshot)
+            rows = np.fromiter(snapshot.values(), dtype=np.int64, count=len(keys))
+            source = np.memmap(_vectors_path(self.root, self.generation), dtype='<f4', mode='r',
+                               offset=HEADER.size, shape=(snapshot_rows, self.dim)) if len(keys) else None
+            with open(vectors_path, 'wb') as vectors, open(log_path, 'wb') as log:
+                vectors.write(HEADER.pack(MAGIC, VERSION, self.dim))
+                # Copy in row order so reads of the old map stay sequential.
+                order = np.argsort(rows, kind='stable')
+                for start in range(0, len(order), 65536):
+                    chunk = order[start:start + 65536]
+                    vectors.write(np.ascontiguousarray(source[rows[chunk]]).tobytes())
+                    log.write(b''.join(_record(keys[i], start + n) for n, i in enumerate(chunk)))
+                del source
+                with self._lock:
+                    # Carry over inserts made while copying, then switch generations.
+                    self.flush(durable=False)
+                    written = len(keys)
+                    latest = dict.fromkeys(self._compactor_pending)
+                    if latest:
+                        current = self._matrix(self.rows)
+                        for key in latest:
+                            vectors.write(np.asarray(current[self.index[key]], dtype='<f4').tobytes())
+                            log.write(_record(key, written))
+                            written += 1
+                    for f in (vectors, log):
+                        f.flush()
+                        os.fsync(f.fileno())
+                    old = self.generation
+                    self._map = None
+                    self._vectors.close()
+                    self._log.close()
+                    atomic_write(os.path.join(self.root, 'CURRENT'), (f'{generation}\n'.encode(),))
+                    self._open(generation)
+                    for path in (_vectors_path(self.root, old), _log_path(self.root, old)):
+                        os.unlink(path)
+                    _fsync_dir(vectors_path)
+        except BaseException:
+            for path in (vectors_path, log_path):
+                if os.path.exists(path) and self.generation != generation:
+                    os.unlink(path)
+            raise
+        finally:
+            self._compactor = None
+
+
+# JSON interchange
+
+def import_json(json_path, root, dim=None):
+    """Loads an embedding-cache.json ({"embeddings": {key: [double]}}) into a store."""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        embeddings = json.load(f).get('embeddings', {})
+    if dim is None:
+        dim = len(next(iter(embeddings.values()))) if embeddings else DEFAULT_DIM
+    with EmbeddingStore(root, dim=dim) as store:
+        store.set_many(embeddings.items())
+        if store.garbage:
+            store.compact()
+        return len(store)
+
+
+def export_json(root, json_path):
+    """Writes the store back out in EmbeddingCache's CacheFile format."""
+    with EmbeddingStore(root) as store:
+        keys, matrix = store.matrix()
+        embeddings = {key: [float(x) for x in row] for key, row in zip(keys, matrix)}
+    data = json.dumps({'embeddings': embeddings}, separators=(',', ':')).encode('utf-8')
+    atomic_write(json_path, (data,))
+    return len(embeddings)
+
+
+# Benchmarks
+
+def bench(size, dim=DEFAULT_DIM, lookups=10000, inserts=2000, json_baseline=True, seed=0):
+    """Returns {metric: value} for a store of `size` keys built in a temporary directory."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    results = {}
+    root = tempfile.mkdtemp(prefix='knowmaps-embeddings-')
+    try:
+        store_dir = os.path.join(root, 'store')
+        keys = [f'fsq:{i:08d}' for i in range(size)]
+        with EmbeddingStore(store_dir, dim=dim) as store:
+            for start in range(0, size, 50000):
+                block = rng.standard_normal((min(50000, size - start), dim), dtype=np.float32)
+                store.set_many(zip(keys[start:start + len(block)], block))
+        results['disk MB'] = sum(os.path.getsize(os.path.join(store_dir, n)) for n in os.listdir(store_dir)) / 1e6
+
+        start = time.perf_counter()
+        store = EmbeddingStore(store_dir)
+        results['cold load ms'] = (time.perf_counter() - start) * 1e3
+        sample = random.Random(seed).choices(keys, k=lookups)
+        store.get(sample[0])
+        start = time.perf_counter()
+        for key in sample:
+            store.get(key)
+        results['lookup us'] = (time.perf_counter() - start) / lookups * 1e6
+        vectors = rng.standard_normal((inserts, dim), dtype=np.float32)
+        start = time.perf_counter()
+        for i in range(inserts):
+            store.set(f'new:{i}', vectors[i])
+        store.flush(durable=False)
+        results['insert us'] = (time.perf_counter() - start) / inserts * 1e6
+        store.close()
+
+        if json_baseline:
+            json_path = os.path.join(root, 'embedding-cache.json')
+            start = time.perf_counter()
+            export_json(store_dir, json_path)
+            results['json rewrite ms'] = (time.perf_counter() - start) * 1e3
+            start = time.perf_counter()
+            with open(json_path, 'r') as f:
+                json.load(f)
+            results['json cold load ms'] = (time.perf_counter() - start) * 1e3
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    command = args[0] if args else 'bench'
+    if command == 'import' and len(args) == 3:
+        print(f"Imported {import_json(args[1], args[2])} embeddings into {args[2]}")
+        return 0
+    if command == 'export' and len(args) == 3:
+        print(f"Exported {export_json(args[1], args[2])} embeddings to {args[2]}")
+        return 0
+    if command == 'compact' and len(args) == 2:
+        with EmbeddingStore(args[1]) as store:
+            before = store.rows
+            store.compact()
+            print(f"{before} rows -> {store.rows} rows (generation {store.generation})")
+        return 0
+    if command == 'bench':
+        sizes = [int(s) for s in option(args, '--sizes', '10000,100000,1000000').split(',')]
+        dim = int(option(args, '--dim', DEFAULT_DIM))
+        for size in sizes:
+            # A 1M-key JSON file is several GB; the baseline stops at 100k.
+            results = bench(size, dim, json_baseline=size <= 100000)
+            print(f"{size:>9} keys x {dim}: " + ", ".join(f"{name} {value:,.1f}" for name, value in results.items()))
+        return 0
+    print("Usage: python -m knowmaps_tools.embedding_store import|export|compact|bench ...")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
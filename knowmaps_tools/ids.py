@@ -0,0 +1,70 @@
+"""
+ids.py
+
+Deterministic, collision-free object IDs for project.pbxproj.
+
+Every 24-hex ID already in the project is loaded into a set with one regex
+scan, so collision checks are constant time. New IDs are derived from
+(target, group path, filename, role) with SHA-1, which keeps them stable when
+the project is regenerated on CI. A collision is resolved by re-hashing with
+an attempt counter, so the same inputs always resolve to the same ID.
+
+Usage:
+    allocator = IDAllocator.from_project(project)
+    file_id = allocator.derive("Know Maps", "Know Maps Prod/View", "MainUI.swift", "ref")
+"""
+
+import hashlib
+import re
+
+ID_RE = re.compile(r'(?<![0-9A-Fa-f])[0-9A-F]{24}(?![0-9A-Fa-f])')
+
+
+def generate_id(seed):
+    """The seed-hash used by the add_*.py and fix_scratch_project*.py scripts."""
+    return hashlib.sha1(seed.encode()).hexdigest()[:24].upper()
+
+
+class IDAllocator:
+    """Allocates IDs that do not collide with any ID in the project."""
+
+    def __init__(self, existing=()):
+        self.used = set(existing)
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(ID_RE.findall(text))
+
+    @classmethod
+    def from_project(cls, project):
+        allocator = cls.from_text(project.text)
+        allocator.used.update(project.objects)
+        return allocator
+
+    def __contains__(self, object_id):
+        return object_id in self.used
+
+    def reserve(self, object_id):
+        if object_id in self.used:
+            raise KeyError(f"ID {object_id} is already in use")
+        self.used.add(object_id)
+        return object_id
+
+    def derive(self, target, group_path, filename, role='ref'):
+        """Returns the stable ID for a key, re-hashing deterministically on collision."""
+        seed = f"{target}\0{group_path}\0{filename}\0{role}"
+        object_id = generate_id(seed)
+        attempt = 0
+        while object_id in self.used:
+            attempt += 1
+            object_id = generate_id(f"{seed}\0{attempt}")
+        self.used.add(object_id)
+        return object_id
+
+    def derive_many(self, keys):
+        """
+        Allocates IDs for many (target, group_path, filename, role) keys at once.
+        Keys are resolved in sorted order so the result does not depend on the
+        order they were passed in.
+        """
+        return {key: self.derive(*key) for key in sorted(set(keys))}
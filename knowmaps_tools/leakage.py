@@ -0,0 +1,358 @@
+"""
+leakage.py
+
+Train/test leakage detector for the Create ML corpora.
+
+One split (the reference, usually training data) is streamed once into a
+shingle index kept in a scratch directory:
+
+    hashes.npy      8-byte hashes of the normalized texts, sorted, with ids
+    signatures      MinHash signatures over byte 4-grams, one row per record
+    band<N>.npy     LSH band keys, sorted, with the ids that carry them
+
+The other split (the probe, usually test data) is then streamed against it
+a batch at a time. Exact overlaps are found by binary search on the text
+hashes; fuzzy overlaps by binary search on each band's keys, followed by
+comparing the candidates' signatures. Everything but one band being sorted
+stays on disk and is memory-mapped, so memory is bounded by the batch size
+and a few bytes per reference record, not by the texts.
+
+Texts are compared after the normalization of training_data.py (case-folded
+words), so a classifier sentence and the tokens of a tagger example match
+despite their punctuation. Byte-identical files are reported before any
+parsing.
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.leakage [REFERENCE PROBE] [--threshold 0.8] [--limit 20]
+    python -m knowmaps_tools.leakage bench [--size 1000000] [--probes 100000]
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from .common import option
+from .training_data import (BANDS, MAX_BUCKET, ML_DIR, THRESHOLD, LshIndex, MinHasher,
+                            corpus_schema, iter_examples, normalize)
+
+BATCH = 4096
+# (reference, probe) pairs checked when no files are given.
+SPLITS = (
+    ('WordTaggingClassifierTrainingData.json', 'WordTaggingClassifierTrainingData_TestData.json'),
+    ('WordTaggingClassifierTrainingData_FULLSET.json', 'WordTaggingClassifierTrainingData_TestData.json'),
+    ('WordTaggingClassifierTrainingData_TestData.json', 'WordTaggingClassifierTrainingData_TestData'),
+    ('QueryClassifierTrainingData.json', 'WordTaggingClassifierTrainingData_TestData.json'),
+    ('QueryClassifierTrainingData.json', 'WordTaggingClassifierTrainingData.json'),
+)
+
+
+class Overlap(tuple):
+    """
+    (kind, score, probe line, probe index, reference line, reference index,
+    same label), where same label is None across corpora of different kinds.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, kind, score, line, index, reference_line, reference_index, same_label):
+        return tuple.__new__(cls, (kind, score, line, index, reference_line, reference_index, same_label))
+
+    kind = property(lambda self: self[0])
+    score = property(lambda self: self[1])
+    line = property(lambda self: self[2])
+    index = property(lambda self: self[3])
+    reference_line = property(lambda self: self[4])
+    reference_index = property(lambda self: self[5])
+    same_label = property(lambda self: self[6])
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _label_hash(label):
+    return _hash64(repr(label))
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ShingleIndex:
+    """Exact-hash and MinHash/LSH index over one split, spilled to a scratch directory."""
+
+    def __init__(self, examples, hasher=None, bands=BANDS, scratch=None):
+        """Streams `examples` ((line, index, text, label) tuples) into the index."""
+        import numpy as np
+
+        self._np = np
+        self.hasher = hasher or MinHasher()
+        self.lsh = LshIndex(self.hasher.num_perm, bands)
+        self.bands = bands
+        self.root = tempfile.mkdtemp(prefix='knowmaps-leakage-', dir=scratch)
+        try:
+            self.count = self._build(examples)
+        except BaseException:
+            shutil.rmtree(self.root, ignore_errors=True)
+            raise
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _build(self, examples):
+        np = self._np
+        files = {name: open(self._path(name), 'wb') for name in ('hashes', 'meta', 'signatures', 'keys')}
+        count = 0
+        try:
+            batch = []
+            for example in examples:
+                batch.append(example)
+                if len(batch) == BATCH:
+                    count += self._spill(batch, files)
+                    batch = []
+            count += self._spill(batch, files)
+        finally:
+            for f in files.values():
+                f.close()
+
+        hashes = np.fromfile(self._path('hashes'), dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        np.save(self._path('hashes.npy'), hashes[order])
+        np.save(self._path('hash_ids.npy'), order.astype(np.int64))
+        del hashes, order
+        os.unlink(self._path('hashes'))
+        keys = np.memmap(self._path('keys'), dtype=np.uint64, mode='r', shape=(count, self.bands)) if count else None
+        for band in range(self.bands):
+            column = np.array(keys[:, band]) if count else np.zeros(0, dtype=np.uint64)
+            order = np.argsort(column, kind='stable')
+            np.save(self._path(f'band{band}.npy'), column[order])
+            np.save(self._path(f'band{band}_ids.npy'), order.astype(np.int64))
+        del keys
+        os.unlink(self._path('keys'))
+
+        self.hashes = np.load(self._path('hashes.npy'), mmap_mode='r')
+        self.hash_ids = np.load(self._path('hash_ids.npy'), mmap_mode='r')
+        self.band_keys = [np.load(self._path(f'band{b}.npy'), mmap_mode='r') for b in range(self.bands)]
+        self.band_ids = [np.load(self._path(f'band{b}_ids.npy'), mmap_mode='r') for b in range(self.bands)]
+        shape = (max(count, 1), self.hasher.num_perm)
+        self.signatures = np.memmap(self._path('signatures'), dtype=np.uint32, mode='r', shape=shape) if count else None
+        # meta rows: line, record index, label hash.
+        self.meta = np.memmap(self._path('meta'), dtype=np.uint64, mode='r', shape=(count, 3)) if count else None
+        return count
+
+    def _spill(self, batch, files):
+        np = self._np
+        if not batch:
+            return 0
+        texts = [normalize(text) for _, _, text, _ in batch]
+        files['hashes'].write(np.fromiter(map(_hash64, texts), dtype=np.uint64, count=len(texts)).tobytes())
+        meta = np.array([(line, index, _label_hash(label)) for line, index, _, label in batch], dtype=np.uint64)
+        files['meta'].write(meta.tobytes())
+        signatures = self.hasher.signatures(texts)
+        files['signatures'].write(signatures.tobytes())
+        files['keys'].write(self.lsh.band_keys(signatures).tobytes())
+        return len(batch)
+
+    def close(self):
+        self.hashes = self.hash_ids = self.signatures = self.meta = None
+        self.band_keys = self.band_ids = []
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def _exact(self, hashes):
+        """Reference id of each probe hash, or -1."""
+        np = self._np
+        found = np.full(len(hashes), -1, dtype=np.int64)
+        if not self.count:
+            return found
+        at = np.minimum(np.searchsorted(self.hashes, hashes), self.count - 1)
+        hit = self.hashes[at] == hashes
+        found[hit] = self.hash_ids[at[hit]]
+        return found
+
+    def _candidates(self, band_keys):
+        """(probe row, reference id) pairs sharing a band, at most MAX_BUCKET per band."""
+        np = self._np
+        probes, ids = [], []
+        for band in range(self.bands):
+            keys = self.band_keys[band]
+            lo = np.searchsorted(keys, band_keys[:, band], side='left')
+            hi = np.minimum(np.searchsorted(keys, band_keys[:, band], side='right'), lo + MAX_BUCKET)
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            rows = np.repeat(np.arange(len(band_keys)), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+            probes.append(rows)
+            ids.append(np.asarray(self.band_ids[band][offsets]))
+        if not probes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pairs = np.unique(np.concatenate(probes) * self.count + np.concatenate(ids))
+        return np.divmod(pairs, self.count)
+
+    def query(self, examples, threshold=THRESHOLD):
+        """Yields an Overlap for every probe example that matches the reference split."""
+        batch = []
+        for example in examples:
+            batch.append(example)
+            if len(batch) == BATCH:
+                yield from self._query_batch(batch, threshold)
+                batch = []
+        yield from self._query_batch(batch, threshold)
+
+    def _query_batch(self, batch, threshold):
+        np = self._np
+        if not batch or not self.count:
+            return
+        texts = [normalize(text) for _, _, text, _ in batch]
+        labels = np.fromiter((_label_hash(label) for *_, label in batch), dtype=np.uint64, count=len(batch))
+        exact = self._exact(np.fromiter(map(_hash64, texts), dtype=np.uint64, count=len(texts)))
+        best = exact.copy()
+        scores = (exact >= 0).astype(np.float32)
+
+        fuzzy = np.flatnonzero(exact < 0)
+        if len(fuzzy):
+            signatures = self.hasher.signatures([texts[i] for i in fuzzy])
+            rows, ids = self._candidates(self.lsh.band_keys(signatures))
+            if len(rows):
+                similarity = (signatures[rows] == self.signatures[ids]).mean(axis=1)
+                order = np.lexsort((ids, -similarity, rows))
+                rows, ids, similarity = rows[order], ids[order], similarity[order]
+                first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+                keep = first[similarity[first] >= threshold]
+                best[fuzzy[rows[keep]]] = ids[keep]
+                scores[fuzzy[rows[keep]]] = similarity[keep]
+
+        for row in np.flatnonzero(best >= 0):
+            line, index, _, _ = batch[row]
+            reference_line, reference_index, reference_label = (int(v) for v in self.meta[best[row]])
+            yield Overlap('exact' if exact[row] >= 0 else 'fuzzy', round(float(scores[row]), 4), line, index,
+                          reference_line, reference_index, reference_label == int(labels[row]))
+
+
+def detect(reference, probe, threshold=THRESHOLD, scratch=None):
+    """(reference count, probe count, overlaps) between two corpus files."""
+    with ShingleIndex(iter_examples(reference), scratch=scratch) as index:
+        probes = [0]
+
+        def counted():
+            for example in iter_examples(probe):
+                probes[0] += 1
+                yield example
+
+        overlaps = list(index.query(counted(), threshold))
+        if corpus_schema(reference)[0] != corpus_schema(probe)[0]:
+            # Tagger label sequences and classifier labels cannot be compared.
+            overlaps = [Overlap(*overlap[:6], None) for overlap in overlaps]
+        return len(index), probes[0], overlaps
+
+
+# Benchmarks
+
+def _synthetic_examples(count, seed, vocabulary):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield i + 1, i, ' '.join(rng.choices(vocabulary, k=rng.randint(6, 16))), 'SearchQuery'
+
+
+def bench(size=1000000, probes=100000, seed=0):
+    """Returns {metric: value} for a synthetic reference of `size` texts and `probes` probes, half of them leaked."""
+    import resource
+
+    examples = [text for _, _, text, _ in iter_examples(os.path.join(ML_DIR, 'QueryClassifierTrainingData.json'))]
+    vocabulary = sorted({word for text in examples for word in normalize(text).split()})
+    rng = random.Random(seed + 1)
+    leaked = set(rng.sample(range(size), min(probes // 2, size)))
+
+    def probe_examples():
+        reference = _synthetic_examples(size, seed, vocabulary)
+        fresh = _synthetic_examples(probes, seed + 2, vocabulary)
+        emitted = 0
+        for line, index, text, label in reference:
+            if index in leaked:
+                words = text.split()
+                if index % 2:
+                    words[-1] = rng.choice(vocabulary)
+                yield emitted + 1, emitted, ' '.join(words), label
+                emitted += 1
+        for _, _, text, label in fresh:
+            if emitted == probes:
+                break
+            yield emitted + 1, emitted, text, label
+            emitted += 1
+
+    results = {}
+    start = time.perf_counter()
+    with ShingleIndex(_synthetic_examples(size, seed, vocabulary)) as index:
+        results['index s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        overlaps = list(index.query(probe_examples()))
+        results['probe s'] = time.perf_counter() - start
+    results['probes/s'] = probes / results['probe s']
+    results['exact'] = sum(1 for o in overlaps if o.kind == 'exact')
+    results['fuzzy'] = sum(1 for o in overlaps if o.kind == 'fuzzy')
+    results['leaked'] = len(leaked)
+    results['peak RSS MB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return results
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    if args and args[0] == 'bench':
+        results = bench(int(option(args, '--size', 1000000)), int(option(args, '--probes', 100000)))
+        print(", ".join(f"{name} {value:,.1f}" for name, value in results.items()))
+        return 0
+    threshold = float(option(args, '--threshold', THRESHOLD))
+    limit = int(option(args, '--limit', 20))
+    files = [a for i, a in enumerate(args) if not a.startswith('--') and (i == 0 or not args[i - 1].startswith('--'))]
+    if len(files) == 2:
+        pairs = [tuple(files)]
+    elif not files:
+        pairs = [(os.path.join(ML_DIR, a), os.path.join(ML_DIR, b)) for a, b in SPLITS]
+    else:
+        print("Usage: python -m knowmaps_tools.leakage [REFERENCE PROBE] [--threshold 0.8] [--limit 20]")
+        return 2
+    leaked = 0
+    for reference, probe in pairs:
+        print(f"{os.path.basename(reference)} <- {os.path.basename(probe)}")
+        if file_sha1(reference) == file_sha1(probe):
+            print("  byte-identical files: every example leaks")
+            leaked += 1
+            continue
+        references, probes, overlaps = detect(reference, probe, threshold)
+        for overlap in overlaps[:limit]:
+            label = {True: ' (same label)', False: ' (different label)', None: ''}[overlap.same_label]
+            print(f"  {overlap.kind:5} {overlap.score:.2f} line {overlap.line} ~ line {overlap.reference_line}{label}")
+        if len(overlaps) > limit:
+            print(f"  ... {len(overlaps) - limit} more")
+        exact = sum(1 for o in overlaps if o.kind == 'exact')
+        share = len(overlaps) / probes if probes else 0.0
+        print(f"  {probes} probes against {references} references: {exact} exact, "
+              f"{len(overlaps) - exact} fuzzy ({share:.1%} leaked)")
+        leaked += bool(overlaps)
+    return 1 if leaked else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
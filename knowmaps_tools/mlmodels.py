@@ -0,0 +1,418 @@
+"""
+mlmodels.py
+
+Core ML model inspector that does not need coremltools.
+
+A .mlmodel file is a serialized `CoreML.Specification.Model` protobuf. Its
+`description` field (inputs, outputs, metadata) comes first and is small;
+the weights and layers that follow are skipped over by length without being
+decoded, so even large models are summarized by reading a few hundred bytes
+of a memory-mapped file. For an .mlpackage the root model is located through
+Manifest.json, and the FeatureDescriptions.json / Metadata.json overlays
+Xcode writes are merged on top. The weights directory is never opened.
+
+Models are inspected in parallel and summaries are cached in
+.knowmaps-cache/mlmodels.json, keyed by a hash of the spec and manifest
+files. coremltools is only imported as a fallback when a spec cannot be
+decoded.
+
+Usage:
+    python -m knowmaps_tools.mlmodels [--json] [--no-cache] [paths...]
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import load_json_cache, save_json_cache
+from .disk_index import CACHE_DIR
+
+ML_DIR = 'Know-Maps/Know Maps Prod/Model/ML'
+CACHE_PATH = os.path.join(CACHE_DIR, 'mlmodels.json')
+CACHE_VERSION = 1
+MODEL_SUFFIXES = ('.mlmodel', '.mlpackage')
+
+# Model.proto field numbers for the `Type` oneof.
+MODEL_TYPES = {
+    200: 'pipelineClassifier', 201: 'pipelineRegressor', 202: 'pipeline',
+    300: 'glmRegressor', 301: 'supportVectorRegressor', 302: 'treeEnsembleRegressor',
+    303: 'neuralNetworkRegressor', 304: 'bayesianProbitRegressor',
+    400: 'glmClassifier', 401: 'supportVectorClassifier', 402: 'treeEnsembleClassifier',
+    403: 'neuralNetworkClassifier', 404: 'kNearestNeighborsClassifier',
+    500: 'neuralNetwork', 501: 'itemSimilarityRecommender', 502: 'mlProgram',
+    555: 'customModel', 556: 'linkedModel', 560: 'classConfidenceThresholding',
+    600: 'oneHotEncoder', 601: 'imputer', 602: 'featureVectorizer', 603: 'dictVectorizer',
+    604: 'scaler', 606: 'categoricalMapping', 607: 'normalizer', 609: 'arrayFeatureExtractor',
+    610: 'nonMaximumSuppression', 900: 'identity',
+    2000: 'textClassifier', 2001: 'wordTagger', 2002: 'visionFeaturePrint',
+    2003: 'soundAnalysisPreprocessing', 2004: 'gazetteer', 2005: 'wordEmbedding',
+    2006: 'audioFeaturePrint', 3000: 'serializedModel',
+}
+ARRAY_DATA_TYPES = {65552: 'FLOAT16', 65568: 'FLOAT32', 65600: 'DOUBLE', 131104: 'INT32', 131080: 'INT8'}
+COLOR_SPACES = {10: 'GRAYSCALE', 20: 'RGB', 30: 'BGR', 40: 'GRAYSCALE_FLOAT16'}
+
+
+class SpecDecodeError(ValueError):
+    """Raised when a model spec is not a well-formed protobuf."""
+
+
+# Protobuf wire format
+
+def _varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise SpecDecodeError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise SpecDecodeError("Varint is too long")
+
+
+def iter_fields(data, start=0, end=None):
+    """
+    Yields (field number, wire type, value) for one message. Length-delimited
+    values are returned as (start, end) offsets so nothing is copied unless a
+    caller asks for it.
+    """
+    pos = start
+    end = len(data) if end is None else end
+    while pos < end:
+        key, pos = _varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 1:
+            value = bytes(data[pos:pos + 8])
+            pos += 8
+        elif wire == 5:
+            value = bytes(data[pos:pos + 4])
+            pos += 4
+        else:
+            raise SpecDecodeError(f"Unsupported wire type {wire} for field {number}")
+        if pos > end:
+            raise SpecDecodeError(f"Field {number} runs past the end of its message")
+        yield number, wire, value
+
+
+def _text(data, span):
+    return bytes(data[span[0]:span[1]]).decode('utf-8', errors='replace')
+
+
+def _packed_ints(data, span):
+    values = []
+    pos, end = span
+    while pos < end:
+        value, pos = _varint(data, pos)
+        values.append(value)
+    return values
+
+
+# CoreML.Specification messages
+
+def _array_type(data, span):
+    shape, data_type = [], None
+    for number, wire, value in iter_fields(data, *span):
+        if number == 1:
+            shape.extend(_packed_ints(data, value) if wire == 2 else [value])
+        elif number == 2:
+            data_type = ARRAY_DATA_TYPES.get(value, str(value))
+    return f"multiArray({data_type or '?'} {shape})"
+
+
+def _image_type(data, span):
+    width = height = 0
+    color = '?'
+    for number, _, value in iter_fields(data, *span):
+        if number == 1:
+            width = value
+        elif number == 2:
+            height = value
+        elif number == 3:
+            color = COLOR_SPACES.get(value, str(value))
+    return f"image({width}x{height} {color})"
+
+
+def _feature_type(data, span):
+    kind = '?'
+    optional = False
+    for number, _, value in iter_fields(data, *span):
+        if number == 1:
+            kind = 'int64'
+        elif number == 2:
+            kind = 'double'
+        elif number == 3:
+            kind = 'string'
+        elif number == 4:
+            kind = _image_type(data, value)
+        elif number == 5:
+            kind = _array_type(data, value)
+        elif number == 6:
+            keys = [{1: 'int64', 2: 'string'}.get(n, '?') for n, _, _ in iter_fields(data, *value)]
+            kind = f"dictionary<{keys[0] if keys else '?'}, double>"
+        elif number == 7:
+            elements = [{1: 'int64', 3: 'string'}.get(n) for n, _, _ in iter_fields(data, *value)]
+            element = next((e for e in elements if e), '?')
+            kind = f"sequence<{element}>"
+        elif number == 8:
+            kind = 'state'
+        elif number == 1000:
+            optional = bool(value)
+    return kind + ('?' if optional else '')
+
+
+def _feature(data, span):
+    feature = {'name': '', 'type': '?', 'description': ''}
+    for number, _, value in iter_fields(data, *span):
+        if number == 1:
+            feature['name'] = _text(data, value)
+        elif number == 2:
+            feature['description'] = _text(data, value)
+        elif number == 3:
+            feature['type'] = _feature_type(data, value)
+    return feature
+
+
+def _metadata(data, span):
+    metadata = {'shortDescription': '', 'versionString': '', 'author': '', 'license': '', 'userDefined': {}}
+    names = {1: 'shortDescription', 2: 'versionString', 3: 'author', 4: 'license'}
+    for number, _, value in iter_fields(data, *span):
+        if number in names:
+            metadata[names[number]] = _text(data, value)
+        elif number == 100:
+            entry = {n: _text(data, v) for n, _, v in iter_fields(data, *value)}
+            metadata['userDefined'][entry.get(1, '')] = entry.get(2, '')
+    return metadata
+
+
+def _description(data, span):
+    description = {'inputs': [], 'outputs': [], 'trainingInputs': [], 'predictedFeatureName': '',
+                   'predictedProbabilitiesName': '', 'metadata': None}
+    for number, _, value in iter_fields(data, *span):
+        if number == 1:
+            description['inputs'].append(_feature(data, value))
+        elif number == 10:
+            description['outputs'].append(_feature(data, value))
+        elif number == 11:
+            description['predictedFeatureName'] = _text(data, value)
+        elif number == 12:
+            description['predictedProbabilitiesName'] = _text(data, value)
+        elif number == 13:
+            description['trainingInputs'].append(_feature(data, value))
+        elif number == 100:
+            description['metadata'] = _metadata(data, value)
+    return description
+
+
+def decode_spec(data):
+    """
+    Decodes the specification version, description and model type of a
+    serialized Model. Everything but the description is skipped by length.
+    """
+    summary = {'specificationVersion': None, 'modelType': None, 'isUpdatable': False}
+    summary.update(_description(data, (0, 0)))
+    for number, _, value in iter_fields(data):
+        if number == 1:
+            summary['specificationVersion'] = value
+        elif number == 2:
+            summary.update(_description(data, value))
+        elif number == 10:
+            summary['isUpdatable'] = bool(value)
+        elif number in MODEL_TYPES:
+            summary['modelType'] = MODEL_TYPES[number]
+    if summary['specificationVersion'] is None:
+        raise SpecDecodeError("No specificationVersion; not a Core ML spec")
+    if summary['metadata'] is None:
+        summary['metadata'] = _metadata(data, (0, 0))
+    return summary
+
+
+# Files
+
+def package_files(path):
+    """(spec path, [overlay paths]) of an .mlpackage, resolved through Manifest.json."""
+    with open(os.path.join(path, 'Manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    entries = manifest.get('itemInfoEntries', {})
+    root = entries.get(manifest.get('rootModelIdentifier'))
+    if root is None:
+        raise SpecDecodeError(f"{path}: Manifest.json has no root model entry")
+    data_dir = os.path.join(path, 'Data')
+    overlays = [os.path.join(data_dir, entry['path']) for entry in entries.values()
+                if entry['path'].endswith('.json')]
+    return os.path.join(data_dir, root['path']), sorted(overlays)
+
+
+def _model_files(path):
+    if os.path.isdir(path):
+        spec, overlays = package_files(path)
+        return spec, overlays, [os.path.join(path, 'Manifest.json')]
+    return path, [], []
+
+
+def _fingerprint(files):
+    digest = hashlib.sha1()
+    for file_path in files:
+        digest.update(os.path.basename(file_path).encode() + b'\0')
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_spec(spec_path):
+    with open(spec_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise SpecDecodeError(f"{spec_path} is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return decode_spec(data)
+
+
+def _apply_overlays(summary, overlays):
+    for overlay in overlays:
+        try:
+            with open(overlay, 'r') as f:
+                values = json.load(f)
+        except (OSError, ValueError):
+            continue
+        name = os.path.basename(overlay)
+        if name == 'FeatureDescriptions.json':
+            for key, features in (('Inputs', 'inputs'), ('Outputs', 'outputs'), ('TrainingInputs', 'trainingInputs')):
+                texts = values.get(key) or {}
+                for feature in summary[features]:
+                    text = (texts.get(feature['name']) or {}).get('MLFeatureShortDescription')
+                    if text:
+                        feature['description'] = text
+        elif name == 'Metadata.json':
+            metadata = summary['metadata']
+            for key, field in (('MLModelDescriptionKey', 'shortDescription'), ('MLModelVersionStringKey', 'versionString'),
+                               ('MLModelAuthorKey', 'author'), ('MLModelLicenseKey', 'license')):
+                if values.get(key):
+                    metadata[field] = values[key]
+            metadata['userDefined'].update(values.get('MLModelCreatorDefinedKey') or {})
+
+
+def _coremltools_summary(spec_path):
+    """Fallback for specs the wire decoder rejects."""
+    import coremltools as ct
+    return decode_spec(ct.utils.load_spec(spec_path).SerializeToString())
+
+
+def _summarize(path, spec_path, overlays):
+    try:
+        summary = _read_spec(spec_path)
+    except SpecDecodeError as error:
+        try:
+            summary = _coremltools_summary(spec_path)
+        except ImportError:
+            raise error from None
+    _apply_overlays(summary, overlays)
+    summary['path'] = path
+    return summary
+
+
+def inspect_model(path):
+    """Summarizes one .mlmodel or .mlpackage without touching the cache."""
+    _, summary, _ = _inspect_cached(path, {})
+    return summary
+
+
+def find_models(paths=(ML_DIR,)):
+    """Top-level models under `paths`; .mlproj directories and bundle contents are skipped."""
+    found = []
+    for path in paths:
+        if path.endswith(MODEL_SUFFIXES):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            found.extend(os.path.join(root, d) for d in dirs if d.endswith('.mlpackage'))
+            found.extend(os.path.join(root, f) for f in files if f.endswith('.mlmodel'))
+            dirs[:] = sorted(d for d in dirs if not d.endswith(('.mlpackage', '.mlproj')))
+    return sorted(found)
+
+
+def _load_cache():
+    return load_json_cache(CACHE_PATH, CACHE_VERSION, 'models')
+
+
+def _save_cache(cache):
+    save_json_cache(CACHE_PATH, CACHE_VERSION, 'models', cache, indent=1, sort_keys=True)
+
+
+def _inspect_cached(path, cache):
+    spec_path, overlays, extra = _model_files(path)
+    fingerprint = _fingerprint(extra + [spec_path] + overlays)
+    cached = cache.get(fingerprint)
+    if cached is not None:
+        return fingerprint, dict(cached, path=path), True
+    return fingerprint, _summarize(path, spec_path, overlays), False
+
+
+def inspect_models(paths=(ML_DIR,), use_cache=True, workers=None):
+    """
+    Summarizes every model under `paths` in parallel. Returns
+    (summaries, decoded, cached) where summaries are in path order.
+    """
+    models = find_models(paths)
+    cache = _load_cache() if use_cache else {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda path: _inspect_cached(path, cache), models))
+    summaries = []
+    hits = 0
+    for fingerprint, summary, hit in results:
+        hits += hit
+        cache[fingerprint] = {k: v for k, v in summary.items() if k != 'path'}
+        summary['sha1'] = fingerprint
+        summaries.append(summary)
+    if use_cache and hits < len(results):
+        _save_cache(cache)
+    return summaries, len(results) - hits, hits
+
+
+def format_summary(summary):
+    lines = [f"{summary['path']} ({summary['modelType']}, spec v{summary['specificationVersion']})"]
+    description = summary['metadata']['shortDescription']
+    if description:
+        lines.append(f"  {description}")
+    for title, key in (('inputs', 'inputs'), ('outputs', 'outputs')):
+        lines.append(f"  {title}:")
+        for feature in summary[key]:
+            text = f"  # {feature['description']}" if feature['description'] else ""
+            lines.append(f"    - {feature['name']}: {feature['type']}{text}")
+    return lines
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    paths = [a for a in args if not a.startswith('--')] or [ML_DIR]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        for path in missing:
+            print(f"Error: Model not found at '{path}'")
+        return 1
+    summaries, decoded, cached = inspect_models(paths, use_cache='--no-cache' not in args)
+    if '--json' in args:
+        json.dump(summaries, sys.stdout, indent=2)
+        print()
+        return 0
+    for summary in summaries:
+        for line in format_summary(summary):
+            print(line)
+    print(f"{len(summaries)} model(s): {decoded} decoded, {cached} cached.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
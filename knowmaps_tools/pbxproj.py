@@ -0,0 +1,500 @@
+"""
+pbxproj.py
+
+A single-pass parser for Xcode project files (OpenStep property lists).
+
+The whole file is tokenized once and loaded into a UUID-indexed object graph.
+Every entry of the `objects` dictionary keeps the span of text it was parsed
+from, so serializing the project copies untouched objects through verbatim and
+only re-renders the objects that were added, removed or modified.
+
+Usage:
+    from knowmaps_tools.pbxproj import PBXProject
+
+    project = PBXProject.load(PBXPROJ_PATH)
+    ref = project["50D57650D829B6E591429944"]
+    print(ref.isa, ref["path"])
+    project.save()
+"""
+
+import bisect
+import re
+
+from .edit_buffer import EditBuffer
+
+PROJECT_DIR = 'Know-Maps'
+PBXPROJ_NAME = 'Know Maps.xcodeproj/project.pbxproj'
+PBXPROJ_PATH = PROJECT_DIR + '/' + PBXPROJ_NAME
+
+# Objects Xcode writes on a single line.
+SINGLE_LINE_ISAS = frozenset(('PBXBuildFile', 'PBXFileReference'))
+
+# Reference-valued keys Xcode writes without a trailing /* comment */.
+UNANNOTATED_KEYS = frozenset(('remoteGlobalIDString', 'TestTargetID'))
+
+# Leading whitespace is part of each match, so the loop only sees real tokens.
+_TOKEN_RE = re.compile(r'''\s*(?:
+      (?P<comment>/\*.*?\*/|//[^\n]*)
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<word>[^\s{}();=,"]+)
+    | (?P<punct>[{}();=,])
+)''', re.DOTALL | re.VERBOSE)
+
+_UNQUOTED_RE = re.compile(r'^[A-Za-z0-9_$/.]+$')
+_SECTION_RE = re.compile(r'/\* (Begin|End) (\w+) section \*/')
+
+_ESCAPES = {'n': '\n', 't': '\t', '"': '"', '\\': '\\', "'": "'"}
+_QUOTES = {'\n': '\\n', '\t': '\\t', '"': '\\"', '\\': '\\\\'}
+
+
+class PBXParseError(ValueError):
+    """Raised when the project file is not a well-formed OpenStep plist."""
+
+    def __init__(self, message, text, offset):
+        line = text.count('\n', 0, offset) + 1
+        super().__init__(f"{message} at line {line}")
+        self.line = line
+        self.offset = offset
+
+
+class PBXObject:
+    """
+    One entry of the `objects` dictionary.
+
+    `fields` holds the parsed dictionary (strings, lists and dicts). Mutating a
+    field through item assignment marks the object dirty; callers that mutate
+    nested lists in place must call `touch()` themselves.
+    """
+
+    __slots__ = ('id', 'fields', 'comment', 'span', 'dirty')
+
+    def __init__(self, object_id, fields, comment=None, span=None):
+        self.id = object_id
+        self.fields = fields
+        self.comment = comment
+        self.span = span
+        self.dirty = span is None
+
+    @property
+    def isa(self):
+        return self.fields.get('isa')
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+        self.dirty = True
+
+    def __delitem__(self, key):
+        del self.fields[key]
+        self.dirty = True
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def touch(self):
+        self.dirty = True
+
+    def __repr__(self):
+        return f"<{self.isa} {self.id} /* {self.comment} */>"
+
+
+def unquote(token):
+    """Returns the value of a quoted plist string token."""
+    body = token[1:-1]
+    if '\\' not in body:
+        return body
+    out = []
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if c == '\\' and i + 1 < len(body):
+            i += 1
+            out.append(_ESCAPES.get(body[i], body[i]))
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+def quote(value):
+    """Renders a string the way Xcode does, quoting only when required."""
+    if _UNQUOTED_RE.match(value) and '___' not in value:
+        return value
+    return '"' + ''.join(_QUOTES.get(c, c) for c in value) + '"'
+
+
+def tokenize(text):
+    """
+    Splits the file into (kind, text, start, end) tuples in one linear pass.
+    Whitespace is dropped; comments are kept because object comments and
+    section markers are needed to reproduce the file.
+    """
+    tokens = []
+    append = tokens.append
+    pos = 0
+    for m in _TOKEN_RE.finditer(text):
+        if m.start() != pos:
+            raise PBXParseError("Unexpected character", text, pos)
+        kind = m.lastgroup
+        start, pos = m.span(kind)
+        append((kind, text[start:pos], start, pos))
+    if text[pos:].strip():
+        raise PBXParseError("Unexpected character", text, pos)
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+        self.objects = {}
+        self.sections = {}
+
+    def _error(self, message):
+        offset = self.tokens[self.i][2] if self.i < len(self.tokens) else len(self.text)
+        return PBXParseError(message, self.text, offset)
+
+    def _skip_comments(self):
+        tokens = self.tokens
+        comment = None
+        while self.i < len(tokens) and tokens[self.i][0] == 'comment':
+            comment = tokens[self.i]
+            self.i += 1
+        return comment
+
+    def _expect(self, punct):
+        self._skip_comments()
+        if self.i >= len(self.tokens) or self.tokens[self.i][1] != punct:
+            raise self._error(f"Expected '{punct}'")
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def _scalar(self):
+        self._skip_comments()
+        if self.i >= len(self.tokens):
+            raise self._error("Unexpected end of file")
+        kind, value, start, _ = self.tokens[self.i]
+        if kind == 'string':
+            self.i += 1
+            return unquote(value), start
+        if kind == 'word':
+            self.i += 1
+            return value, start
+        raise self._error("Expected a string")
+
+    def _annotation(self):
+        """Consumes a trailing /* comment */ and returns its text."""
+        tokens = self.tokens
+        if self.i < len(tokens) and tokens[self.i][0] == 'comment':
+            text = tokens[self.i][1]
+            self.i += 1
+            if text.startswith('/*'):
+                return text[2:-2].strip()
+        return None
+
+    def value(self):
+        self._skip_comments()
+        if self.i >= len(self.tokens):
+            raise self._error("Unexpected end of file")
+        token = self.tokens[self.i][1]
+        if token == '{':
+            return self.dictionary()
+        if token == '(':
+            return self.array()
+        value, _ = self._scalar()
+        self._annotation()
+        return value
+
+    def array(self):
+        self._expect('(')
+        items = []
+        while True:
+            self._skip_comments()
+            if self.i >= len(self.tokens):
+                raise self._error("Unterminated array")
+            if self.tokens[self.i][1] == ')':
+                self.i += 1
+                return items
+            items.append(self.value())
+            self._skip_comments()
+            if self.i < len(self.tokens) and self.tokens[self.i][1] == ',':
+                self.i += 1
+
+    def dictionary(self, top=False):
+        self._expect('{')
+        result = {}
+        while True:
+            self._skip_comments()
+            if self.i >= len(self.tokens):
+                raise self._error("Unterminated dictionary")
+            if self.tokens[self.i][1] == '}':
+                self.i += 1
+                return result
+            key, _ = self._scalar()
+            self._annotation()
+            self._expect('=')
+            if top and key == 'objects':
+                result[key] = self.object_table()
+            else:
+                result[key] = self.value()
+            self._expect(';')
+
+    def object_table(self):
+        """Parses the `objects` dictionary, recording spans and sections."""
+        text = self.text
+        tokens = self.tokens
+        self._expect('{')
+        while True:
+            while self.i < len(tokens) and tokens[self.i][0] == 'comment':
+                _, comment, start, end = tokens[self.i]
+                m = _SECTION_RE.fullmatch(comment)
+                if m:
+                    bounds = self.sections.setdefault(m.group(2), [None, None])
+                    line_start = text.rfind('\n', 0, start) + 1
+                    bounds[0 if m.group(1) == 'Begin' else 1] = line_start
+                self.i += 1
+            if self.i >= len(tokens):
+                raise self._error("Unterminated objects dictionary")
+            if tokens[self.i][1] == '}':
+                self.i += 1
+                return self.objects
+            object_id, key_start = self._scalar()
+            comment = self._annotation()
+            self._expect('=')
+            fields = self.dictionary()
+            end = self._expect(';')[3]
+            if text.startswith('\n', end):
+                end += 1
+            span = (text.rfind('\n', 0, key_start) + 1, end)
+            self.objects[object_id] = PBXObject(object_id, fields, comment, span)
+
+    def document(self):
+        top = self.dictionary(top=True)
+        self._skip_comments()
+        if self.i != len(self.tokens):
+            raise self._error("Trailing content after root dictionary")
+        return top
+
+
+class PBXProject:
+    """UUID-indexed view over a parsed project.pbxproj."""
+
+    def __init__(self, text, path=None):
+        parser = _Parser(text)
+        self.text = text
+        self.path = path
+        self.top = parser.document()
+        self.objects = parser.objects
+        self.sections = parser.sections
+        self.removed = {}
+
+    @classmethod
+    def load(cls, path=PBXPROJ_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(f.read(), path)
+
+    # Lookup
+
+    def __getitem__(self, object_id):
+        return self.objects[object_id]
+
+    def __contains__(self, object_id):
+        return object_id in self.objects
+
+    def get(self, object_id, default=None):
+        return self.objects.get(object_id, default)
+
+    def iter_isa(self, isa):
+        return (obj for obj in self.objects.values() if obj.fields.get('isa') == isa)
+
+    @property
+    def root_object(self):
+        return self.objects[self.top['rootObject']]
+
+    @property
+    def main_group(self):
+        return self.objects[self.root_object['mainGroup']]
+
+    def comment_for(self, object_id):
+        obj = self.objects.get(object_id)
+        return obj.comment if obj is not None else None
+
+    # Mutation
+
+    def add(self, object_id, fields, comment=None):
+        """Adds a new object. `fields` must contain `isa`."""
+        if object_id in self.objects:
+            raise KeyError(f"Object {object_id} already exists")
+        if comment is None:
+            comment = fields.get('name') or fields.get('path')
+        previous = self.removed.pop(object_id, None)
+        obj = PBXObject(object_id, fields, comment)
+        if previous is not None and previous.span is not None:
+            # Re-adding an object that was removed in this session reuses its slot.
+            obj.span = previous.span
+        self.objects[object_id] = obj
+        return obj
+
+    def remove(self, object_id):
+        obj = self.objects.pop(object_id)
+        self.removed[object_id] = obj
+        return obj
+
+    def touch(self, object_id):
+        self.objects[object_id].dirty = True
+
+    @property
+    def changed(self):
+        return bool(self.removed) or any(obj.dirty for obj in self.objects.values())
+
+    # Serialization
+
+    def render_value(self, value, indent, inline, key=None):
+        if isinstance(value, dict):
+            return self.render_dict(value, indent, inline)
+        if isinstance(value, list):
+            if inline:
+                return '(' + ''.join(self.render_value(v, indent, True) + ', ' for v in value) + ')'
+            pad = '\t' * (indent + 1)
+            body = ''.join(f"{pad}{self.render_value(v, indent + 1, False)},\n" for v in value)
+            return '(\n' + body + '\t' * indent + ')'
+        text = quote(value)
+        if key not in UNANNOTATED_KEYS:
+            comment = self.comment_for(value) if len(value) == 24 else None
+            if comment is not None:
+                text += f" /* {comment} */"
+        return text
+
+    def render_dict(self, fields, indent, inline):
+        keys = sorted(fields, key=lambda k: (k != 'isa', k))
+        if inline:
+            body = ''.join(f"{quote(k)} = {self.render_value(fields[k], indent, True, k)}; " for k in keys)
+            return '{' + body + '}'
+        pad = '\t' * (indent + 1)
+        body = ''.join(f"{pad}{quote(k)} = {self.render_value(fields[k], indent + 1, False, k)};\n" for k in keys)
+        return '{\n' + body + '\t' * indent + '}'
+
+    def render_object(self, obj):
+        inline = obj.isa in SINGLE_LINE_ISAS
+        head = f"\t\t{quote(obj.id)}"
+        if obj.comment is not None:
+            head += f" /* {obj.comment} */"
+        return f"{head} = {self.render_dict(obj.fields, 2, inline)};\n"
+
+    def _section_slots(self):
+        """Maps each isa to the sorted (id, start offset) list of its original objects."""
+        slots = {}
+        for obj in self.objects.values():
+            if obj.span is not None:
+                slots.setdefault(obj.isa, []).append((obj.id, obj.span[0]))
+        for obj in self.removed.values():
+            if obj.span is not None:
+                slots.setdefault(obj.isa, []).append((obj.id, obj.span[0]))
+        for entries in slots.values():
+            entries.sort()
+        return slots
+
+    def edits(self):
+        """
+        Returns the sorted (start, end, replacement) spans that turn the
+        original text into the current object graph.
+        """
+        edits = []
+        new_objects = {}
+        for obj in self.objects.values():
+            if obj.span is None:
+                new_objects.setdefault(obj.isa, []).append(obj)
+            elif obj.dirty:
+                edits.append((obj.span[0], obj.span[1], self.render_object(obj)))
+        for obj in self.removed.values():
+            if obj.span is not None and obj.id not in self.objects:
+                edits.append((obj.span[0], obj.span[1], ''))
+        if new_objects:
+            edits.extend(self._insertions(new_objects))
+        edits.sort(key=lambda e: (e[0], e[1]))
+        return edits
+
+    def _insertions(self, new_objects):
+        slots = self._section_slots()
+        inserts = []
+        pending_sections = []
+        for isa, objs in new_objects.items():
+            objs.sort(key=lambda o: o.id)
+            bounds = self.sections.get(isa)
+            if bounds is None or bounds[1] is None:
+                pending_sections.append((isa, ''.join(self.render_object(o) for o in objs)))
+                continue
+            entries = slots.get(isa, [])
+            ids = [e[0] for e in entries]
+            grouped = {}
+            for obj in objs:
+                index = bisect.bisect_left(ids, obj.id)
+                offset = entries[index][1] if index < len(entries) else bounds[1]
+                grouped.setdefault(offset, []).append(self.render_object(obj))
+            inserts.extend((offset, offset, ''.join(parts)) for offset, parts in grouped.items())
+        for isa, body in sorted(pending_sections):
+            inserts.append(self._new_section(isa, body))
+        return inserts
+
+    def _new_section(self, isa, body):
+        following = [b[0] for name, b in self.sections.items() if name > isa and b[0] is not None]
+        block = f"/* Begin {isa} section */\n{body}/* End {isa} section */\n"
+        if following:
+            offset = min(following)
+            return (offset, offset, block + '\n')
+        ends = [b[1] for b in self.sections.values() if b[1] is not None]
+        if ends:
+            last_end = max(ends)
+            offset = self.text.find('\n', last_end) + 1
+        else:
+            offset = self.text.find('\n', self.text.find('objects = {')) + 1
+        return (offset, offset, '\n' + block)
+
+    def serialize(self):
+        """Returns the project text; untouched objects are copied verbatim."""
+        edits = self.edits()
+        if not edits:
+            return self.text
+        out = []
+        pos = 0
+        for start, end, replacement in edits:
+            out.append(self.text[pos:start])
+            out.append(replacement)
+            pos = max(pos, end)
+        out.append(self.text[pos:])
+        return ''.join(out)
+
+    def byte_edits(self):
+        """`edits()` with offsets converted to UTF-8 byte offsets."""
+        edits = self.edits()
+        if self.text.isascii():
+            return [(start, end - start, replacement.encode('utf-8')) for start, end, replacement in edits]
+        result = []
+        pos = byte_pos = 0
+        for start, end, replacement in edits:
+            byte_pos += len(self.text[pos:start].encode('utf-8'))
+            length = len(self.text[start:end].encode('utf-8'))
+            result.append((byte_pos, length, replacement.encode('utf-8')))
+            pos = start
+        return result
+
+    def save(self, path=None):
+        """
+        Applies the edits to the file on disk as byte spans and writes it
+        atomically. Returns False when there was nothing to write.
+        """
+        if not self.changed:
+            return False
+        with EditBuffer(self.path) as buf:
+            if len(buf) != len(self.text.encode('utf-8')):
+                raise RuntimeError(f"{self.path} changed on disk since it was loaded")
+            for offset, length, replacement in self.byte_edits():
+                buf.replace(offset, length, replacement)
+            return buf.commit(path)
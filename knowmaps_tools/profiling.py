@@ -0,0 +1,254 @@
+"""
+profiling.py
+
+Phase profiler behind `python -m knowmaps_tools --profile`.
+
+The tools are not annotated by hand. INSTRUMENTS names the functions that
+do each kind of work, and `Profiler.install()` wraps them in place:
+
+    read        getting bytes off disk: project files, caches, logs, models
+    parse       turning bytes into structure: pbxproj, YAML, Swift, JSON, protobuf
+    transform   computing and applying edits, indexes and checks
+    write       rendering and writing results
+
+Every wrapper counts calls and measures inclusive time and self time (time
+not spent in another instrumented function it called) on a per-thread
+stack, so nested phases are never counted twice; time outside every
+instrumented function is reported as `other`. Generator functions are
+timed per resumption. Work done in process pools happens in other
+processes and is not seen.
+
+Usage:
+    profiler = Profiler()
+    profiler.install()
+    ...
+    trace = profiler.trace(wall_seconds)
+"""
+
+import functools
+import importlib
+import inspect
+import sys
+import threading
+import time
+
+PHASES = ('read', 'parse', 'transform', 'write')
+
+# module -> {qualified name: phase}
+INSTRUMENTS = {
+    'knowmaps_tools.pbxproj': {
+        'PBXProject.load': 'read',
+        'PBXProject.__init__': 'parse',
+        'PBXProject.serialize': 'write',
+        'PBXProject.save': 'write',
+    },
+    'knowmaps_tools.edit_buffer': {
+        'EditBuffer.__init__': 'read',
+        'atomic_write': 'write',
+    },
+    'knowmaps_tools.ids': {'IDAllocator.from_text': 'parse'},
+    'knowmaps_tools.references': {
+        'ReferenceIndex.__init__': 'transform',
+        'ReferenceIndex.remove_many': 'transform',
+    },
+    'knowmaps_tools.transaction': {'ProjectTransaction.apply': 'transform'},
+    'knowmaps_tools.disk_index': {
+        'DiskIndex._load': 'read',
+        'DiskIndex.update': 'read',
+        'DiskIndex.save': 'write',
+    },
+    'knowmaps_tools.sync': {
+        'load_spec': 'parse',
+        'resolve_paths': 'transform',
+        'ProjectSync.compute': 'transform',
+        'ProjectSync.apply': 'transform',
+    },
+    'knowmaps_tools.swift_syntax': {
+        'swift_files': 'read',
+        '_check_file': 'read',
+        'check_text': 'parse',
+        'load_cache': 'read',
+        'save_cache': 'write',
+    },
+    'knowmaps_tools.swift_index': {
+        '_file_sha1': 'read',
+        '_index_file': 'read',
+        'index_text': 'parse',
+        'SwiftIndex.update': 'read',
+        'SwiftIndex._providers': 'read',
+        'SwiftIndex.dependencies': 'transform',
+    },
+    'knowmaps_tools.mlmodels': {
+        '_fingerprint': 'read',
+        '_read_spec': 'read',
+        'decode_spec': 'parse',
+        '_load_cache': 'read',
+        '_save_cache': 'write',
+    },
+    'knowmaps_tools.build_logs': {
+        'BuildLogStore.ingest': 'read',
+        'LogParser.feed': 'parse',
+    },
+    'knowmaps_tools.compile_times': {
+        'CompileTimeStore.ingest': 'read',
+        'parse_log': 'parse',
+    },
+    'knowmaps_tools.taxonomy_index': {
+        'load_taxonomy': 'parse',
+        'compile_taxonomy': 'transform',
+        'build_index': 'write',
+        'TaxonomyIndex.__init__': 'read',
+    },
+    'knowmaps_tools.taxonomy_hierarchy': {'TaxonomyHierarchy.from_index': 'transform'},
+    'knowmaps_tools.category_resolver': {
+        'CategoryResolver.load': 'read',
+        'CategoryResolver.resolve_many': 'transform',
+    },
+    'knowmaps_tools.training_data': {
+        'iter_json_array': 'parse',
+        'iter_csv': 'parse',
+        'check_record': 'transform',
+        'MinHasher.signatures': 'transform',
+    },
+    'knowmaps_tools.corpus_shards': {'_write_shard': 'write'},
+    'knowmaps_tools.leakage': {
+        'file_sha1': 'read',
+        'ShingleIndex.query': 'transform',
+    },
+    'knowmaps_tools.duplicates': {
+        'scan': 'read',
+        '_partial_hash': 'read',
+        '_full_hash': 'read',
+        'similar_files': 'transform',
+        'project_references': 'parse',
+    },
+    'knowmaps_tools.embedding_store': {
+        'EmbeddingStore.__init__': 'read',
+        'EmbeddingStore.flush': 'write',
+        'import_json': 'parse',
+        'export_json': 'write',
+    },
+    'knowmaps_tools.similarity': {
+        'SimilarityIndex.open': 'read',
+        'SimilarityIndex.build': 'write',
+        'SimilarityIndex.top_k': 'transform',
+    },
+    'knowmaps_tools.wordpiece': {
+        'load_vocab': 'read',
+        'WordPieceTokenizer.encode_batch': 'transform',
+    },
+}
+
+
+class Profiler:
+    """Wraps the INSTRUMENTS functions and accumulates per-function timings."""
+
+    def __init__(self, instruments=INSTRUMENTS):
+        self.instruments = instruments
+        # name -> [phase, calls, inclusive seconds, self seconds]
+        self.stats = {}
+        self.missing = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, phase, calls, elapsed, own):
+        with self._lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                entry = self.stats[name] = [phase, 0, 0.0, 0.0]
+            entry[1] += calls
+            entry[2] += elapsed
+            entry[3] += own
+
+    def _timed(self, name, phase, calls, call):
+        stack = self._stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._record(name, phase, calls, elapsed, elapsed - children)
+
+    def wrap(self, name, phase, func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                gen = self._timed(name, phase, 1, lambda: func(*args, **kwargs))
+                while True:
+                    try:
+                        item = self._timed(name, phase, 0, lambda: next(gen))
+                    except StopIteration as stop:
+                        return stop.value
+                    yield item
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self._timed(name, phase, 1, lambda: func(*args, **kwargs))
+        return wrapper
+
+    def install(self):
+        """Imports every instrumented module and wraps its functions; missing names are listed, not fatal."""
+        for module_name, functions in self.instruments.items():
+            module = importlib.import_module(module_name)
+            short = module_name.rsplit('.', 1)[-1]
+            for qualname, phase in functions.items():
+                *owners, attr = qualname.split('.')
+                owner = module
+                for part in owners:
+                    owner = getattr(owner, part, None)
+                raw = vars(owner).get(attr) if owner is not None else None
+                if raw is None:
+                    self.missing.append(f"{module_name}.{qualname}")
+                    continue
+                name = f"{short}.{qualname}"
+                if isinstance(raw, (classmethod, staticmethod)):
+                    replacement = type(raw)(self.wrap(name, phase, raw.__func__))
+                else:
+                    replacement = self.wrap(name, phase, raw)
+                self._replace(owner, attr, raw, replacement)
+
+    def _replace(self, owner, attr, raw, replacement):
+        setattr(owner, attr, replacement)
+        self._patched.append((owner, attr, raw))
+        if inspect.ismodule(owner):
+            # Other modules hold their own reference through `from .x import f`.
+            for name, module in list(sys.modules.items()):
+                if module is None or module is owner or not name.startswith('knowmaps_tools.'):
+                    continue
+                for key, value in list(vars(module).items()):
+                    if value is raw:
+                        setattr(module, key, replacement)
+                        self._patched.append((module, key, raw))
+
+    def uninstall(self):
+        for owner, attr, raw in reversed(self._patched):
+            setattr(owner, attr, raw)
+        self._patched = []
+
+    def trace(self, wall):
+        """The JSON-ready trace for a run that took `wall` seconds."""
+        phases = {phase: {'seconds': 0.0, 'calls': 0} for phase in PHASES}
+        functions = []
+        for name, (phase, calls, inclusive, own) in self.stats.items():
+            phases[phase]['seconds'] += own
+            phases[phase]['calls'] += calls
+            functions.append({'name': name, 'phase': phase, 'calls': calls,
+                              'self s': round(own, 6), 'total s': round(inclusive, 6)})
+        functions.sort(key=lambda f: -f['self s'])
+        accounted = sum(p['seconds'] for p in phases.values())
+        phases['other'] = {'seconds': max(0.0, wall - accounted), 'calls': 0}
+        for entry in phases.values():
+            entry['seconds'] = round(entry['seconds'], 6)
+        return {'wall s': round(wall, 6), 'phases': phases, 'functions': functions, 'missing': self.missing}
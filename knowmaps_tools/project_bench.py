@@ -0,0 +1,441 @@
+"""
+project_bench.py
+
+Scaling benchmark for the pbxproj tooling on synthetic projects.
+
+For every size (1k, 10k and 100k source files by default) a project
+directory is generated the way this repo lays one out: a project.yml with
+an app and a test target, a `Know Maps.xcodeproj/project.pbxproj` written
+in Xcode's own format, and a matching source tree. The groups nest up to
+DEPTH levels, a share of the files reuse a handful of common basenames
+(View.swift, Model.swift, ...) in different directories, and disk and
+project disagree on 1% of the files in each direction so reconciliation
+has real work to do.
+
+Each operation then runs in a fresh interpreter, so peak RSS is its own:
+
+    parse       PBXProject.load of the project file
+    serialize   re-rendering every object and serializing the project
+    add         load, add 1% new files through a ProjectTransaction, save
+    purge       load, purge 1% of the basenames (duplicates included), save
+    reconcile   ProjectSync against project.yml with a cold disk index, apply
+
+Wall time and peak RSS are recorded as JSON. Every result is checked
+against a budget that grows linearly with the file count, so superlinear
+behaviour fails at the larger sizes even when the small ones pass; a
+previous result file can be given as a baseline as well. The exit status
+is 1 when any budget is exceeded or a serialization does not reproduce the
+project file it was loaded from.
+
+Usage:
+    python -m knowmaps_tools.project_bench [--sizes 1000,10000,100000] [--ops parse,add,...]
+        [--out results.json] [--budget budgets.json] [--baseline previous.json] [--tolerance 0.25]
+        [--keep DIR]
+"""
+
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import option
+from .disk_index import CACHE_DIR, REPO_ROOT, default_cache_path
+from .ids import generate_id
+from .pbxproj import quote
+from .sync import PBXPROJ_NAME, SPEC_NAME
+
+SIZES = (1000, 10000, 100000)
+OPS = ('parse', 'serialize', 'add', 'purge', 'reconcile')
+RESULTS_PATH = os.path.join(CACHE_DIR, 'project-bench.json')
+DEPTH = 8
+FILES_PER_GROUP = 20
+DUPLICATE_SHARE = 0.05
+DUPLICATE_NAMES = ('View.swift', 'Model.swift', 'ViewModel.swift', 'Helpers.swift', 'Extensions.swift',
+                   'Constants.swift', 'Service.swift', 'Tests.swift')
+DRIFT = 0.01
+TEST_SHARE = 0.1
+
+# op -> {metric: (fixed, per 1k files)}
+BUDGETS = {
+    'parse': {'wall s': (0.5, 0.2), 'peak rss MB': (100, 25)},
+    'serialize': {'wall s': (0.5, 0.2), 'peak rss MB': (100, 25)},
+    'add': {'wall s': (1.0, 0.4), 'peak rss MB': (100, 30)},
+    'purge': {'wall s': (1.0, 0.4), 'peak rss MB': (100, 30)},
+    'reconcile': {'wall s': (1.0, 0.6), 'peak rss MB': (100, 30)},
+}
+
+TARGETS = (('App', 'App'), ('AppTests', 'AppTests'))
+
+
+def _id(*parts):
+    return generate_id('\0'.join(('project-bench',) + tuple(str(p) for p in parts)))
+
+
+def synthetic_tree(files, seed=0):
+    """
+    {root: [(directory, name)]} for `files` source files under the App and
+    AppTests roots. Directories are '/'-joined paths below the root ('' for
+    the root itself), nested up to DEPTH levels.
+    """
+    rng = random.Random(seed)
+    tree = {}
+    counts = {'App': files - int(files * TEST_SHARE), 'AppTests': int(files * TEST_SHARE)}
+    for root, count in counts.items():
+        dirs = ['']
+        for i in range(max(1, count // FILES_PER_GROUP) - 1):
+            parent = rng.choice(dirs[-16:] if rng.random() < 0.5 else dirs)
+            if parent.count('/') + 1 >= DEPTH:
+                parent = ''
+            dirs.append(f"{parent}/Group{i}" if parent else f"Group{i}")
+        used = set()
+        entries = []
+        for i in range(count):
+            directory = rng.choice(dirs)
+            name = rng.choice(DUPLICATE_NAMES) if rng.random() < DUPLICATE_SHARE else f"{root}Type{i}.swift"
+            if (directory, name) in used:
+                name = f"{root}Type{i}.swift"
+            used.add((directory, name))
+            entries.append((directory, name))
+        tree[root] = entries
+    return tree
+
+
+def _object_line(object_id, comment, fields):
+    body = ' '.join(f"{key} = {value};" for key, value in fields)
+    return f"\t\t{object_id} /* {comment} */ = {{{body} }};\n"
+
+
+def _object_block(object_id, comment, fields):
+    head = f"{object_id} /* {comment} */" if comment is not None else object_id
+    lines = [f"\t\t{head} = {{\n"]
+    for key, value in fields:
+        if isinstance(value, list):
+            lines.append(f"\t\t\t{key} = (\n")
+            lines.extend(f"\t\t\t\t{item},\n" for item in value)
+            lines.append("\t\t\t);\n")
+        elif isinstance(value, dict):
+            lines.append(f"\t\t\t{key} = {{\n")
+            lines.extend(f"\t\t\t\t{k} = {v};\n" for k, v in value.items())
+            lines.append("\t\t\t};\n")
+        else:
+            lines.append(f"\t\t\t{key} = {value};\n")
+    lines.append("\t\t};\n")
+    return ''.join(lines)
+
+
+def synthetic_pbxproj(tree):
+    """Project text for `tree` ({root: [(directory, name)]}) in Xcode's layout."""
+    sections = {isa: [] for isa in ('PBXBuildFile', 'PBXFileReference', 'PBXGroup', 'PBXNativeTarget',
+                                    'PBXProject', 'PBXSourcesBuildPhase', 'XCBuildConfiguration',
+                                    'XCConfigurationList')}
+    main_id = _id('group', '')
+    products_id = _id('group', 'Products')
+    project_id = _id('project')
+    main_children = []
+    product_ids = []
+    target_ids = []
+    for target, root in TARGETS:
+        phase_id = _id('phase', target)
+        groups = {'': []}
+        build_ids = []
+        for directory, name in tree[root]:
+            parts = directory.split('/') if directory else []
+            for depth in range(len(parts)):
+                path = '/'.join(parts[:depth + 1])
+                if path not in groups:
+                    groups[path] = []
+                    groups['/'.join(parts[:depth])].append(f"{_id('group', root, path)} /* {parts[depth]} */")
+            file_id = _id('ref', root, directory, name)
+            build_id = _id('build', root, directory, name)
+            groups[directory].append(f"{file_id} /* {name} */")
+            build_ids.append(f"{build_id} /* {name} in Sources */")
+            sections['PBXFileReference'].append(_object_line(file_id, name, (
+                ('isa', 'PBXFileReference'), ('lastKnownFileType', 'sourcecode.swift'),
+                ('path', quote(name)), ('sourceTree', '"<group>"'))))
+            sections['PBXBuildFile'].append(_object_line(build_id, f"{name} in Sources", (
+                ('isa', 'PBXBuildFile'), ('fileRef', f"{file_id} /* {name} */"))))
+        for path, children in groups.items():
+            name = path.rsplit('/', 1)[-1] if path else root
+            sections['PBXGroup'].append(_object_block(_id('group', root, path), name, (
+                ('isa', 'PBXGroup'), ('children', children), ('path', quote(name)), ('sourceTree', '"<group>"'))))
+        main_children.append(f"{_id('group', root, '')} /* {root} */")
+        product = f"{target}.app" if target == 'App' else f"{target}.xctest"
+        product_id = _id('product', target)
+        product_ids.append(f"{product_id} /* {product} */")
+        sections['PBXFileReference'].append(_object_line(product_id, product, (
+            ('isa', 'PBXFileReference'), ('explicitFileType', 'wrapper.application' if target == 'App' else 'wrapper.cfbundle'),
+            ('includeInIndex', '0'), ('path', product), ('sourceTree', 'BUILT_PRODUCTS_DIR'))))
+        sections['PBXSourcesBuildPhase'].append(_object_block(phase_id, 'Sources', (
+            ('isa', 'PBXSourcesBuildPhase'), ('buildActionMask', '2147483647'), ('files', build_ids),
+            ('runOnlyForDeploymentPostprocessing', '0'))))
+        configs = []
+        for config in ('Debug', 'Release'):
+            config_id = _id('config', target, config)
+            configs.append(f"{config_id} /* {config} */")
+            sections['XCBuildConfiguration'].append(_object_block(config_id, config, (
+                ('isa', 'XCBuildConfiguration'),
+                ('buildSettings', {'PRODUCT_BUNDLE_IDENTIFIER': f"com.example.{target}", 'SDKROOT': 'iphoneos'}),
+                ('name', config))))
+        list_id = _id('configlist', target)
+        sections['XCConfigurationList'].append(_object_block(list_id, f'Build configuration list for PBXNativeTarget "{target}"', (
+            ('isa', 'XCConfigurationList'), ('buildConfigurations', configs),
+            ('defaultConfigurationIsVisible', '0'), ('defaultConfigurationName', 'Release'))))
+        target_id = _id('target', target)
+        target_ids.append(f"{target_id} /* {target} */")
+        sections['PBXNativeTarget'].append(_object_block(target_id, target, (
+            ('isa', 'PBXNativeTarget'), ('buildConfigurationList', f'{list_id} /* Build configuration list for PBXNativeTarget "{target}" */'),
+            ('buildPhases', [f"{phase_id} /* Sources */"]), ('buildRules', []), ('dependencies', []),
+            ('name', target), ('productName', target), ('productReference', f"{product_id} /* {product} */"),
+            ('productType', '"com.apple.product-type.application"' if target == 'App'
+             else '"com.apple.product-type.bundle.unit-test"'))))
+    main_children.append(f"{products_id} /* Products */")
+    sections['PBXGroup'].append(_object_block(main_id, None, (
+        ('isa', 'PBXGroup'), ('children', main_children), ('sourceTree', '"<group>"'))))
+    sections['PBXGroup'].append(_object_block(products_id, 'Products', (
+        ('isa', 'PBXGroup'), ('children', product_ids), ('name', 'Products'), ('sourceTree', '"<group>"'))))
+    configs = []
+    for config in ('Debug', 'Release'):
+        config_id = _id('config', '', config)
+        configs.append(f"{config_id} /* {config} */")
+        sections['XCBuildConfiguration'].append(_object_block(config_id, config, (
+            ('isa', 'XCBuildConfiguration'), ('buildSettings', {'SWIFT_VERSION': '5.0'}), ('name', config))))
+    list_id = _id('configlist', '')
+    sections['XCConfigurationList'].append(_object_block(list_id, 'Build configuration list for PBXProject "Bench"', (
+        ('isa', 'XCConfigurationList'), ('buildConfigurations', configs),
+        ('defaultConfigurationIsVisible', '0'), ('defaultConfigurationName', 'Release'))))
+    sections['PBXProject'].append(_object_block(project_id, 'Project object', (
+        ('isa', 'PBXProject'), ('buildConfigurationList', f'{list_id} /* Build configuration list for PBXProject "Bench" */'),
+        ('compatibilityVersion', '"Xcode 14.0"'), ('developmentRegion', 'en'), ('hasScannedForEncodings', '0'),
+        ('knownRegions', ['Base', 'en']), ('mainGroup', main_id), ('productRefGroup', f"{products_id} /* Products */"),
+        ('projectDirPath', '""'), ('projectRoot', '""'), ('targets', target_ids))))
+
+    out = ['// !$*UTF8*$!\n{\n\tarchiveVersion = 1;\n\tclasses = {\n\t};\n\tobjectVersion = 63;\n\tobjects = {\n']
+    for isa, objects in sections.items():
+        # Xcode keeps every section sorted by object ID.
+        objects.sort()
+        out.append(f"\n/* Begin {isa} section */\n")
+        out.extend(objects)
+        out.append(f"/* End {isa} section */\n")
+    out.append(f"\t}};\n\trootObject = {project_id} /* Project object */;\n}}\n")
+    return ''.join(out)
+
+
+def generate(project_dir, files, seed=0):
+    """
+    Writes a synthetic project with `files` sources to `project_dir`. Disk and
+    project each hold DRIFT of the files the other lacks. Returns the tree
+    that was put in the project.
+    """
+    tree = synthetic_tree(files, seed)
+    rng = random.Random(seed + 1)
+    in_project = {}
+    for root, entries in tree.items():
+        missing = set(rng.sample(range(len(entries)), int(len(entries) * DRIFT)))
+        stale = set(rng.sample(range(len(entries)), int(len(entries) * DRIFT))) - missing
+        in_project[root] = [entry for i, entry in enumerate(entries) if i not in missing]
+        made = set()
+        for i, (directory, name) in enumerate(entries):
+            if i in stale:
+                continue
+            folder = os.path.join(project_dir, root, *directory.split('/')) if directory else os.path.join(project_dir, root)
+            if folder not in made:
+                os.makedirs(folder, exist_ok=True)
+                made.add(folder)
+            with open(os.path.join(folder, name), 'w') as f:
+                f.write(f"struct {os.path.splitext(name)[0]}{i} {{ }}\n")
+    with open(os.path.join(project_dir, SPEC_NAME), 'w') as f:
+        f.write("name: Bench\ntargets:\n")
+        for target, root in TARGETS:
+            f.write(f"  {target}:\n    type: {'application' if target == 'App' else 'bundle.unit-test'}\n"
+                    f"    platform: iOS\n    sources:\n      - path: {root}\n")
+    pbxproj = os.path.join(project_dir, PBXPROJ_NAME)
+    os.makedirs(os.path.dirname(pbxproj), exist_ok=True)
+    with open(pbxproj + '.orig', 'w') as f:
+        f.write(synthetic_pbxproj(in_project))
+    return in_project
+
+
+def _restore(project_dir):
+    pbxproj = os.path.join(project_dir, PBXPROJ_NAME)
+    shutil.copyfile(pbxproj + '.orig', pbxproj)
+    return pbxproj
+
+
+def _drop_disk_indexes(project_dir):
+    for _, root in TARGETS:
+        try:
+            os.remove(default_cache_path(os.path.join(project_dir, root)))
+        except OSError:
+            pass
+
+
+def run_op(op, project_dir, seed=0):
+    """Runs one operation in this process; returns its measurements."""
+    from .pbxproj import PBXProject
+    from .references import ReferenceIndex
+    from .sync import ProjectSync
+    from .transaction import ProjectTransaction
+
+    pbxproj = _restore(project_dir)
+    _drop_disk_indexes(project_dir)
+    result = {'bytes': os.path.getsize(pbxproj)}
+    rng = random.Random(seed + 2)
+    if op == 'serialize':
+        # Only rendering is timed; the other operations load the project themselves.
+        project = PBXProject.load(pbxproj)
+        result['objects'] = len(project.objects)
+    result['base rss MB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if op == 'parse':
+        result['objects'] = len(PBXProject.load(pbxproj).objects)
+    elif op == 'serialize':
+        for obj in project.objects.values():
+            obj.touch()
+        text = project.serialize()
+        result['written bytes'] = len(text.encode('utf-8'))
+        # Every object was re-rendered; a faithful renderer reproduces the file.
+        result['identical'] = text == project.text
+    elif op == 'add':
+        project = PBXProject.load(pbxproj)
+        result['objects'] = len(project.objects)
+        groups = sorted(obj.id for obj in project.iter_isa('PBXGroup'))
+        phase_id = next(obj.id for obj in project.iter_isa('PBXSourcesBuildPhase'))
+        count = max(10, sum(1 for _ in project.iter_isa('PBXFileReference')) // 100)
+        with ProjectTransaction(project) as txn:
+            for i in range(count):
+                txn.add_file(f"BenchAdded{i}.swift", rng.choice(groups), phase_id)
+        result['added'] = count
+    elif op == 'purge':
+        project = PBXProject.load(pbxproj)
+        result['objects'] = len(project.objects)
+        refs = ReferenceIndex(project)
+        names = sorted(refs.file_refs_by_name)
+        chosen = rng.sample(names, max(1, len(names) // 100)) + list(DUPLICATE_NAMES[:2])
+        result['removed'] = len(refs.purge(chosen))
+        project.save()
+    elif op == 'reconcile':
+        sync = ProjectSync(project_dir)
+        plan = sync.compute()
+        result['inserts'] = sum(len(inserts) for _, inserts, _ in plan.values())
+        result['deletes'] = sum(len(deletes) for _, _, deletes in plan.values())
+        sync.apply()
+    else:
+        raise ValueError(f"Unknown operation {op!r}")
+    result['wall s'] = time.perf_counter() - start
+    result['peak rss MB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    _drop_disk_indexes(project_dir)
+    return result
+
+
+def measure(op, project_dir):
+    """Runs `run_op` in a fresh interpreter and returns its result."""
+    proc = subprocess.run([sys.executable, '-m', 'knowmaps_tools.project_bench', 'op', op, project_dir],
+                          cwd=REPO_ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{op} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout)
+
+
+def budget_for(budgets, op, files):
+    """{metric: limit} for an operation at a file count; limits grow linearly."""
+    return {metric: fixed + per_k * files / 1000 for metric, (fixed, per_k) in budgets.get(op, {}).items()}
+
+
+def check(results, budgets, baseline=None, tolerance=0.25):
+    """
+    Returns a failure message for every result over its budget or over the
+    baseline, and for every serialization that did not reproduce its input.
+    """
+    failures = []
+    previous = {(r['op'], r['files']): r for r in (baseline or {}).get('results', ())}
+    for result in results:
+        op, files = result['op'], result['files']
+        if result.get('identical') is False:
+            failures.append(f"{op} @ {files:,}: output differs from the project it was loaded from")
+        for metric, limit in budget_for(budgets, op, files).items():
+            if result[metric] > limit:
+                failures.append(f"{op} @ {files:,}: {metric} {result[metric]:.2f} > budget {limit:.2f}")
+        before = previous.get((op, files))
+        if before is not None:
+            for metric in ('wall s', 'peak rss MB'):
+                if result[metric] > before[metric] * (1 + tolerance):
+                    failures.append(f"{op} @ {files:,}: {metric} {result[metric]:.2f} > baseline "
+                                    f"{before[metric]:.2f} +{tolerance:.0%}")
+    return failures
+
+
+def run(sizes=SIZES, ops=OPS, budgets=BUDGETS, baseline=None, tolerance=0.25, keep=None, log=None):
+    """Generates each size, measures each operation and returns the result document."""
+    scratch = keep or tempfile.mkdtemp(prefix='knowmaps-bench-')
+    results = []
+    try:
+        for files in sizes:
+            project_dir = os.path.join(scratch, f"project-{files}")
+            if not os.path.exists(os.path.join(project_dir, PBXPROJ_NAME + '.orig')):
+                start = time.perf_counter()
+                generate(project_dir, files)
+                if log:
+                    log(f"generated {files:,} files in {time.perf_counter() - start:.1f} s")
+            for op in ops:
+                result = dict(op=op, files=files, **measure(op, project_dir))
+                results.append(result)
+                if log:
+                    log(f"{op:10} {files:>8,} files  {result['wall s']:8.3f} s  {result['peak rss MB']:8.1f} MB")
+    finally:
+        if keep is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    document = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    document['failures'] = check(results, budgets, baseline, tolerance)
+    return document
+
+
+def _load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    if args[:1] == ['op'] and len(args) == 3:
+        print(json.dumps(run_op(args[1], args[2])))
+        return 0
+    if args and args[0] not in ('--sizes', '--ops', '--out', '--budget', '--baseline', '--tolerance', '--keep'):
+        print("Usage: python -m knowmaps_tools.project_bench [--sizes N,...] [--ops OP,...] [--out PATH] "
+              "[--budget PATH] [--baseline PATH] [--tolerance F] [--keep DIR]")
+        return 2
+    sizes = [int(n) for n in option(args, '--sizes', ','.join(map(str, SIZES))).split(',')]
+    ops = option(args, '--ops', ','.join(OPS)).split(',')
+    budgets = dict(BUDGETS)
+    if '--budget' in args:
+        budgets.update((op, {m: tuple(v) for m, v in limits.items()})
+                       for op, limits in _load_json(option(args, '--budget', None)).items())
+    baseline = _load_json(option(args, '--baseline', None)) if '--baseline' in args else None
+    keep = option(args, '--keep', None)
+    if keep:
+        os.makedirs(keep, exist_ok=True)
+    document = run(sizes, ops, budgets, baseline, float(option(args, '--tolerance', 0.25)), keep,
+                   log=lambda line: print(line, flush=True))
+    out = option(args, '--out', RESULTS_PATH)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(document, f, indent=1)
+    for failure in document['failures']:
+        print(f"FAIL {failure}")
+    print(f"{len(document['results'])} measurement(s) written to {out}; {len(document['failures'])} failure(s).")
+    return 1 if document['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+references.py
+
+Reverse-reference index over a parsed project.pbxproj.
+
+Built in one pass over the object graph, the index answers which build files
+point at a file reference, which build phases list a build file and which
+groups hold an object. `remove()` cascades through all of them, and `purge()`
+does the same for a batch of filenames so that dropping hundreds of stale
+views costs one parse and one write.
+
+Usage:
+    project = PBXProject.load(PBXPROJ_PATH)
+    refs = ReferenceIndex(project)
+    refs.purge(['SearchView.swift', 'SavedListView.swift'])
+    project.save()
+"""
+
+import os
+
+
+class ReferenceIndex:
+    """fileRef -> build files -> phases, and object -> parent groups."""
+
+    def __init__(self, project):
+        self.project = project
+        self.build_files = {}
+        self.phases = {}
+        self.parents = {}
+        self.file_refs_by_name = {}
+        for obj in project.objects.values():
+            self._index(obj)
+
+    def _index(self, obj):
+        fields = obj.fields
+        isa = fields.get('isa')
+        if 'children' in fields:
+            for child in fields['children']:
+                self.parents.setdefault(child, set()).add(obj.id)
+        if isa == 'PBXBuildFile':
+            if 'fileRef' in fields:
+                self.build_files.setdefault(fields['fileRef'], set()).add(obj.id)
+        elif isa == 'PBXFileReference':
+            name = os.path.basename(fields.get('name') or fields.get('path', ''))
+            self.file_refs_by_name.setdefault(name, set()).add(obj.id)
+        elif isa is not None and isa.endswith('BuildPhase'):
+            for build_id in fields.get('files', ()):
+                self.phases.setdefault(build_id, set()).add(obj.id)
+
+    # Lookup
+
+    def find_file_refs(self, filename):
+        return sorted(self.file_refs_by_name.get(filename, ()))
+
+    def build_files_for(self, file_id):
+        return sorted(self.build_files.get(file_id, ()))
+
+    def phases_for(self, build_id):
+        return sorted(self.phases.get(build_id, ()))
+
+    def parents_of(self, object_id):
+        return sorted(self.parents.get(object_id, ()))
+
+    def orphans(self):
+        """
+        Returns dangling entries as (kind, object_id, missing_id) tuples:
+        build files whose fileRef is gone, and phase or group entries that
+        name an object which no longer exists.
+        """
+        objects = self.project.objects
+        found = []
+        for file_id, build_ids in self.build_files.items():
+            if file_id not in objects:
+                found.extend(('build-file', build_id, file_id) for build_id in sorted(build_ids) if build_id in objects)
+        for build_id, phase_ids in self.phases.items():
+            if build_id not in objects:
+                found.extend(('phase-entry', phase_id, build_id) for phase_id in sorted(phase_ids) if phase_id in objects)
+        for child_id, group_ids in self.parents.items():
+            if child_id not in objects:
+                found.extend(('group-child', group_id, child_id) for group_id in sorted(group_ids) if group_id in objects)
+        return sorted(found)
+
+    # Removal
+
+    def remove(self, file_id):
+        """Removes a file reference and everything that depends on it."""
+        return self.remove_many([file_id])
+
+    def remove_many(self, file_ids):
+        """
+        Cascades removal of many file references in one pass: their build
+        files, the build-phase entries for those build files and the group
+        children entries. Each affected list is rewritten once. Returns the
+        removed object IDs.
+        """
+        project = self.project
+        doomed = set()
+        for file_id in file_ids:
+            if file_id not in project or file_id in doomed:
+                continue
+            doomed.add(file_id)
+            doomed.update(b for b in self.build_files.get(file_id, ()) if b in project)
+
+        containers = {}
+        for object_id in doomed:
+            for group_id in self.parents.get(object_id, ()):
+                containers.setdefault(group_id, 'children')
+            for phase_id in self.phases.get(object_id, ()):
+                containers.setdefault(phase_id, 'files')
+        for container_id, key in containers.items():
+            container = project.get(container_id)
+            if container is None or container_id in doomed:
+                continue
+            container[key] = [item for item in container[key] if item not in doomed]
+
+        for object_id in doomed:
+            obj = project.remove(object_id)
+            if obj.isa == 'PBXFileReference':
+                name = os.path.basename(obj.get('name') or obj.get('path', ''))
+                self.file_refs_by_name.get(name, set()).discard(object_id)
+                self.build_files.pop(object_id, None)
+            self.parents.pop(object_id, None)
+            self.phases.pop(object_id, None)
+        return sorted(doomed)
+
+    def purge(self, filenames):
+        """Removes every file reference whose basename is in `filenames`."""
+        file_ids = []
+        for filename in filenames:
+            file_ids.extend(self.find_file_refs(filename))
+        return self.remove_many(file_ids)
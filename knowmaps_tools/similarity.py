@@ -0,0 +1,369 @@
+"""
+similarity.py
+
+Offline cosine top-k ranking over place and category embeddings, with the
+scoring of HybridRecommenderModel.score and
+VectorEmbeddingService.batchSemanticScores.
+
+The app compares one pair at a time and recomputes both norms on every
+call. Here item vectors are L2-normalized once into a float32 matrix, so
+cosine similarity is a dot product and a whole batch of user or query
+vectors is scored with one matrix multiply. The k best items per query are
+cut with argpartition. Zero vectors score 0 against everything, as they do
+in the app.
+
+An index can live in memory or be written to disk as a directory:
+
+    vectors.npy   normalized float32 rows, memory-mapped when opened
+    keys.txt      one key per line, row order; written last
+
+Scoring walks the rows in chunks on a thread pool (NumPy releases the GIL
+in matrix multiplies and page faults), keeps only each chunk's top-k and
+merges those, so an index larger than RAM is scanned with bounded memory.
+
+Scores are float32 where the app uses Double; they agree to about 1e-6,
+which `verify` checks against a transliteration of the Swift arithmetic.
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.similarity build STORE_DIR INDEX_DIR
+    python -m knowmaps_tools.similarity neighbors INDEX_DIR KEY... [--k 10]
+    python -m knowmaps_tools.similarity verify
+    python -m knowmaps_tools.similarity bench [--size 1000000] [--dim 384] [--queries 64] [--threads N]
+"""
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import option
+from .edit_buffer import atomic_write
+
+VECTORS_FILE = 'vectors.npy'
+KEYS_FILE = 'keys.txt'
+# Bytes of (query x item) scores one chunk may allocate.
+SCORE_BUDGET = 64 << 20
+QUERY_BLOCK = 1024
+BUILD_CHUNK = 65536
+
+
+def normalize_rows(vectors):
+    """Float32 copy of `vectors` (2-d) with every non-zero row scaled to unit length."""
+    import numpy as np
+
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix, dtype=np.float64))
+    nonzero = norms > 0
+    matrix[nonzero] /= norms[nonzero, None].astype(np.float32)
+    return matrix
+
+
+def cosine(a, b):
+    """HybridRecommenderModel.score, step for step: 0 for empty, mismatched or zero vectors."""
+    if not a or len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if norm_a <= 0 or norm_b <= 0:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+class SimilarityIndex:
+    """Keys plus a row-normalized float32 matrix, in memory or memory-mapped."""
+
+    def __init__(self, keys, vectors, normalized=False):
+        import numpy as np
+
+        self._np = np
+        self.keys = list(keys)
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+        if len(self.keys) != len(self.vectors):
+            raise ValueError(f"{len(self.keys)} keys for {len(self.vectors)} vectors")
+        self._position = None
+
+    @classmethod
+    def from_store(cls, store):
+        """In-memory index over every live vector of an EmbeddingStore."""
+        keys, matrix = store.matrix()
+        return cls(keys, matrix)
+
+    @classmethod
+    def build(cls, path, store, chunk=BUILD_CHUNK):
+        """Normalizes an EmbeddingStore into an index directory, `chunk` rows at a time."""
+        import numpy as np
+
+        os.makedirs(path, exist_ok=True)
+        keys = store.keys()
+        for key in keys:
+            if '\n' in key or '\r' in key:
+                raise ValueError(f"Key {key!r} contains a line break")
+        keys_path = os.path.join(path, KEYS_FILE)
+        if os.path.exists(keys_path):
+            os.unlink(keys_path)
+        vectors = np.lib.format.open_memmap(os.path.join(path, VECTORS_FILE), mode='w+',
+                                            dtype='<f4', shape=(len(keys), store.dim))
+        for start in range(0, len(keys), chunk):
+            _, block = store.get_many(keys[start:start + chunk])
+            vectors[start:start + len(block)] = normalize_rows(block)
+        vectors.flush()
+        del vectors
+        atomic_write(keys_path, ((key + '\n').encode('utf-8') for key in keys))
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+        import numpy as np
+
+        keys_path = os.path.join(path, KEYS_FILE)
+        try:
+            with open(keys_path, 'r', encoding='utf-8', newline='\n') as f:
+                keys = f.read().split('\n')[:-1]
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{path} has no {KEYS_FILE}; the index was not built completely") from None
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+        return cls(keys, vectors, normalized=True)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def row(self, key):
+        if self._position is None:
+            self._position = {k: i for i, k in enumerate(self.keys)}
+        try:
+            return self._position[key]
+        except KeyError:
+            raise KeyError(f"Unknown key {key!r}") from None
+
+    def _queries(self, queries):
+        queries = normalize_rows(queries)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d queries, got {queries.shape[1]}-d")
+        return queries
+
+    def scores(self, queries, rows=None):
+        """Dense (queries x items) cosine scores, against every item or only `rows`."""
+        vectors = self.vectors if rows is None else self.vectors[self._np.asarray(rows, dtype=self._np.int64)]
+        return self._queries(queries) @ self._np.asarray(vectors).T
+
+    def top_k(self, queries, k=10, threads=None, chunk_rows=None):
+        """
+        (scores, rows): two (queries x k) arrays, best first, where k is capped
+        at the item count. Items tied at the k-th score may be either one.
+        """
+        np = self._np
+        queries = self._queries(queries)
+        k = min(k, len(self))
+        if k <= 0 or not len(queries):
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        threads = threads or os.cpu_count() or 1
+        best_scores, best_rows = [], []
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for first in range(0, len(queries), QUERY_BLOCK):
+                block = queries[first:first + QUERY_BLOCK]
+                rows = chunk_rows or max(k, SCORE_BUDGET // (4 * len(block)))
+                scores, found = None, None
+                for chunk_scores, chunk_rows_found in pool.map(lambda start: self._chunk_top_k(block, start, rows, k),
+                                                               range(0, len(self), rows)):
+                    if scores is None:
+                        scores, found = chunk_scores, chunk_rows_found
+                    else:
+                        scores, found = _merge(np, scores, found, chunk_scores, chunk_rows_found, k)
+                order = np.lexsort((found, -scores), axis=1)
+                best_scores.append(np.take_along_axis(scores, order, 1))
+                best_rows.append(np.take_along_axis(found, order, 1))
+        return np.concatenate(best_scores), np.concatenate(best_rows)
+
+    def _chunk_top_k(self, queries, start, rows, k):
+        np = self._np
+        scores = queries @ np.asarray(self.vectors[start:start + rows]).T
+        if scores.shape[1] <= k:
+            found = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape).copy()
+            return scores, found
+        part = np.argpartition(scores, -k, axis=1)[:, -k:]
+        return np.take_along_axis(scores, part, 1), part + start
+
+    def search(self, queries, k=10, threads=None):
+        """[[(key, score), ...] per query], best first."""
+        scores, rows = self.top_k(queries, k, threads)
+        return [[(self.keys[r], float(s)) for s, r in zip(score_row, row)] for score_row, row in zip(scores, rows)]
+
+    def neighbors(self, keys, k=10, threads=None):
+        """Nearest other items of stored keys: {key: [(key, score), ...]}."""
+        rows = [self.row(key) for key in keys]
+        scores, found = self.top_k(self._np.asarray(self.vectors[rows]), k + 1, threads)
+        result = {}
+        for key, row, score_row, found_row in zip(keys, rows, scores, found):
+            result[key] = [(self.keys[r], float(s)) for s, r in zip(score_row, found_row) if r != row][:k]
+        return result
+
+
+def _merge(np, scores, rows, more_scores, more_rows, k):
+    scores = np.concatenate((scores, more_scores), axis=1)
+    rows = np.concatenate((rows, more_rows), axis=1)
+    if scores.shape[1] <= k:
+        return scores, rows
+    part = np.argpartition(scores, -k, axis=1)[:, -k:]
+    return np.take_along_axis(scores, part, 1), np.take_along_axis(rows, part, 1)
+
+
+# Verification and benchmarks
+
+def verify(items=5000, dim=64, queries=32, k=10, seed=0):
+    """
+    Checks top_k against a float64 full sort and sampled scores against the
+    Swift arithmetic, over random vectors with some zero and duplicate rows.
+    Returns a list of failures.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((items, dim)).astype(np.float32)
+    vectors[::97] = 0
+    vectors[1::89] = vectors[2::89][:len(vectors[1::89])] * 3
+    query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    query_vectors[0] = 0
+    index = SimilarityIndex([str(i) for i in range(items)], vectors)
+    failures = []
+
+    exact = np.array([[cosine(q, v) for v in vectors[:200].tolist()] for q in query_vectors.tolist()])
+    if not np.allclose(index.scores(query_vectors, range(200)), exact, atol=1e-5):
+        failures.append('scores differ from HybridRecommenderModel.score')
+
+    reference = normalize_rows(query_vectors).astype(np.float64) @ index.vectors.astype(np.float64).T
+    expected = -np.sort(-reference, axis=1)[:, :k]
+    for chunk_rows in (None, 7, 1000, items):
+        for threads in (1, 4):
+            scores, rows = index.top_k(query_vectors, k, threads=threads, chunk_rows=chunk_rows)
+            label = f"chunk_rows={chunk_rows} threads={threads}"
+            if not np.allclose(scores, expected, atol=1e-5):
+                failures.append(f"top-k scores differ ({label})")
+            if not np.allclose(np.take_along_axis(reference, rows, 1), scores, atol=1e-5):
+                failures.append(f"rows do not carry their scores ({label})")
+            if (np.diff(scores, axis=1) > 0).any():
+                failures.append(f"results not sorted ({label})")
+
+    root = tempfile.mkdtemp(prefix='knowmaps-similarity-')
+    try:
+        from .embedding_store import EmbeddingStore
+
+        with EmbeddingStore(os.path.join(root, 'store'), dim=dim) as store:
+            store.set_many(zip(index.keys, vectors))
+            on_disk = SimilarityIndex.build(os.path.join(root, 'index'), store, chunk=333)
+        if on_disk.keys != index.keys or not np.array_equal(np.asarray(on_disk.vectors), index.vectors):
+            failures.append('index built from a store differs from the in-memory index')
+        elif not np.array_equal(on_disk.top_k(query_vectors, k, chunk_rows=500)[1],
+                                index.top_k(query_vectors, k, chunk_rows=500)[1]):
+            failures.append('memory-mapped top-k differs from in-memory top-k')
+        del on_disk
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return failures
+
+
+def bench(size, dim=384, queries=64, k=10, threads=None, pairs=2000, seed=0):
+    """Returns {metric: value} for a memory-mapped index of `size` random vectors."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    results = {}
+    root = tempfile.mkdtemp(prefix='knowmaps-similarity-')
+    try:
+        vectors = np.lib.format.open_memmap(os.path.join(root, VECTORS_FILE), mode='w+', dtype='<f4', shape=(size, dim))
+        for start in range(0, size, BUILD_CHUNK):
+            count = min(BUILD_CHUNK, size - start)
+            vectors[start:start + count] = normalize_rows(rng.standard_normal((count, dim), dtype=np.float32))
+        vectors.flush()
+        del vectors
+        with open(os.path.join(root, KEYS_FILE), 'w', encoding='utf-8') as f:
+            f.writelines(f'fsq:{i:08d}\n' for i in range(size))
+        index = SimilarityIndex.open(root)
+        query_vectors = rng.standard_normal((queries, dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        index.top_k(query_vectors, k, threads)
+        elapsed = time.perf_counter() - start
+        results['top-k ms'] = elapsed * 1e3
+        results['pairs/s'] = queries * size / elapsed
+
+        sample = index.vectors[:pairs].tolist()
+        query = query_vectors[0].tolist()
+        start = time.perf_counter()
+        for item in sample:
+            cosine(query, item)
+        baseline = pairs / (time.perf_counter() - start)
+        results['pairwise pairs/s'] = baseline
+        results['speedup'] = results['pairs/s'] / baseline
+        del index
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def _positional(args):
+    """Arguments that are neither flags nor flag values."""
+    result, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg.startswith('--'):
+            skip = True
+        else:
+            result.append(arg)
+    return result
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    command = args[0] if args else 'verify'
+    positional = _positional(args[1:])
+    if command == 'build' and len(positional) == 2:
+        from .embedding_store import EmbeddingStore
+
+        with EmbeddingStore(positional[0]) as store:
+            index = SimilarityIndex.build(positional[1], store)
+        print(f"Indexed {len(index)} {index.dim}-d vectors into {positional[1]}")
+        return 0
+    if command == 'neighbors' and len(positional) >= 2:
+        index = SimilarityIndex.open(positional[0])
+        try:
+            results = index.neighbors(positional[1:], int(option(args, '--k', 10)))
+        except KeyError as e:
+            print(e.args[0])
+            return 1
+        for key, matches in results.items():
+            print(key)
+            for other, score in matches:
+                print(f"  {score:.4f} {other}")
+        return 0
+    if command == 'verify':
+        failures = verify()
+        for failure in failures:
+            print(f"Mismatch: {failure}")
+        print(f"{len(failures)} mismatch(es).")
+        return 1 if failures else 0
+    if command == 'bench':
+        size = int(option(args, '--size', 1000000))
+        dim = int(option(args, '--dim', 384))
+        queries = int(option(args, '--queries', 64))
+        threads = int(option(args, '--threads', 0)) or None
+        results = bench(size, dim, queries, threads=threads)
+        print(f"{size} items x {dim}, {queries} queries: " + ", ".join(f"{name} {value:,.1f}" for name, value in results.items()))
+        return 0
+    print("Usage: python -m knowmaps_tools.similarity build|neighbors|verify|bench ...")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
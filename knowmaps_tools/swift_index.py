@@ -0,0 +1,586 @@
+"""
+swift_index.py
+
+Persistent symbol index for the Swift sources, and the file dependencies it
+implies.
+
+Each file is lexed (comments and string literals skipped, interpolations
+kept as code) and its declarations are recorded: types, protocols,
+extensions, typealiases, functions, properties and enum cases, with the
+type or extension they belong to, plus every identifier the file mentions.
+Declarations inside function and property bodies are locals and are left
+out. Symbols are stored in .knowmaps-cache/swift-index.sqlite keyed by the
+file's content hash, with a separate path -> hash table, so a file that is
+moved or copied (View/Old/SearchView.swift, "SearchView 2.swift") reuses its
+entry instead of being lexed again. An update stats every file, hashes only
+those whose size or mtime changed and lexes only unknown contents, across a
+process pool.
+
+A file depends on every file that declares a top-level name it mentions,
+and on every extension that declares a member or conformance it mentions of
+a type it, or anything it depends on, mentions. `deps` follows that
+transitively: the files that must be in a target for one file to compile.
+Names declared by more than one of those files are reported, since both
+copies in one target is an invalid redeclaration. Types from the SDK are not
+indexed and are never required.
+
+Usage:
+    python -m knowmaps_tools.swift_index [update] [paths...] [--workers N]
+    python -m knowmaps_tools.swift_index deps FILE [--target NAME[,NAME...]] [--project DIR]
+    python -m knowmaps_tools.swift_index users FILE
+    python -m knowmaps_tools.swift_index defines NAME
+    python -m knowmaps_tools.swift_index symbols FILE
+    python -m knowmaps_tools.swift_index bench
+"""
+
+import hashlib
+import os
+import re
+import sys
+import time
+
+from .build_logs import connect
+from .common import option
+from .disk_index import CACHE_DIR
+from .swift_syntax import DEFAULT_ROOTS, _BLOCK_RE, _string_re, swift_files
+
+DB_PATH = os.path.join(CACHE_DIR, 'swift-index.sqlite')
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    sha1 TEXT PRIMARY KEY,
+    lines INTEGER NOT NULL,
+    refs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL REFERENCES contents(sha1),
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE TABLE IF NOT EXISTS symbols (
+    sha1 TEXT NOT NULL REFERENCES contents(sha1) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    container TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    extension INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+CREATE INDEX IF NOT EXISTS symbols_sha1 ON symbols (sha1);
+"""
+
+TYPE_KINDS = frozenset(('class', 'struct', 'enum', 'protocol', 'actor'))
+# Declarations whose `{` opens a body; everything else opens a plain block.
+DECL_KINDS = TYPE_KINDS | {'extension', 'typealias', 'associatedtype', 'func', 'var', 'let', 'case',
+                           'init', 'deinit', 'subscript'}
+UNNAMED_KINDS = frozenset(('init', 'deinit', 'subscript'))
+
+KEYWORDS = frozenset((
+    'actor', 'any', 'as', 'associatedtype', 'async', 'await', 'borrowing', 'break', 'case', 'catch',
+    'class', 'consuming', 'continue', 'convenience', 'default', 'defer', 'deinit', 'didSet', 'do',
+    'dynamic', 'else', 'enum', 'extension', 'fallthrough', 'false', 'fileprivate', 'final', 'for',
+    'func', 'get', 'guard', 'if', 'import', 'in', 'indirect', 'init', 'inout', 'internal', 'is',
+    'isolated', 'lazy', 'let', 'mutating', 'nil', 'nonisolated', 'nonmutating', 'open', 'operator',
+    'optional', 'override', 'package', 'private', 'protocol', 'public', 'repeat', 'required',
+    'rethrows', 'return', 'self', 'Self', 'set', 'some', 'static', 'struct', 'subscript', 'super',
+    'switch', 'throw', 'throws', 'true', 'try', 'typealias', 'unowned', 'var', 'weak', 'where',
+    'while', 'willSet', 'Any',
+))
+
+_LEX_RE = re.compile(r'''
+      //[^\n]*
+    | (?P<block>/\*)
+    | (?P<hashes>\#*)(?P<quote>"""|")
+    | ^[ \t]*\#(?P<directive>elseif|if|else|endif)\b[^\n]*
+    | (?P<ident>`?[A-Za-z_][A-Za-z0-9_]*`?)
+    | \d\w*
+    | (?P<punct>[{}()\[\].,:])
+''', re.MULTILINE | re.VERBOSE)
+
+
+def _skip_block_comment(text, pos):
+    depth = 1
+    while depth:
+        m = _BLOCK_RE.search(text, pos)
+        if m is None:
+            return len(text)
+        depth += 1 if m.group() == '/*' else -1
+        pos = m.end()
+    return pos
+
+
+def _skip_string(text, quote, hashes, pos, patterns):
+    """Position after the literal, and whether it stopped at a `\\(` interpolation instead."""
+    pattern = patterns.get((quote, hashes))
+    if pattern is None:
+        pattern = patterns[quote, hashes] = _string_re(quote, hashes)
+    while True:
+        m = pattern.search(text, pos)
+        if m is None:
+            return len(text), False
+        token = m.group()
+        pos = m.end()
+        if token.endswith('(') and token.startswith('\\') and len(token) == hashes + 2:
+            return pos, True
+        if not token.startswith('\\'):
+            return pos, False
+
+
+def index_text(text):
+    """
+    Lexes one file. Returns (symbols, refs): symbols are (name, kind,
+    container, line, in extension) tuples for the declarations at file and
+    type scope, refs the set of identifiers used anywhere in the file.
+    """
+    symbols = []
+    refs = set()
+    # [kind, name, open ( and [ inside it, qualified container for the
+    # declarations directly inside it or None for bodies, inside an extension]
+    scopes = [['file', None, 0, '', False]]
+    # Strings suspended at `\\(`: (quote, hashes, scope depth, parens at the `(`)
+    interpolations = []
+    # #if blocks: [scopes at #if, scopes the first branch left or None]
+    conditions = []
+    patterns = {}
+    expect = None       # declaration kind whose name comes next
+    pending = None      # (kind, name) whose body the next `{` at paren depth 0 opens
+    conforming = False  # inside an extension's `: A, B` list
+    previous = None     # 'ident', 'string' or the punctuation token
+    word = None         # the last identifier
+    lines = [1, 0]      # line number at offset
+
+    def line_at(offset):
+        lines[0] += text.count('\n', lines[1], offset)
+        lines[1] = offset
+        return lines[0]
+
+    pos = 0
+    end = len(text)
+    while pos < end:
+        m = _LEX_RE.search(text, pos)
+        if m is None:
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == 'block':
+            pos = _skip_block_comment(text, pos)
+            continue
+        if kind == 'quote':
+            quote, hashes = m.group('quote'), len(m.group('hashes'))
+            pos, suspended = _skip_string(text, quote, hashes, pos, patterns)
+            if suspended:
+                interpolations.append((quote, hashes, len(scopes), scopes[-1][2]))
+                scopes[-1][2] += 1
+            previous = 'string'
+            continue
+        if kind == 'directive':
+            # Like the balance checker: each branch starts from the nesting at
+            # #if, and the first branch decides where parsing continues.
+            directive = m.group('directive')
+            if directive == 'if':
+                conditions.append([[list(s) for s in scopes], None])
+            elif conditions:
+                condition = conditions[-1]
+                if condition[1] is None:
+                    condition[1] = [list(s) for s in scopes]
+                if directive == 'endif':
+                    scopes = condition[1]
+                    conditions.pop()
+                else:
+                    scopes = [list(s) for s in condition[0]]
+            continue
+        if kind is None:
+            continue
+        token = m.group()
+        scope = scopes[-1]
+
+        if kind == 'ident':
+            word = token.strip('`')
+            quoted = token[0] == '`'
+            # After `class` or `struct` a keyword is the real declaration
+            # (`class func`); after `let` or `func` it is a name (`let actor`).
+            if expect is not None and (quoted or word not in DECL_KINDS or
+                                       expect not in TYPE_KINDS and expect != 'extension'):
+                if scope[3] is not None and (expect != 'case' or scope[0] == 'enum'):
+                    symbols.append((word, expect, scope[3], line_at(m.start()), int(scope[4])))
+                if expect == 'extension':
+                    refs.add(word)
+                pending = (expect, word)
+                expect = None
+            elif not quoted and word in DECL_KINDS and previous != '.' and \
+                    not (word == 'class' and previous in (':', ',')):
+                conforming = False
+                pending = (word, None)
+                expect = None if word in UNNAMED_KINDS else word
+            elif conforming and word != 'where':
+                refs.add(word)
+                if scope[3] is not None:
+                    symbols.append((word, 'conformance', pending[1], line_at(m.start()), 1))
+            else:
+                if word == 'where':
+                    conforming = False
+                if quoted or word not in KEYWORDS:
+                    refs.add(word)
+            previous = 'ident'
+            continue
+
+        if token == '.' and previous == 'ident' and pending is not None and pending[0] == 'extension' \
+                and pending[1] is not None and word == pending[1].split('.')[-1] and not conforming:
+            # `extension Outer.Inner`
+            following = _LEX_RE.match(text, pos)
+            if following is not None and following.lastgroup == 'ident':
+                word = following.group().strip('`')
+                refs.add(word)
+                pos = following.end()
+                name = pending[1] + '.' + word
+                if symbols and symbols[-1][1] == 'extension' and symbols[-1][0] == pending[1]:
+                    symbols[-1] = (name,) + symbols[-1][1:]
+                pending = ('extension', name)
+                continue
+        # `func ==`, `let (a, b)`: nothing to name, but a body still belongs to it.
+        expect = None
+        if token == ':':
+            # Only the colon right after the name; `where T: P` is a constraint.
+            if pending is not None and pending[0] == 'extension' and pending[1] is not None and \
+                    previous == 'ident' and word == pending[1].split('.')[-1]:
+                conforming = True
+        elif token == ',':
+            if pending is not None and pending[0] == 'case' and scope[2] == 0 and scope[0] == 'enum':
+                expect = 'case'
+        elif token in '([':
+            scope[2] += 1
+        elif token in ')]':
+            if scope[2]:
+                scope[2] -= 1
+            if token == ')' and interpolations and interpolations[-1][2:] == (len(scopes), scope[2]):
+                quote, hashes, _, _ = interpolations.pop()
+                pos, suspended = _skip_string(text, quote, hashes, pos, patterns)
+                if suspended:
+                    interpolations.append((quote, hashes, len(scopes), scope[2]))
+                    scope[2] += 1
+        elif token == '{':
+            conforming = False
+            if pending is not None and scope[2] == 0:
+                body_kind, name = pending
+                container = None
+                if scope[3] is not None and name is not None and (body_kind in TYPE_KINDS or body_kind == 'extension'):
+                    container = f"{scope[3]}.{name}" if scope[3] else name
+                scopes.append([body_kind, name, 0, container, scope[4] or body_kind == 'extension'])
+                pending = None
+            else:
+                scopes.append(['block', None, 0, None, False])
+        elif token == '}':
+            pending = None
+            conforming = False
+            if len(scopes) > 1:
+                scopes.pop()
+        previous = token
+    return symbols, refs
+
+
+def _file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _index_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8', errors='replace')
+    symbols, refs = index_text(text)
+    return hashlib.sha1(data).hexdigest(), text.count('\n') + 1, symbols, sorted(refs)
+
+
+class SwiftIndex:
+    """SQLite store of per-content Swift symbols and the paths that hold each content."""
+
+    def __init__(self, path=DB_PATH):
+        self.db = connect(path, SCHEMA, SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def update(self, paths=DEFAULT_ROOTS, workers=None):
+        """
+        Brings the index in line with the Swift files under `paths`. Returns
+        counts of files 'unchanged' (same size and mtime), 'reused' (content
+        already indexed), 'indexed' (lexed) and 'removed'.
+        """
+        known = {path: (sha1, size, mtime_ns)
+                 for path, sha1, size, mtime_ns in self.db.execute("SELECT path, sha1, size, mtime_ns FROM files")}
+        contents = {sha1 for (sha1,) in self.db.execute("SELECT sha1 FROM contents")}
+        counts = {'unchanged': 0, 'reused': 0, 'indexed': 0, 'removed': 0}
+        files = [os.path.normpath(path) for path in swift_files(paths)]
+        rows = []
+        pending = []
+        for path in files:
+            st = os.stat(path)
+            row = known.get(path)
+            if row is not None and row[1:] == (st.st_size, st.st_mtime_ns):
+                counts['unchanged'] += 1
+                continue
+            sha1 = _file_sha1(path)
+            if sha1 in contents:
+                rows.append((path, sha1, st.st_size, st.st_mtime_ns))
+                counts['reused'] += 1
+            else:
+                pending.append((path, st.st_size, st.st_mtime_ns))
+        if len(pending) > 1 and workers != 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_index_file, [path for path, _, _ in pending], chunksize=8))
+        else:
+            results = [_index_file(path) for path, _, _ in pending]
+        live = set(files)
+        roots = tuple(os.path.normpath(path) for path in paths)
+        gone = [path for path in known if path not in live and path.startswith(roots)]
+        with self.db:
+            for (path, size, mtime_ns), (sha1, lines, symbols, refs) in zip(pending, results):
+                if sha1 not in contents:
+                    contents.add(sha1)
+                    self.db.execute("INSERT INTO contents VALUES (?, ?, ?)", (sha1, lines, '\n'.join(refs)))
+                    self.db.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(sha1,) + symbol for symbol in symbols])
+                rows.append((path, sha1, size, mtime_ns))
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+            self.db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in gone])
+            # Contents no file holds any more.
+            self.db.execute("DELETE FROM contents WHERE sha1 NOT IN (SELECT sha1 FROM files)")
+        counts['indexed'] = len(pending)
+        counts['removed'] = len(gone)
+        return counts
+
+    def _sha1(self, path):
+        row = self.db.execute("SELECT sha1 FROM files WHERE path = ?", (os.path.normpath(path),)).fetchone()
+        if row is None:
+            raise KeyError(f"{path} is not indexed")
+        return row[0]
+
+    def symbols(self, path):
+        """(name, kind, container, line) declared by one file, in line order."""
+        return self.db.execute("SELECT name, kind, container, line FROM symbols WHERE sha1 = ? ORDER BY line",
+                               (self._sha1(path),)).fetchall()
+
+    def defines(self, name):
+        """(path, kind, container, line) for every declaration of `name`."""
+        return self.db.execute("""
+            SELECT f.path, s.kind, s.container, s.line FROM symbols s JOIN files f ON f.sha1 = s.sha1
+            WHERE s.name = ? AND s.kind != 'conformance' ORDER BY f.path, s.line""", (name,)).fetchall()
+
+    def _providers(self):
+        """
+        Returns (top, members, refs): top-level name -> paths declaring it,
+        member name -> [(extended type, path)] for extension members and
+        conformances, and path -> the names it mentions.
+        """
+        top = {}
+        members = {}
+        for path, name, kind, container, extension in self.db.execute("""
+                SELECT f.path, s.name, s.kind, s.container, s.extension
+                FROM symbols s JOIN files f ON f.sha1 = s.sha1 WHERE s.kind != 'extension'"""):
+            if not container and not extension:
+                top.setdefault(name, set()).add(path)
+            elif extension:
+                members.setdefault(name, []).append((container.split('.')[0], path))
+        return top, members, self._refs()
+
+    def _refs(self):
+        """path -> the names it mentions."""
+        rows = self.db.execute("SELECT f.path, c.refs FROM files f JOIN contents c ON c.sha1 = f.sha1")
+        return {path: set(names.split('\n')) for path, names in rows}
+
+    def dependencies(self, path, prefer=None):
+        """
+        The files `path` needs to compile, transitively. Returns (required,
+        ambiguous): required maps each path to (name, referencing path or
+        None for an extension member) for the first reason it was pulled in;
+        ambiguous maps names declared by more than one required file (or
+        `path` itself) to those files. When a name is declared in several
+        files and some are in `prefer`, e.g. a target's members, only those
+        are followed.
+        """
+        path = os.path.normpath(path)
+        self._sha1(path)
+        top, members, refs = self._providers()
+        required = {path: None}
+        mentioned = set()
+        queue = [path]
+        while queue:
+            while queue:
+                current = queue.pop()
+                names = refs.get(current, ())
+                mentioned.update(names)
+                for name in names:
+                    providers = top.get(name, ())
+                    if len(providers) > 1 and prefer:
+                        providers = (providers & prefer) or providers
+                    for provider in providers:
+                        if provider not in required:
+                            required[provider] = (name, current)
+                            queue.append(provider)
+            # Extensions are pulled in by their members once their type is in play.
+            for name in mentioned:
+                for extended, provider in members.get(name, ()):
+                    if provider not in required and extended in mentioned:
+                        required[provider] = (f"{extended}.{name}", None)
+                        queue.append(provider)
+        ambiguous = {}
+        for name, providers in top.items():
+            if len(providers) > 1 and name in mentioned:
+                clash = sorted(providers & required.keys())
+                if len(clash) > 1:
+                    ambiguous[name] = clash
+        del required[path]
+        return required, ambiguous
+
+    def users(self, path):
+        """(path, names) of the files that mention a top-level name `path` declares."""
+        path = os.path.normpath(path)
+        declared = {name for (name,) in self.db.execute(
+            "SELECT name FROM symbols WHERE sha1 = ? AND container = '' AND extension = 0 AND kind != 'extension'",
+            (self._sha1(path),))}
+        users = []
+        for user, names in sorted(self._refs().items()):
+            used = names & declared
+            if used and user != path:
+                users.append((user, sorted(used)))
+        return users
+
+
+def target_members(target, project_dir=None):
+    """Repository-relative paths of the Swift files in a target's Sources phase."""
+    from .pbxproj import PBXPROJ_NAME, PROJECT_DIR, PBXProject
+    from .sync import resolve_paths, target_phases
+
+    project_dir = project_dir or PROJECT_DIR
+    project = PBXProject.load(os.path.join(project_dir, PBXPROJ_NAME))
+    phase_id, _ = target_phases(project, target)
+    if phase_id is None:
+        raise KeyError(f"No target named {target!r}")
+    paths = resolve_paths(project)
+    members = set()
+    for build_id in project[phase_id].get('files', ()):
+        build = project.get(build_id)
+        path = paths.get(build.get('fileRef')) if build is not None else None
+        if path is not None:
+            members.add(os.path.normpath(os.path.join(project_dir, path)))
+    return members
+
+
+def bench(paths=DEFAULT_ROOTS):
+    """Cold index, no-op update, one touched file and dependency queries on a scratch database."""
+    import tempfile
+
+    files = [os.path.normpath(path) for path in swift_files(paths)]
+    if not files:
+        print("No Swift files to index.")
+        return 1
+    with tempfile.TemporaryDirectory() as scratch:
+        with SwiftIndex(os.path.join(scratch, 'index.sqlite')) as index:
+            start = time.perf_counter()
+            counts = index.update(paths)
+            cold = time.perf_counter() - start
+            print(f"cold index: {cold * 1000:8.1f} ms  {counts['indexed']} file(s)")
+            start = time.perf_counter()
+            index.update(paths)
+            print(f"no change:  {(time.perf_counter() - start) * 1000:8.1f} ms")
+            touched = max(files, key=os.path.getsize)
+            st = os.stat(touched)
+            os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+            try:
+                start = time.perf_counter()
+                counts = index.update(paths)
+                print(f"touched:    {(time.perf_counter() - start) * 1000:8.1f} ms  "
+                      f"({counts['reused']} reused, {counts['indexed']} lexed)")
+            finally:
+                os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns))
+            times = []
+            sizes = []
+            for path in files:
+                start = time.perf_counter()
+                required, _ = index.dependencies(path)
+                times.append(time.perf_counter() - start)
+                sizes.append(len(required))
+            times.sort()
+            print(f"deps:       {times[len(times) // 2] * 1000:8.2f} ms median, {times[-1] * 1000:.2f} ms max "
+                  f"over {len(files)} file(s); {max(sizes)} file(s) at most")
+    return 0
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    options = {'--workers', '--target', '--project'}
+    positional = [a for i, a in enumerate(args) if not a.startswith('--') and (i == 0 or args[i - 1] not in options)]
+    commands = ('update', 'deps', 'users', 'defines', 'symbols', 'bench')
+    command = positional.pop(0) if positional and positional[0] in commands else 'update'
+    if command == 'bench':
+        return bench()
+    workers = option(args, '--workers')
+    workers = int(workers) if workers else None
+
+    with SwiftIndex() as index:
+        start = time.perf_counter()
+        counts = index.update(positional if command == 'update' and positional else DEFAULT_ROOTS, workers)
+        if command == 'update':
+            detail = ", ".join(f"{n} {status}" for status, n in counts.items())
+            print(f"{detail} in {(time.perf_counter() - start) * 1000:.0f} ms.")
+            return 0
+        if not positional:
+            print(f"Usage: python -m knowmaps_tools.swift_index {command} "
+                  f"{'NAME' if command == 'defines' else 'FILE'}")
+            return 2
+        try:
+            if command == 'deps':
+                members = None
+                target = option(args, '--target')
+                if target is not None:
+                    members = set()
+                    for name in target.split(','):
+                        members |= target_members(name, option(args, '--project'))
+                start = time.perf_counter()
+                required, ambiguous = index.dependencies(positional[0], members)
+                elapsed = time.perf_counter() - start
+                missing = 0
+                for path, (name, via) in sorted(required.items()):
+                    reason = f"{name}, from {os.path.basename(via)}" if via else f"extension member {name}"
+                    flag = ''
+                    if members is not None and path not in members:
+                        flag = '  [not in target]'
+                        missing += 1
+                    print(f"{path}  ({reason}){flag}")
+                for name, paths in sorted(ambiguous.items()):
+                    print(f"Declared more than once: {name} in {', '.join(paths)}")
+                summary = f"{len(required)} file(s) required"
+                if members is not None:
+                    summary += f", {missing} not in {target}"
+                print(f"{summary}; resolved in {elapsed * 1000:.1f} ms.")
+                return 1 if missing or ambiguous else 0
+            if command == 'users':
+                for path, names in index.users(positional[0]):
+                    print(f"{path}  ({', '.join(names)})")
+            elif command == 'defines':
+                for path, kind, container, line in index.defines(positional[0]):
+                    owner = f" in {container}" if container else ""
+                    print(f"{path}:{line}: {kind}{owner}")
+            else:
+                for name, kind, container, line in index.symbols(positional[0]):
+                    owner = f"{container}." if container else ""
+                    print(f"{line:6}  {kind:13} {owner}{name}")
+        except KeyError as e:
+            print(e.args[0])
+            return 1
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+swift_syntax.py
+
+Lexer-based bracket balance checker for Swift sources.
+
+Unlike counting characters line by line, the lexer skips `//` and nested
+`/* */` comments, single-line, multi-line (`\"\"\"`) and raw (`#"..."#`)
+string literals, and descends into `\\( ... )` interpolations. Each `#if`
+branch is checked from the nesting the `#if` started at, and the branches
+must agree on where they leave it. Every mismatch is reported with the line
+and column of both the closer and the opener.
+
+Files are checked across a process pool and results are cached under
+.knowmaps-cache/ by content hash, so unchanged files are skipped.
+
+Usage:
+    python -m knowmaps_tools.swift_syntax [paths...]
+"""
+
+import bisect
+import hashlib
+import os
+import re
+import sys
+
+from .common import load_json_cache, save_json_cache
+from .disk_index import CACHE_DIR
+
+DEFAULT_ROOTS = ('Know-Maps/Know Maps Prod', 'Know-Maps/knowmapsTests')
+CACHE_PATH = os.path.join(CACHE_DIR, 'swift-syntax.json')
+CACHE_VERSION = 1
+
+OPENERS = {'(': ')', '[': ']', '{': '}'}
+CLOSERS = {')': '(', ']': '[', '}': '{'}
+
+_CODE_RE = re.compile(r'//|/\*|(#*)("""|")|[{}()\[\]]|^[ \t]*#(elseif|if|else|endif)\b', re.MULTILINE)
+_BLOCK_RE = re.compile(r'/\*|\*/')
+_LINE_END_RE = re.compile(r'\n')
+
+
+class SwiftSyntaxIssue(dict):
+    """A single finding: path, line, column and message."""
+
+    def __str__(self):
+        return f"{self['path']}:{self['line']}:{self['column']}: {self['message']}"
+
+
+def _string_re(quote, hashes):
+    closing = re.escape(quote + '#' * hashes)
+    escape = re.escape('\\' + '#' * hashes)
+    newline = '|\n' if quote == '"' else ''
+    return re.compile(f'{escape}\\(|{escape}.|{closing}{newline}', re.DOTALL)
+
+
+class SwiftBalanceChecker:
+    """Checks one file's worth of Swift source."""
+
+    def __init__(self, text, path='<string>'):
+        self.text = text
+        self.path = path
+        self.issues = []
+        self._newlines = None
+        self._string_res = {}
+
+    def _position(self, offset):
+        if self._newlines is None:
+            self._newlines = [m.start() for m in _LINE_END_RE.finditer(self.text)]
+        line = bisect.bisect_left(self._newlines, offset)
+        line_start = self._newlines[line - 1] + 1 if line else 0
+        return line + 1, offset - line_start + 1
+
+    def _where(self, offset):
+        line, column = self._position(offset)
+        return f"{line}:{column}"
+
+    def _report(self, offset, message):
+        line, column = self._position(offset)
+        self.issues.append(SwiftSyntaxIssue(path=self.path, line=line, column=column, message=message))
+
+    def _string_pattern(self, quote, hashes):
+        key = (quote, hashes)
+        pattern = self._string_res.get(key)
+        if pattern is None:
+            pattern = self._string_res[key] = _string_re(quote, hashes)
+        return pattern
+
+    def _close(self, stack, char, offset):
+        """Pops the opener for `char`; returns the popped entry or None."""
+        opener = CLOSERS[char]
+        if stack and stack[-1][0] == opener:
+            return stack.pop()
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == opener and not stack[depth][2]:
+                for kind, start, _ in stack[depth + 1:]:
+                    self._report(start, f"Unclosed '{kind}' before '{char}' at {self._where(offset)}")
+                entry = stack[depth]
+                del stack[depth:]
+                return entry
+        if stack:
+            kind, start, _ = stack[-1]
+            self._report(offset, f"Unexpected '{char}'; innermost open bracket is '{kind}' at {self._where(start)}")
+        else:
+            self._report(offset, f"Unexpected '{char}' with no open bracket")
+        return None
+
+    def check(self):
+        text = self.text
+        # (bracket, offset, is_interpolation)
+        stack = []
+        # Strings suspended by an interpolation: (quote, hashes, start offset)
+        strings = []
+        # Open #if blocks: where they started, the bracket stack at #if and
+        # the stack and depth each finished branch left behind.
+        conditions = []
+        pos = 0
+        end = len(text)
+        while pos < end:
+            m = _CODE_RE.search(text, pos)
+            if m is None:
+                break
+            token = m.group()
+            start = m.start()
+            pos = m.end()
+            if token == '//':
+                nl = text.find('\n', pos)
+                pos = end if nl < 0 else nl
+            elif token == '/*':
+                pos = self._skip_block_comment(start, pos)
+            elif m.group(2):
+                pos = self._skip_string(m.group(2), len(m.group(1)), start, pos, stack, strings)
+            elif m.group(3):
+                self._directive(m.group(3), m.start(3) - 1, stack, conditions)
+            elif token in OPENERS:
+                stack.append((token, start, False))
+            else:
+                entry = self._close(stack, token, start)
+                if entry is not None and entry[2]:
+                    quote, hashes, string_start = strings.pop()
+                    pos = self._skip_string(quote, hashes, string_start, pos, stack, strings)
+        for condition in conditions:
+            self._report(condition['offset'], "Unterminated #if")
+        for kind, start, interpolation in stack:
+            if interpolation:
+                self._report(start, "Unterminated string interpolation")
+            else:
+                self._report(start, f"Unclosed '{kind}'")
+        self.issues.sort(key=lambda issue: (issue['line'], issue['column']))
+        return self.issues
+
+    def _skip_block_comment(self, start, pos):
+        depth = 1
+        while depth:
+            m = _BLOCK_RE.search(self.text, pos)
+            if m is None:
+                self._report(start, "Unterminated block comment")
+                return len(self.text)
+            depth += 1 if m.group() == '/*' else -1
+            pos = m.end()
+        return pos
+
+    def _skip_string(self, quote, hashes, start, pos, stack, strings):
+        """
+        Skips to the end of a string literal. On `\\(` the string is suspended
+        and an interpolation bracket is pushed; scanning resumes in code.
+        """
+        pattern = self._string_pattern(quote, hashes)
+        while True:
+            m = pattern.search(self.text, pos)
+            if m is None or m.group() == '\n':
+                self._report(start, "Unterminated string literal")
+                return len(self.text) if m is None else m.end()
+            token = m.group()
+            pos = m.end()
+            if token.endswith('(') and token.startswith('\\') and len(token) == hashes + 2:
+                strings.append((quote, hashes, start))
+                stack.append(('(', m.start(), True))
+                return pos
+            if not token.startswith('\\'):
+                return pos
+
+    def _directive(self, name, offset, stack, conditions):
+        if name == 'if':
+            conditions.append({'offset': offset, 'base': list(stack), 'first': None, 'branches': []})
+            return
+        if not conditions:
+            self._report(offset, f"#{name} without #if")
+            return
+        condition = conditions[-1]
+        condition['branches'].append((len(stack), offset))
+        if condition['first'] is None:
+            condition['first'] = list(stack)
+        if name != 'endif':
+            # Each #elseif / #else branch starts from the nesting at #if.
+            stack[:] = condition['base']
+            return
+        conditions.pop()
+        base = len(condition['base'])
+        if len({depth for depth, _ in condition['branches']}) > 1:
+            detail = ", ".join(f"{depth - base:+d} at {self._where(at)}" for depth, at in condition['branches'])
+            self._report(condition['offset'], f"#if branches leave different bracket nesting: {detail}")
+        # Continue from where the first branch left off.
+        stack[:] = condition['first']
+
+
+def check_text(text, path='<string>'):
+    return SwiftBalanceChecker(text, path).check()
+
+
+def _check_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    return path, digest, check_text(data.decode('utf-8', errors='replace'), path)
+
+
+def load_cache():
+    """{path: {'sha1', 'issues'}} from the last check_paths run."""
+    return load_json_cache(CACHE_PATH, CACHE_VERSION, 'files')
+
+
+def save_cache(cache):
+    save_json_cache(CACHE_PATH, CACHE_VERSION, 'files', cache)
+
+
+def swift_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.swift'):
+                        yield os.path.join(root, name)
+        elif path.endswith('.swift'):
+            yield path
+
+
+def check_paths(paths=DEFAULT_ROOTS, use_cache=True, workers=None):
+    """
+    Checks every Swift file under `paths`. Returns (issues, checked, skipped):
+    files whose content hash matches the cache reuse their cached issues.
+    """
+    cache = load_cache() if use_cache else {}
+    files = list(swift_files(paths))
+    pending = []
+    issues = []
+    skipped = 0
+    for path in files:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        cached = cache.get(path)
+        if cached is not None and cached['sha1'] == digest:
+            issues.extend(SwiftSyntaxIssue(issue) for issue in cached['issues'])
+            skipped += 1
+        else:
+            pending.append(path)
+    if len(pending) > 1 and workers != 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_check_file, pending, chunksize=8))
+    else:
+        results = [_check_file(path) for path in pending]
+    for path, digest, file_issues in results:
+        cache[path] = {'sha1': digest, 'issues': file_issues}
+        issues.extend(file_issues)
+    if use_cache:
+        live = set(files)
+        save_cache({path: entry for path, entry in cache.items() if path in live or not path.startswith(tuple(paths))})
+    issues.sort(key=lambda issue: (issue['path'], issue['line'], issue['column']))
+    return issues, len(pending), skipped
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    use_cache = '--no-cache' not in args
+    paths = [a for a in args if not a.startswith('--')] or list(DEFAULT_ROOTS)
+    issues, checked, skipped = check_paths(paths, use_cache=use_cache)
+    for issue in issues:
+        print(issue)
+    print(f"{checked} checked, {skipped} unchanged, {len(issues)} issue(s).")
+    return 1 if issues else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+"""
+sync.py
+
+Synchronizes target membership in project.pbxproj with project.yml.
+
+project.yml declares which directories each target compiles. The sync reads
+the spec, indexes the declared directories on disk and resolves the current
+Sources build phase of every target, then walks the sorted on-disk and
+in-project path lists side by side to produce a minimal edit script: inserts
+for sources that exist on disk but are missing from the phase, deletes for
+phase entries whose file is gone or excluded. Finder copies ("SearchView
+2.swift" next to SearchView.swift) are not inserted: they redeclare the
+types of the original, so the report lists them as skipped instead. Only
+those edits are applied, and when there are none the project file is not
+written at all, so Xcode does not reindex or rebuild.
+
+Prerequisites:
+    - PyYAML (`pip install pyyaml`)
+
+Usage:
+    python -m knowmaps_tools.sync [--dry-run] [Know-Maps]
+"""
+
+import fnmatch
+import os
+import re
+import sys
+
+from .disk_index import DiskIndex
+from .pbxproj import PBXPROJ_NAME, PROJECT_DIR, PBXProject
+from .transaction import ProjectTransaction
+
+SPEC_NAME = 'project.yml'
+
+# Files that are compiled into a target's Sources phase.
+SOURCE_SUFFIXES = ('.swift', '.mlmodel', '.mlpackage')
+# Directories Xcode treats as a single file; nothing inside them is synced.
+BUNDLE_SUFFIXES = ('.mlpackage', '.mlproj', '.xcassets', '.docc', '.xcdatamodeld')
+# The names Finder gives duplicates: "<name> 2.swift", "<name> 3.swift", ...
+_FINDER_COPY_RE = re.compile(r'^(.+) \d+(\.[^./]+)$')
+
+
+def load_spec(path):
+    import yaml
+    # The libyaml loader is an order of magnitude faster when PyYAML was built with it.
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=loader)
+
+
+def target_sources(spec):
+    """Maps each target name to its [(source path, [exclude globs])] entries."""
+    targets = {}
+    for name, target in (spec.get('targets') or {}).items():
+        entries = []
+        for source in target.get('sources') or ():
+            if isinstance(source, str):
+                entries.append((source, []))
+            else:
+                entries.append((source['path'], list(source.get('excludes') or ())))
+        targets[name] = entries
+    return targets
+
+
+def _in_bundle(rel_path):
+    return any(part.endswith(BUNDLE_SUFFIXES) for part in rel_path.split(os.sep)[:-1])
+
+
+def declared(path, source_path, excludes):
+    """True when the project-relative `path` is a source of the declared directory."""
+    prefix = os.path.join(source_path, '')
+    if not path.startswith(prefix) or not path.endswith(SOURCE_SUFFIXES):
+        return False
+    rel = path[len(prefix):]
+    return not _in_bundle(rel) and not any(fnmatch.fnmatch(rel, pattern) for pattern in excludes)
+
+
+def disk_sources(project_dir, source_path, excludes):
+    """Sorted project-relative paths of the sources under one declared directory."""
+    index = DiskIndex.build(os.path.join(project_dir, source_path))
+    found = []
+    candidates = list(index.files(SOURCE_SUFFIXES))
+    candidates.extend(d for d in index.directories() if d.endswith(SOURCE_SUFFIXES))
+    for full_path in candidates:
+        path = os.path.join(source_path, os.path.relpath(full_path, index.root))
+        if declared(path, source_path, excludes):
+            found.append(path)
+    found.sort()
+    return found
+
+
+def resolve_paths(project):
+    """
+    Maps every group and file reference reachable from the main group to its
+    path relative to the project directory. Objects outside the source tree
+    (built products, SDK frameworks) are left out.
+    """
+    paths = {}
+    main = project.main_group
+    stack = [(main.id, '')]
+    paths[main.id] = ''
+    while stack:
+        group_id, base = stack.pop()
+        for child_id in project[group_id].get('children', ()):
+            child = project.get(child_id)
+            if child is None:
+                continue
+            tree = child.get('sourceTree', '<group>')
+            path = child.get('path')
+            if tree == '<group>':
+                child_path = os.path.join(base, path) if path else base
+            elif tree == 'SOURCE_ROOT':
+                child_path = path or ''
+            else:
+                continue
+            paths[child_id] = child_path
+            if 'children' in child:
+                stack.append((child_id, child_path))
+    return paths
+
+
+def target_phases(project, target_name):
+    """Returns (sources phase ID, every build phase ID) for a native target."""
+    for target in project.iter_isa('PBXNativeTarget'):
+        if target.get('name') == target_name:
+            phases = list(target.get('buildPhases', ()))
+            for phase_id in phases:
+                if project[phase_id].isa == 'PBXSourcesBuildPhase':
+                    return phase_id, phases
+    return None, []
+
+
+def finder_original(path):
+    """The path a Finder copy named "<name> N.ext" was made from, or None for other names."""
+    match = _FINDER_COPY_RE.match(path)
+    return match.group(1) + match.group(2) if match else None
+
+
+def merge_diff(desired, current):
+    """
+    Two-pointer walk over two sorted path lists; returns (inserts, deletes).
+    Paths are compared case-insensitively, as they are on the APFS volumes
+    Xcode projects live on.
+    """
+    inserts, deletes = [], []
+    i = j = 0
+    while i < len(desired) and j < len(current):
+        a, b = desired[i].casefold(), current[j].casefold()
+        if a == b:
+            i += 1
+            j += 1
+        elif a < b:
+            inserts.append(desired[i])
+            i += 1
+        else:
+            deletes.append(current[j])
+            j += 1
+    inserts.extend(desired[i:])
+    deletes.extend(current[j:])
+    return inserts, deletes
+
+
+class ProjectSync:
+    """Computes and applies the project.yml -> pbxproj edit script."""
+
+    def __init__(self, project_dir=PROJECT_DIR):
+        self.project_dir = project_dir
+        self.spec = load_spec(os.path.join(project_dir, SPEC_NAME))
+        self.plan = {}
+        # target -> [(Finder copy, original)] left out of the last plan
+        self.skipped = {}
+        self.reload()
+
+    def reload(self):
+        """Re-reads project.pbxproj, e.g. after `apply` wrote it or Xcode changed it."""
+        self.project = PBXProject.load(os.path.join(self.project_dir, PBXPROJ_NAME))
+        self.paths = resolve_paths(self.project)
+        self.groups = {}
+        self.refs = {}
+        for object_id, path in self.paths.items():
+            obj = self.project[object_id]
+            if 'children' in obj:
+                self.groups.setdefault(path, object_id)
+            elif obj.isa == 'PBXFileReference':
+                self.refs.setdefault(path, object_id)
+
+    def _phase_members(self, phase_ids):
+        members = {}
+        for phase_id in phase_ids:
+            for build_id in self.project[phase_id].get('files', ()):
+                build = self.project.get(build_id)
+                file_id = build.get('fileRef') if build is not None else None
+                path = self.paths.get(file_id)
+                if path is not None:
+                    members.setdefault(path, (file_id, build_id))
+        return members
+
+    def sources(self, source_path, excludes):
+        """Sorted project-relative paths of the sources under one declared directory."""
+        return disk_sources(self.project_dir, source_path, excludes)
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.project_dir, path))
+
+    def compute(self, only=None):
+        """
+        Fills `plan` with {target: (phase ID, inserts, deletes)} and returns it.
+        With `only`, a set of project-relative paths, just those paths are
+        compared and nothing else on disk is looked at. Finder copies whose
+        original exists are kept out of the inserts and listed in `skipped`.
+        """
+        self.plan = {}
+        self.skipped = {}
+        if only is not None:
+            folded = {path.casefold() for path in only}
+        for target_name, sources in target_sources(self.spec).items():
+            phase_id, phase_ids = target_phases(self.project, target_name)
+            if phase_id is None or not sources:
+                continue
+            desired = set()
+            for source_path, excludes in sources:
+                if only is None:
+                    desired.update(self.sources(source_path, excludes))
+                else:
+                    desired.update(p for p in only if declared(p, source_path, excludes) and self.exists(p))
+            # Sources already built by another phase of the target (models copied
+            # as resources, for instance) count as members but are never deleted.
+            members = self._phase_members([phase_id])
+            elsewhere = self._phase_members(p for p in phase_ids if p != phase_id)
+            desired.difference_update(elsewhere)
+            roots = tuple(os.path.join(path, '') for path, _ in sources)
+            current = sorted((p for p in members if p.startswith(roots)
+                              and (only is None or p.casefold() in folded)), key=str.casefold)
+            inserts, deletes = merge_diff(sorted(desired, key=str.casefold), current)
+            copies = {p: finder_original(p) for p in inserts if finder_original(p)}
+            copies = {path: original for path, original in copies.items() if self.exists(original)}
+            if copies:
+                self.skipped[target_name] = sorted(copies.items())
+                inserts = [p for p in inserts if p not in copies]
+            if inserts or deletes:
+                self.plan[target_name] = (phase_id, inserts, [(p, members[p]) for p in deletes])
+        return self.plan
+
+    def _group_for(self, txn, dir_path):
+        group_id = self.groups.get(dir_path)
+        if group_id is None:
+            parent_path = os.path.dirname(dir_path)
+            parent_id = self._group_for(txn, parent_path)
+            group_id = txn.add_group(os.path.basename(dir_path), parent_id, parent_path)
+            self.groups[dir_path] = group_id
+        return group_id
+
+    def moves(self):
+        """
+        {old path: (new path, file ID)} for deleted sources that reappear under
+        another directory with the same name. Their references are moved
+        between groups instead of being removed and added again, so file and
+        build file IDs survive the move. A move only qualifies when the same
+        targets lose the old path and gain the new one.
+        """
+        gone = {}
+        added = {}
+        for target_name, (_, inserts, deletes) in self.plan.items():
+            for path, (file_id, _) in deletes:
+                ref = self.project.get(file_id)
+                name = os.path.basename(path)
+                if (ref is not None and ref.get('path') == name and ref.get('sourceTree', '<group>') == '<group>'
+                        and not self.exists(path)):
+                    gone.setdefault(name, {}).setdefault((path, file_id), set()).add(target_name)
+            for path in inserts:
+                if path not in self.refs:
+                    added.setdefault(os.path.basename(path), {}).setdefault(path, set()).add(target_name)
+        moves = {}
+        for name, old in gone.items():
+            new = added.get(name, {})
+            if len(old) == 1 and len(new) == 1:
+                ((old_path, file_id), old_targets), = old.items()
+                (new_path, new_targets), = new.items()
+                if old_targets == new_targets:
+                    moves[old_path] = (new_path, file_id)
+        return moves
+
+    def apply(self, dry_run=False):
+        """Applies the computed plan. Returns True when the project was written."""
+        if not self.plan:
+            return False
+        txn = ProjectTransaction(self.project)
+        moves = self.moves()
+        for new_path, file_id in sorted(moves.values()):
+            txn.move_file(file_id, self._group_for(txn, os.path.dirname(new_path)))
+            self.refs[new_path] = file_id
+        for target_name, (phase_id, inserts, deletes) in sorted(self.plan.items()):
+            kept = {moves[path][0] for path, _ in deletes if path in moves}
+            for path, (file_id, build_id) in deletes:
+                if path in moves:
+                    continue
+                txn.remove_file(build_id if self.exists(path) else file_id)
+            for path in inserts:
+                if path in kept:
+                    continue
+                file_id = self.refs.get(path)
+                if file_id is not None:
+                    txn.add_to_phase(file_id, phase_id)
+                else:
+                    group_id = self._group_for(txn, os.path.dirname(path))
+                    file_id, _ = txn.add_file(os.path.basename(path), group_id, phase_id)
+                    self.refs[path] = file_id
+        return txn.commit(dry_run=dry_run)
+
+    def report(self, plan=None):
+        """Summary lines for `plan`, by default the computed one."""
+        lines = []
+        for target_name, (_, inserts, deletes) in sorted((self.plan if plan is None else plan).items()):
+            lines.append(f"{target_name}: +{len(inserts)} -{len(deletes)}")
+            lines.extend(f"  + {path}" for path in inserts)
+            lines.extend(f"  - {path}" for path, _ in deletes)
+        return lines
+
+    def skipped_report(self):
+        lines = []
+        for target_name, copies in sorted(self.skipped.items()):
+            lines.append(f"{target_name}: skipped {len(copies)} Finder cop{'y' if len(copies) == 1 else 'ies'}")
+            lines.extend(f"  ~ {path} (copy of {os.path.basename(original)})" for path, original in copies)
+        return lines
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    dry_run = '--dry-run' in args
+    positional = [a for a in args if not a.startswith('--')]
+    sync = ProjectSync(positional[0] if positional else PROJECT_DIR)
+    plan = sync.compute()
+    for line in sync.skipped_report():
+        print(line)
+    if not plan:
+        print("Project is in sync with project.yml; nothing written.")
+        return 0
+    for line in sync.report():
+        print(line)
+    if sync.apply(dry_run=dry_run):
+        print("Project file updated.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
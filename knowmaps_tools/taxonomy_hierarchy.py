@@ -0,0 +1,309 @@
+"""
+taxonomy_hierarchy.py
+
+Ancestor, descendant and lowest-common-ancestor queries over the category
+taxonomy.
+
+The taxonomy is a tree under "Foursquare Places". One depth-first pass
+numbers every category in preorder and records the last preorder number in
+its subtree, so a subtree is the contiguous interval [enter, leave] of the
+preorder array. "Is A under B" is two comparisons, a descendant set is one
+slice, and filtering many IDs against many categories is a bisect into the
+merged intervals. Binary lifting tables (the 2^k-th ancestor of every node)
+answer LCA in O(log depth).
+
+The hierarchy is built from the compiled index (see taxonomy_index.py), so
+no JSON is parsed when the index is current.
+
+Usage:
+    python -m knowmaps_tools.taxonomy_hierarchy descendants 10000
+    python -m knowmaps_tools.taxonomy_hierarchy ancestors 13035
+    python -m knowmaps_tools.taxonomy_hierarchy lca 13035 13040 [...]
+    python -m knowmaps_tools.taxonomy_hierarchy verify|bench
+"""
+
+import bisect
+import random
+import sys
+import time
+from array import array
+
+from .taxonomy_index import NONE, open_index
+
+
+class TaxonomyHierarchy:
+    """Interval-encoded category tree with binary lifting."""
+
+    def __init__(self, ids, parents):
+        """
+        `ids` are the category IDs by position and `parents[i]` is the
+        position of the first parent of category i, or -1 for a root. Several
+        roots are joined under a virtual root that is never returned.
+        """
+        count = len(ids)
+        self.ids = list(ids)
+        self.position = {category_id: i for i, category_id in enumerate(self.ids)}
+        self.root = count
+        parent = array('i', (p if p >= 0 else count for p in parents))
+        parent.append(count)
+        children = [[] for _ in range(count + 1)]
+        for child in range(count):
+            children[parent[child]].append(child)
+
+        enter = array('i', [0]) * (count + 1)
+        leave = array('i', [0]) * (count + 1)
+        depth = array('i', [0]) * (count + 1)
+        order = array('i')
+        stack = [(self.root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                leave[node] = len(order) - 1
+                continue
+            enter[node] = len(order)
+            order.append(node)
+            stack.append((node, True))
+            for child in reversed(children[node]):
+                depth[child] = depth[node] + 1
+                stack.append((child, False))
+        self.parent = parent
+        self.enter, self.leave, self.depth, self.order = enter, leave, depth, order
+
+        # up[k][v] is the 2^k-th ancestor of v, saturating at the root.
+        self.up = [parent]
+        for _ in range(max(1, max(depth).bit_length())):
+            previous = self.up[-1]
+            self.up.append(array('i', (previous[previous[v]] for v in range(count + 1))))
+
+    @classmethod
+    def from_index(cls, index):
+        ids = index.ids()
+        parents = []
+        for i in range(len(ids)):
+            first = index.parent_indexes(i)[:1]
+            parents.append(first[0] if first and first[0] != NONE else -1)
+        return cls(ids, parents)
+
+    @classmethod
+    def from_taxonomy(cls, taxonomy):
+        ids = list(taxonomy)
+        position = {category_id: i for i, category_id in enumerate(ids)}
+        parents = [position.get(((taxonomy[i].get('parents') or [None])[0]), -1) for i in ids]
+        return cls(ids, parents)
+
+    @classmethod
+    def load(cls):
+        with open_index() as index:
+            return cls.from_index(index)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _node(self, category_id):
+        try:
+            return self.position[category_id]
+        except KeyError:
+            raise KeyError(f"Unknown category ID {category_id!r}") from None
+
+    # Single queries
+
+    def is_descendant(self, category_id, ancestor_id):
+        """True when `category_id` is `ancestor_id` or lies below it."""
+        node, ancestor = self._node(category_id), self._node(ancestor_id)
+        return self.enter[ancestor] <= self.enter[node] <= self.leave[ancestor]
+
+    def descendants(self, category_id, include_self=True):
+        node = self._node(category_id)
+        start = self.enter[node] + (0 if include_self else 1)
+        return [self.ids[n] for n in self.order[start:self.leave[node] + 1]]
+
+    def ancestors(self, category_id, include_self=False):
+        """Ancestor chain from the nearest parent up to the root."""
+        node = self._node(category_id)
+        chain = [category_id] if include_self else []
+        node = self.parent[node]
+        while node != self.root:
+            chain.append(self.ids[node])
+            node = self.parent[node]
+        return chain
+
+    def depth_of(self, category_id):
+        return self.depth[self._node(category_id)] - 1
+
+    def _lca(self, a, b):
+        enter, leave = self.enter, self.leave
+        if enter[a] <= enter[b] <= leave[a]:
+            return a
+        if enter[b] <= enter[a] <= leave[b]:
+            return b
+        # Climb from `a` to the highest ancestor that still does not contain b.
+        for level in reversed(self.up):
+            candidate = level[a]
+            if not enter[candidate] <= enter[b] <= leave[candidate]:
+                a = candidate
+        return self.parent[a]
+
+    def lca(self, *category_ids):
+        """Lowest common ancestor of one or more categories, or None across roots."""
+        nodes = [self._node(c) for c in category_ids]
+        if not nodes:
+            raise ValueError("lca() needs at least one category ID")
+        node = nodes[0]
+        for other in nodes[1:]:
+            node = self._lca(node, other)
+            if node == self.root:
+                return None
+        return self.ids[node]
+
+    # Batch queries
+
+    def _intervals(self, ancestor_ids):
+        """Merged, sorted preorder intervals of the subtrees under `ancestor_ids`."""
+        spans = sorted((self.enter[n], self.leave[n]) for n in map(self._node, ancestor_ids))
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return merged
+
+    def expand(self, ancestor_ids):
+        """Every category under any of `ancestor_ids`, in preorder and without repeats."""
+        ids, order = self.ids, self.order
+        return [ids[n] for start, end in self._intervals(ancestor_ids) for n in order[start:end + 1]]
+
+    def under_any(self, category_ids, ancestor_ids):
+        """One bool per ID: does it fall under any of `ancestor_ids`? Unknown IDs are False."""
+        intervals = self._intervals(ancestor_ids)
+        starts = [start for start, _ in intervals]
+        position, enter = self.position, self.enter
+        result = []
+        for category_id in category_ids:
+            node = position.get(category_id)
+            if node is None:
+                result.append(False)
+                continue
+            tin = enter[node]
+            i = bisect.bisect_right(starts, tin) - 1
+            result.append(i >= 0 and tin <= intervals[i][1])
+        return result
+
+    def filter_under(self, category_ids, ancestor_ids):
+        """The IDs from `category_ids` that fall under any of `ancestor_ids`, in input order."""
+        return [c for c, keep in zip(category_ids, self.under_any(category_ids, ancestor_ids)) if keep]
+
+    def lca_pairs(self, pairs):
+        """LCA of each (a, b) pair; None where the pair shares no category."""
+        result = []
+        for a, b in pairs:
+            node = self._lca(self._node(a), self._node(b))
+            result.append(None if node == self.root else self.ids[node])
+        return result
+
+    def ancestor_chains(self, category_ids):
+        return [self.ancestors(c) for c in category_ids]
+
+
+# Reference tree walks
+
+def _walk_ancestors(taxonomy, category_id):
+    chain = []
+    parents = taxonomy[category_id].get('parents') or []
+    while parents:
+        chain.append(parents[0])
+        parents = taxonomy[parents[0]].get('parents') or []
+    return chain
+
+
+def verify(hierarchy, taxonomy, samples=2000, seed=0):
+    """Compares every query with plain tree walks. Returns a list of failures."""
+    failures = []
+    children = {}
+    for category_id, details in taxonomy.items():
+        for parent in (details.get('parents') or [])[:1]:
+            children.setdefault(parent, []).append(category_id)
+    for category_id in taxonomy:
+        chain = _walk_ancestors(taxonomy, category_id)
+        if hierarchy.ancestors(category_id) != chain:
+            failures.append(('ancestors', category_id))
+        below, stack = set(), [category_id]
+        while stack:
+            node = stack.pop()
+            below.add(node)
+            stack.extend(children.get(node, ()))
+        if set(hierarchy.descendants(category_id)) != below:
+            failures.append(('descendants', category_id))
+    rng = random.Random(seed)
+    ids = list(taxonomy)
+    for _ in range(samples):
+        a, b = rng.choice(ids), rng.choice(ids)
+        a_chain = [a] + _walk_ancestors(taxonomy, a)
+        b_chain = set([b] + _walk_ancestors(taxonomy, b))
+        expected = next((c for c in a_chain if c in b_chain), None)
+        if hierarchy.lca(a, b) != expected:
+            failures.append(('lca', a, b))
+        if hierarchy.is_descendant(a, b) != (b in a_chain):
+            failures.append(('is_descendant', a, b))
+    return failures
+
+
+def bench(hierarchy, count=100000, seed=0):
+    """Returns {query: operations per second} over random IDs."""
+    rng = random.Random(seed)
+    ids = hierarchy.ids
+    sample = [rng.choice(ids) for _ in range(count)]
+    filters = rng.sample(ids, 20)
+    pairs = list(zip(sample, reversed(sample)))
+    rates = {}
+    start = time.perf_counter()
+    hierarchy.under_any(sample, filters)
+    rates['under_any'] = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    hierarchy.lca_pairs(pairs)
+    rates['lca_pairs'] = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for category_id in sample[:10000]:
+        hierarchy.ancestors(category_id)
+    rates['ancestors'] = 10000 / (time.perf_counter() - start)
+    return rates
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if not args:
+        print("Usage: python -m knowmaps_tools.taxonomy_hierarchy descendants|ancestors|lca|verify|bench [IDs...]")
+        return 2
+    command, ids = args[0], args[1:]
+    hierarchy = TaxonomyHierarchy.load()
+    try:
+        if command == 'descendants' and len(ids) == 1:
+            for category_id in hierarchy.descendants(ids[0]):
+                print(category_id)
+        elif command == 'ancestors' and len(ids) == 1:
+            for category_id in hierarchy.ancestors(ids[0]):
+                print(category_id)
+        elif command == 'lca' and ids:
+            print(hierarchy.lca(*ids))
+        elif command == 'verify':
+            from .taxonomy_index import load_taxonomy
+            failures = verify(hierarchy, load_taxonomy())
+            for failure in failures:
+                print(f"Mismatch: {failure}")
+            print(f"{len(hierarchy)} categories checked, {len(failures)} mismatch(es).")
+            return 1 if failures else 0
+        elif command == 'bench':
+            for query, rate in bench(hierarchy).items():
+                print(f"{query:12} {rate:12,.0f}/s")
+        else:
+            print(f"Unknown command: {' '.join(args)}")
+            return 2
+    except KeyError as e:
+        print(e.args[0])
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
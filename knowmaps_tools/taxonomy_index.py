@@ -0,0 +1,384 @@
+"""
+taxonomy_index.py
+
+Compiled, memory-mappable index for integrated_category_taxonomy.json.
+
+The compiler interns every string of the taxonomy once and writes flat
+little-endian uint32 arrays: category IDs, parent lists, full_label paths,
+per-language labels and two open-addressing hash tables (CRC-32 keyed) that
+map a lowercased label or a category ID to a category. A reader mmaps the
+file and answers lookups by probing a table, without parsing any JSON.
+
+Each label slot records two answers. The "compatible" answer reproduces
+FoursquareCategoryMapper.categoryID(for:): an English label match wins over a
+full_label component match, and ties go to the category that comes first in
+the JSON. The "any language" answer additionally accepts the vi/ms/th/tl/id/km
+labels at the lowest priority.
+
+The index lives in .knowmaps-cache/ and is rebuilt when the SHA-1 of the
+taxonomy recorded in its header no longer matches.
+
+Usage:
+    python -m knowmaps_tools.taxonomy_index [build|verify|bench]
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from .disk_index import CACHE_DIR
+from .edit_buffer import atomic_write
+
+TAXONOMY_PATH = 'Know-Maps/Know Maps Prod/Model/Controllers/integrated_category_taxonomy.json'
+INDEX_PATH = os.path.join(CACHE_DIR, 'category-taxonomy.idx')
+
+MAGIC = b'KMTX'
+VERSION = 1
+NONE = 0xFFFFFFFF
+SECTIONS = ('string_offsets', 'strings', 'ids', 'parent_offsets', 'parents', 'path_offsets', 'paths',
+            'label_offsets', 'labels', 'label_slots', 'id_slots')
+# magic, version, source sha1, category count, then (offset, length) per section
+HEADER = struct.Struct('<4sI20sI' + 'II' * len(SECTIONS))
+
+# Match tiers, best first.
+TIER_EN, TIER_FULL_LABEL, TIER_OTHER_LANGUAGE = 0, 1, 2
+
+if sys.byteorder != 'little':
+    raise ImportError("taxonomy_index reads uint32 arrays in place and needs a little-endian host")
+
+
+def load_taxonomy(path=TAXONOMY_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _hash(key):
+    return zlib.crc32(key)
+
+
+def _table_size(count):
+    size = 8
+    while size < count * 2:
+        size <<= 1
+    return size
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+        self.offsets = array('I', [0])
+        self.blob = bytearray()
+
+    def intern(self, text):
+        found = self.index.get(text)
+        if found is None:
+            found = self.index[text] = len(self.offsets) - 1
+            self.blob += text.encode('utf-8')
+            self.offsets.append(len(self.blob))
+        return found
+
+
+def _hash_table(entries, strings, width):
+    """
+    Open-addressing table of `width` uint32s per slot: the key's string index
+    followed by width - 1 values. `entries` maps key text to its values.
+    """
+    size = _table_size(len(entries))
+    slots = array('I', [NONE]) * (size * width)
+    mask = size - 1
+    for key in sorted(entries):
+        slot = _hash(key.encode('utf-8')) & mask
+        while slots[slot * width] != NONE:
+            slot = (slot + 1) & mask
+        slots[slot * width] = strings.intern(key)
+        for i, value in enumerate(entries[key]):
+            slots[slot * width + 1 + i] = value
+    return slots
+
+
+def compile_taxonomy(taxonomy, source_sha1=b'\0' * 20):
+    """Returns the binary index for a parsed taxonomy."""
+    strings = _Strings()
+    ids = array('I')
+    position = {category_id: i for i, category_id in enumerate(taxonomy)}
+    parent_offsets, parents = array('I', [0]), array('I')
+    path_offsets, paths = array('I', [0]), array('I')
+    label_offsets, labels = array('I', [0]), array('I')
+    # lowercased label -> [best compatible (tier, category), best overall]
+    best = {}
+
+    def offer(key, tier, category):
+        entry = best.setdefault(key, [None, None])
+        if tier <= TIER_FULL_LABEL and (entry[0] is None or (tier, category) < entry[0]):
+            entry[0] = (tier, category)
+        if entry[1] is None or (tier, category) < entry[1]:
+            entry[1] = (tier, category)
+
+    for i, (category_id, details) in enumerate(taxonomy.items()):
+        ids.append(strings.intern(category_id))
+        parents.extend(position.get(p, NONE) for p in details.get('parents') or ())
+        parent_offsets.append(len(parents))
+        full_label = details.get('full_label') or []
+        paths.extend(strings.intern(part) for part in full_label)
+        path_offsets.append(len(paths))
+        for language, label in (details.get('labels') or {}).items():
+            labels.extend((strings.intern(language), strings.intern(label)))
+            offer(label.lower(), TIER_EN if language == 'en' else TIER_OTHER_LANGUAGE, i)
+        label_offsets.append(len(labels) // 2)
+        for part in full_label:
+            offer(part.lower(), TIER_FULL_LABEL, i)
+
+    label_entries = {key: [NONE if e is None else e[1] for e in entry] for key, entry in best.items()}
+    label_slots = _hash_table(label_entries, strings, 3)
+    id_slots = _hash_table({category_id: [i] for category_id, i in position.items()}, strings, 2)
+
+    sections = {
+        'string_offsets': strings.offsets, 'strings': bytes(strings.blob), 'ids': ids,
+        'parent_offsets': parent_offsets, 'parents': parents, 'path_offsets': path_offsets, 'paths': paths,
+        'label_offsets': label_offsets, 'labels': labels, 'label_slots': label_slots, 'id_slots': id_slots,
+    }
+    body = bytearray()
+    layout = []
+    for name in SECTIONS:
+        data = sections[name]
+        raw = data.tobytes() if isinstance(data, array) else data
+        body += b'\0' * (-(HEADER.size + len(body)) % 4)
+        layout.extend((HEADER.size + len(body), len(raw)))
+        body += raw
+    return HEADER.pack(MAGIC, VERSION, source_sha1, len(taxonomy), *layout) + bytes(body)
+
+
+def _sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def build_index(source=TAXONOMY_PATH, dest=INDEX_PATH):
+    """Compiles `source` into `dest` atomically. Returns the destination path."""
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    data = compile_taxonomy(load_taxonomy(source), _sha1(source))
+    atomic_write(dest, (data,))
+    return dest
+
+
+class TaxonomyIndex:
+    """Read-only view of a compiled index."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.source_sha1, self.count, *layout = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} taxonomy index")
+        view = memoryview(self._map)
+        self._views = [view]
+        for i, name in enumerate(SECTIONS):
+            offset, length = layout[2 * i], layout[2 * i + 1]
+            section = view[offset:offset + length]
+            if name != 'strings':
+                section = section.cast('I')
+            self._views.append(section)
+            setattr(self, '_' + name, section)
+        self._label_mask = len(self._label_slots) // 3 - 1
+        self._id_mask = len(self._id_slots) // 2 - 1
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def string(self, index):
+        return bytes(self._strings[self._string_offsets[index]:self._string_offsets[index + 1]]).decode('utf-8')
+
+    def _probe(self, slots, width, mask, key):
+        encoded = key.encode('utf-8')
+        offsets = self._string_offsets
+        strings = self._strings
+        slot = _hash(encoded) & mask
+        while True:
+            base = slot * width
+            string_index = slots[base]
+            if string_index == NONE:
+                return None
+            start = offsets[string_index]
+            end = offsets[string_index + 1]
+            if end - start == len(encoded) and strings[start:end] == encoded:
+                return base
+            slot = (slot + 1) & mask
+
+    # Lookup by label
+
+    def _label_index(self, label, field):
+        base = self._probe(self._label_slots, 3, self._label_mask, label.lower())
+        if base is None:
+            return None
+        index = self._label_slots[base + field]
+        return None if index == NONE else index
+
+    def category_index(self, label, any_language=False):
+        """Position of the category a label resolves to, or None."""
+        return self._label_index(label, 2 if any_language else 1)
+
+    def category_id(self, label, any_language=False):
+        """The ID categoryID(for:) returns; `any_language` also matches non-English labels."""
+        index = self._label_index(label, 2 if any_language else 1)
+        return None if index is None else self.id_at(index)
+
+    def category_ids(self, labels, any_language=False):
+        """Matches categoryIDs(for:): labels that resolve to nothing are dropped."""
+        field = 2 if any_language else 1
+        found = []
+        for label in labels:
+            index = self._label_index(label, field)
+            if index is not None:
+                found.append(self.id_at(index))
+        return found
+
+    # Lookup by category
+
+    def index_of(self, category_id):
+        base = self._probe(self._id_slots, 2, self._id_mask, category_id)
+        return None if base is None else self._id_slots[base + 1]
+
+    def id_at(self, index):
+        return self.string(self._ids[index])
+
+    def ids(self):
+        return [self.id_at(i) for i in range(self.count)]
+
+    def parent_indexes(self, index):
+        return list(self._parents[self._parent_offsets[index]:self._parent_offsets[index + 1]])
+
+    def parents(self, category_id):
+        index = self.index_of(category_id)
+        return [] if index is None else [self.id_at(p) for p in self.parent_indexes(index) if p != NONE]
+
+    def full_label(self, category_id):
+        index = self.index_of(category_id)
+        if index is None:
+            return []
+        return [self.string(s) for s in self._paths[self._path_offsets[index]:self._path_offsets[index + 1]]]
+
+    def labels(self, category_id):
+        index = self.index_of(category_id)
+        if index is None:
+            return {}
+        pairs = self._labels[2 * self._label_offsets[index]:2 * self._label_offsets[index + 1]]
+        return {self.string(pairs[i]): self.string(pairs[i + 1]) for i in range(0, len(pairs), 2)}
+
+
+def open_index(source=TAXONOMY_PATH, path=INDEX_PATH):
+    """Opens the compiled index, rebuilding it first if it is missing or stale."""
+    try:
+        index = TaxonomyIndex(path)
+    except (OSError, ValueError):
+        index = None
+    if index is not None and index.source_sha1 == _sha1(source):
+        return index
+    if index is not None:
+        index.close()
+    build_index(source, path)
+    return TaxonomyIndex(path)
+
+
+# Reference semantics
+
+def linear_category_id(taxonomy, label):
+    """FoursquareCategoryMapper.categoryID(for:), scanning in JSON order."""
+    lowercase = label.lower()
+    for category_id, details in taxonomy.items():
+        en = (details.get('labels') or {}).get('en')
+        if en is not None and en.lower() == lowercase:
+            return category_id
+    for category_id, details in taxonomy.items():
+        if any(part.lower() == lowercase for part in details.get('full_label') or ()):
+            return category_id
+    return None
+
+
+def _probe_labels(taxonomy):
+    """Every label and path component, plus case variants and misses."""
+    labels = set()
+    for details in taxonomy.values():
+        labels.update((details.get('labels') or {}).values())
+        labels.update(details.get('full_label') or ())
+    probes = sorted(labels)
+    probes += [label.upper() for label in probes[::7]]
+    probes += [label + ' x' for label in probes[::11]] + ['', 'coffee shops', 'Cafe']
+    return probes
+
+
+def verify(index, taxonomy):
+    """Returns the labels on which the index and the linear scan disagree."""
+    mismatches = []
+    for label in _probe_labels(taxonomy):
+        if index.category_id(label) != linear_category_id(taxonomy, label):
+            mismatches.append(label)
+    for category_id, details in taxonomy.items():
+        if index.full_label(category_id) != details.get('full_label', []) \
+                or index.parents(category_id) != details.get('parents', []) \
+                or index.labels(category_id) != details.get('labels', {}):
+            mismatches.append(category_id)
+    return mismatches
+
+
+def bench(index, taxonomy, repeat=3):
+    """Returns (labels, linear lookups/s, index lookups/s)."""
+    probes = _probe_labels(taxonomy)
+    linear_probes = probes[:400]
+    start = time.perf_counter()
+    for label in linear_probes:
+        linear_category_id(taxonomy, label)
+    linear = len(linear_probes) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        index.category_ids(probes)
+    indexed = len(probes) * repeat / (time.perf_counter() - start)
+    return len(probes), linear, indexed
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    command = args[0] if args else 'build'
+    if command == 'build':
+        start = time.perf_counter()
+        path = build_index()
+        print(f"Wrote {path} ({os.path.getsize(path)} bytes) in {time.perf_counter() - start:.3f}s")
+        return 0
+    taxonomy = load_taxonomy()
+    with open_index() as index:
+        if command == 'verify':
+            mismatches = verify(index, taxonomy)
+            for label in mismatches:
+                print(f"Mismatch: {label!r}")
+            print(f"{len(index)} categories checked, {len(mismatches)} mismatch(es).")
+            return 1 if mismatches else 0
+        if command == 'bench':
+            count, linear, indexed = bench(index, taxonomy)
+            print(f"{count} labels: linear scan {linear:,.0f}/s, index {indexed:,.0f}/s ({indexed / linear:,.0f}x)")
+            return 0
+    print("Usage: python -m knowmaps_tools.taxonomy_index [build|verify|bench]")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,485 @@
+"""
+training_data.py
+
+Streaming validator and deduplicator for the hand-edited Create ML corpora:
+the word tagger data (WordTaggingClassifierTrainingData*.json), the query
+classifier data (QueryClassifierTrainingData.json) and the Foursquare
+section classifier data (FoursquareClassifierTrainingData.csv).
+
+JSON arrays are parsed one record at a time from a bounded buffer instead
+of loading the file, so a syntax error is reported with its line and parsing
+resumes at the next record. Every record is checked against its corpus
+schema: tokens and labels of equal length, labels from the known set, no
+empty text. Exact duplicates are found by hashing the normalized text
+(case-folded words), and are reported as conflicts when their labels
+differ. Near-duplicates are found with MinHash signatures over character
+shingles (byte 4-grams), computed a batch at a time with NumPy, and banded LSH: only
+records sharing a band are compared, so the whole check is linear in the
+corpus size.
+
+Prerequisites:
+    - numpy (`pip install numpy`)
+
+Usage:
+    python -m knowmaps_tools.training_data [validate] [files...] [--threshold 0.8] [--all]
+    python -m knowmaps_tools.training_data bench [--scales 1,10,100]
+"""
+
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from .common import option
+
+ML_DIR = 'Know-Maps/Know Maps Prod/Model/ML'
+CORPORA = (
+    'WordTaggingClassifierTrainingData.json',
+    'WordTaggingClassifierTrainingData_FULLSET.json',
+    'WordTaggingClassifierTrainingData_TestData.json',
+    'QueryClassifierTrainingData.json',
+    'FoursquareClassifierTrainingData.csv',
+)
+TAGGER_LABELS = frozenset({'NONE', 'PLACE', 'TASTE', 'CATEGORY'})
+QUERY_LABELS = frozenset({'SearchQuery', 'TellPlace', 'ShareResult', 'Unsupported'})
+SECTION_LABELS = frozenset({'Coffee', 'Food', 'Drinks', 'Shopping', 'Art', 'Outdoors'})
+
+READ_SIZE = 1 << 16
+# A record still unparsed with this much text after its start is malformed,
+# not cut off by the read buffer.
+MAX_RECORD = 1 << 20
+SHINGLE = 4
+NUM_PERM = 64
+BANDS = 16
+# Members kept per LSH bucket, which bounds the comparisons per record.
+MAX_BUCKET = 32
+BATCH = 1024
+THRESHOLD = 0.8
+
+ERRORS = ('syntax', 'schema', 'length', 'label', 'empty')
+_WORD_RE = re.compile(r'\w+')
+_RESYNC_RE = re.compile(r'\}\s*([,\]])')
+_SPACE_RE = re.compile(r'\s*')
+
+
+class CorpusIssue(dict):
+    """A single finding: path, line, record index, kind and message."""
+
+    def __str__(self):
+        return f"{self['path']}:{self['line']}: {self['kind']}: {self['message']}"
+
+
+# Streaming readers
+
+def iter_json_array(path, read_size=READ_SIZE):
+    """
+    Yields (line, record, error) for each element of a top-level JSON array,
+    with `error` set instead of `record` for an element that does not parse.
+    After an error, reading resumes past the next '}' followed by ',' or ']'.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+        counted, line = 0, 1
+
+        def more():
+            nonlocal buffer, pos, counted, eof
+            chunk = f.read(read_size)
+            if not chunk:
+                eof = True
+                return False
+            line_at(pos)
+            buffer = buffer[pos:] + chunk
+            counted -= pos
+            pos = 0
+            return True
+
+        def line_at(offset):
+            nonlocal counted, line
+            if offset > counted:
+                line += buffer.count('\n', counted, offset)
+                counted = offset
+            return line
+
+        def skip_space():
+            nonlocal pos
+            while True:
+                pos = _SPACE_RE.match(buffer, pos).end()
+                if pos < len(buffer) or not more():
+                    return pos < len(buffer)
+
+        if not skip_space() or buffer[pos] != '[':
+            yield line_at(pos), None, "expected a JSON array"
+            return
+        pos += 1
+        first = True
+        while skip_space():
+            char = buffer[pos]
+            if char == ']':
+                return
+            if not first:
+                if char == ',':
+                    pos += 1
+                    if not skip_space():
+                        break
+                else:
+                    yield line_at(pos), None, "missing ',' between records"
+            first = False
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError as e:
+                    if not eof and len(buffer) - pos < MAX_RECORD and more():
+                        continue
+                    start = line_at(pos)
+                    resume = max(e.pos, pos)
+                    yield line_at(resume), None, f"{e.msg} (record starting at line {start})"
+                    while True:
+                        match = _RESYNC_RE.search(buffer, resume)
+                        if match:
+                            break
+                        shift = pos
+                        if not more():
+                            break
+                        # more() drops buffer[:pos]; keep `resume` pointing at the same text.
+                        resume -= shift
+                    if match is None:
+                        return
+                    line_at(match.start(1))
+                    pos = match.start(1)
+                    break
+                line_here = line_at(pos)
+                pos = end
+                yield line_here, record, None
+                break
+        yield line_at(pos), None, "unterminated array"
+
+
+def iter_csv(path):
+    """Yields (line, row dict, None) for each row of a CSV file with a header."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        line = reader.line_num + 1
+        for row in reader:
+            yield line, row, None
+            line = reader.line_num + 1
+
+
+# Schemas
+
+def corpus_schema(path):
+    """(kind, known labels) for a corpus file, from its name."""
+    name = os.path.basename(path)
+    if name.endswith('.csv'):
+        return 'section', SECTION_LABELS if name.startswith('Foursquare') else None
+    if name.startswith('WordTagging'):
+        return 'tagger', TAGGER_LABELS
+    return 'query', QUERY_LABELS if name.startswith('QueryClassifier') else None
+
+
+def _strings(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def check_record(kind, record, labels=None):
+    """Returns (text, label, [(issue kind, message)]) for one record."""
+    problems = []
+    if not isinstance(record, dict):
+        return None, None, [('schema', f"expected an object, got {type(record).__name__}")]
+    if kind == 'tagger':
+        tokens, tags = record.get('tokens'), record.get('labels')
+        if not _strings(tokens) or not _strings(tags):
+            return None, None, [('schema', "'tokens' and 'labels' must be lists of strings")]
+        text, label = ' '.join(tokens), tuple(tags)
+        if not tokens or not all(t.strip() for t in tokens):
+            problems.append(('empty', "empty token list or blank token"))
+        if tags == ['']:
+            problems.append(('unlabeled', "labels is [\"\"]"))
+        elif len(tokens) != len(tags):
+            problems.append(('length', f"{len(tokens)} tokens but {len(tags)} labels"))
+        if labels is not None and tags != ['']:
+            unknown = sorted(set(tags) - labels)
+            if unknown:
+                problems.append(('label', f"unknown label(s) {', '.join(map(repr, unknown))}"))
+    else:
+        text, label = record.get('text'), record.get('label')
+        if not isinstance(text, str) or not isinstance(label, str):
+            return None, None, [('schema', "'text' and 'label' must be strings")]
+        if not text.strip():
+            problems.append(('empty', "empty text"))
+        if labels is not None and label not in labels:
+            problems.append(('label', f"unknown label {label!r}"))
+    return text, label, problems
+
+
+def iter_examples(path):
+    """(line, record index, text, label) of every record with usable text, without reporting issues."""
+    kind, _ = corpus_schema(path)
+    reader = iter_csv if kind == 'section' else iter_json_array
+    index = 0
+    for line, record, error in reader(path):
+        if error is not None:
+            continue
+        text, label, _ = check_record(kind, record)
+        if text is not None:
+            yield line, index, text, label
+        index += 1
+
+
+def normalize(text):
+    """Case-folded words joined by single spaces."""
+    return ' '.join(_WORD_RE.findall(text.casefold()))
+
+
+def text_hash(normalized):
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+
+# MinHash / LSH
+
+class MinHasher:
+    """
+    MinHash over the byte 4-grams of normalized texts, read straight from the
+    UTF-8 bytes as uint32s and mixed with a multiply-shift hash family, so a
+    whole batch is signed with a few array operations.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        import numpy as np
+
+        self._np = np
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+    def signatures(self, texts):
+        """(len(texts), num_perm) uint32 signatures of normalized texts."""
+        np = self._np
+        if not texts:
+            return np.zeros((0, self.num_perm), dtype=np.uint32)
+        encoded = [text.encode('utf-8').ljust(SHINGLE) for text in texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+        grams = (data[:-3] << np.uint64(24)) | (data[1:-2] << np.uint64(16)) | (data[2:-1] << np.uint64(8)) | data[3:]
+        # One row per permutation keeps the per-text minimum over contiguous memory.
+        hashed = self.a[:, None] * grams + self.b[:, None]
+        # Grams that straddle two texts never win the minimum.
+        straddling = (starts[1:, None] - np.arange(1, SHINGLE)).ravel()
+        hashed[:, straddling] = np.iinfo(np.uint64).max
+        # The top 32 bits of the minimum are the minimum of the top 32 bits.
+        return (np.minimum.reduceat(hashed, starts, axis=1).T >> np.uint64(32)).astype(np.uint32)
+
+
+class LshIndex:
+    """Banded LSH over MinHash signatures: records sharing any band are candidates."""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError(f"{num_perm} permutations do not split into {bands} bands")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.buckets = [{} for _ in range(bands)]
+
+    def band_keys(self, signatures):
+        """(rows, bands) uint64 band keys of a signature matrix."""
+        import numpy as np
+
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        keys = bands[:, :, 0]
+        for row in range(1, self.rows):
+            keys = keys * np.uint64(0x100000001B3) ^ bands[:, :, row]
+        return keys
+
+    def candidates(self, keys):
+        found = set()
+        for bucket, key in zip(self.buckets, keys):
+            found.update(bucket.get(key, ()))
+        return found
+
+    def add(self, ident, keys):
+        for bucket, key in zip(self.buckets, keys):
+            members = bucket.setdefault(key, [])
+            # A full bucket already holds enough look-alikes to match against.
+            if len(members) < MAX_BUCKET:
+                members.append(ident)
+
+
+# Validation
+
+class CorpusValidator:
+    """Validates and deduplicates one corpus file in a single streaming pass."""
+
+    def __init__(self, path, labels=None, threshold=THRESHOLD, hasher=None):
+        import numpy as np
+
+        self._np = np
+        self.path = path
+        self.kind, known = corpus_schema(path)
+        self.labels = known if labels is None else frozenset(labels)
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        self.records = 0
+        self.issues = []
+        self._seen = {}
+        self._lsh = LshIndex(self.hasher.num_perm)
+        self._signatures = np.zeros((BATCH, self.hasher.num_perm), dtype=np.uint32)
+        self._kept = []
+        self._pending = []
+
+    def _issue(self, line, index, kind, message):
+        self.issues.append(CorpusIssue(path=self.path, line=line, index=index, kind=kind, message=message))
+
+    def run(self):
+        reader = iter_csv if self.kind == 'section' else iter_json_array
+        for line, record, error in reader(self.path):
+            if error is not None:
+                self._issue(line, None, 'syntax', error)
+                continue
+            index = self.records
+            self.records += 1
+            text, label, problems = check_record(self.kind, record, self.labels)
+            for kind, message in problems:
+                self._issue(line, index, kind, message)
+            if text is None:
+                continue
+            normalized = normalize(text)
+            if not normalized:
+                continue
+            digest = text_hash(normalized)
+            first = self._seen.get(digest)
+            if first is not None:
+                first_line, first_index, first_label = first
+                if first_label == label:
+                    self._issue(line, index, 'duplicate', f"same text as record {first_index} (line {first_line})")
+                else:
+                    self._issue(line, index, 'conflict',
+                                f"same text as record {first_index} (line {first_line}) with a different label")
+                continue
+            self._seen[digest] = (line, index, label)
+            self._pending.append((line, index, label, normalized))
+            if len(self._pending) >= BATCH:
+                self._near_duplicates()
+        self._near_duplicates()
+        self.issues.sort(key=lambda issue: issue['line'])
+        return self.issues
+
+    def _near_duplicates(self):
+        np = self._np
+        if not self._pending:
+            return
+        signatures = self.hasher.signatures([p[3] for p in self._pending])
+        base = len(self._kept)
+        if base + len(signatures) > len(self._signatures):
+            grown = np.zeros((2 * (base + len(signatures)), self.hasher.num_perm), dtype=np.uint32)
+            grown[:base] = self._signatures[:base]
+            self._signatures = grown
+        self._signatures[base:base + len(signatures)] = signatures
+        band_keys = self._lsh.band_keys(signatures).tolist()
+        for offset, (line, index, label, _) in enumerate(self._pending):
+            ident = base + offset
+            signature, keys = signatures[offset], band_keys[offset]
+            candidates = self._lsh.candidates(keys)
+            if candidates:
+                ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                similarity = (self._signatures[ids] == signature).mean(axis=1)
+                best = int(similarity.argmax())
+                if similarity[best] >= self.threshold:
+                    other_line, other_index, other_label = self._kept[ids[best]]
+                    relation = 'same label' if other_label == label else 'different label'
+                    self._issue(line, index, 'near-duplicate',
+                                f"~{similarity[best]:.2f} similar to record {other_index} (line {other_line}), {relation}")
+            self._lsh.add(ident, keys)
+            self._kept.append((line, index, label))
+        self._pending = []
+
+
+def validate(paths, threshold=THRESHOLD, labels=None):
+    """{path: (issues, record count)}, one streaming pass per file."""
+    hasher = MinHasher()
+    results = {}
+    for path in paths:
+        validator = CorpusValidator(path, labels, threshold, hasher)
+        results[path] = (validator.run(), validator.records)
+    return results
+
+
+# Benchmarks
+
+def _synthetic_corpus(path, source, scale, seed=0):
+    """Writes `scale` copies of a tagger corpus with one token changed per copy."""
+    rng = random.Random(seed)
+    with open(source, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    vocabulary = sorted({t for r in records for t in r['tokens']})
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        first = True
+        for copy in range(scale):
+            for record in records:
+                tokens = list(record['tokens'])
+                if copy:
+                    tokens[rng.randrange(len(tokens))] = rng.choice(vocabulary)
+                    tokens.append(f"v{copy}")
+                    labels = record['labels'] + ['NONE']
+                else:
+                    labels = record['labels']
+                f.write(('' if first else ',\n') + json.dumps({'tokens': tokens, 'labels': labels}))
+                first = False
+        f.write('\n]\n')
+    return len(records) * scale
+
+
+def bench(scales=(1, 10, 100)):
+    """Returns [(scale, records, seconds, records per second)]."""
+    source = os.path.join(ML_DIR, 'WordTaggingClassifierTrainingData.json')
+    root = tempfile.mkdtemp(prefix='knowmaps-corpus-')
+    results = []
+    try:
+        for scale in scales:
+            path = os.path.join(root, 'WordTaggingClassifierTrainingData.json')
+            records = _synthetic_corpus(path, source, scale)
+            start = time.perf_counter()
+            CorpusValidator(path).run()
+            elapsed = time.perf_counter() - start
+            results.append((scale, records, elapsed, records / elapsed))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    if args and args[0] == 'bench':
+        scales = [int(s) for s in option(args, '--scales', '1,10,100').split(',')]
+        for scale, records, elapsed, rate in bench(scales):
+            print(f"x{scale:<4} {records:>9} records {elapsed:8.2f}s {rate:12,.0f} records/s")
+        return 0
+    if args and args[0] == 'validate':
+        args = args[1:]
+    threshold = float(option(args, '--threshold', THRESHOLD))
+    show_all = '--all' in args
+    paths = [a for i, a in enumerate(args) if not a.startswith('--') and (i == 0 or args[i - 1] != '--threshold')]
+    paths = paths or [os.path.join(ML_DIR, name) for name in CORPORA]
+    errors = 0
+    for path, (issues, records) in validate(paths, threshold).items():
+        counts = {}
+        for issue in issues:
+            counts[issue['kind']] = counts.get(issue['kind'], 0) + 1
+            if show_all or counts[issue['kind']] <= 5:
+                print(issue)
+        errors += sum(counts.get(kind, 0) for kind in ERRORS)
+        summary = ', '.join(f"{count} {kind}" for kind, count in sorted(counts.items())) or 'clean'
+        print(f"{path}: {records} records, {summary}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+transaction.py
+
+Batched edits against a parsed project.pbxproj.
+
+A ProjectTransaction collects add, remove and move operations for any number
+of files. Nothing touches the object graph until `commit()`, which resolves
+every group and build-phase anchor once through a ReferenceIndex, rewrites
+each affected children or files list a single time and serializes the project
+in one merge pass.
+
+Usage:
+    project = PBXProject.load(PBXPROJ_PATH)
+    with ProjectTransaction(project) as txn:
+        txn.add_file("Know Maps Prod/View/MainUI.swift", group_id, phase_id)
+"""
+
+import os
+
+from .ids import IDAllocator
+from .references import ReferenceIndex
+
+FILE_TYPES = {
+    '.swift': 'sourcecode.swift',
+    '.mlmodel': 'file.mlmodel',
+    '.mlpackage': 'folder.mlpackage',
+    '.json': 'text.json',
+    '.plist': 'text.plist.xml',
+    '.entitlements': 'text.plist.entitlements',
+    '.xcassets': 'folder.assetcatalog',
+    '.md': 'net.daringfireball.markdown',
+}
+
+
+def file_type_for(path):
+    return FILE_TYPES.get(os.path.splitext(path)[1], 'text')
+
+
+class ProjectTransaction:
+    """Collects file edits and applies them to a PBXProject in one pass."""
+
+    def __init__(self, project, allocator=None):
+        self.project = project
+        self.allocator = allocator or IDAllocator.from_project(project)
+        self.refs = None
+        self.targets = None
+        self.groups = []
+        self.pending_paths = {}
+        self.adds = []
+        self.phase_adds = []
+        self.removes = []
+        self.moves = []
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self.committed:
+            self.commit()
+        return False
+
+    # Recording
+
+    def add_file(self, path, group_id, phase_id=None, source_tree='<group>', name=None,
+                 file_id=None, build_id=None):
+        """
+        Queues a new PBXFileReference (and a PBXBuildFile when `phase_id` is
+        given). Returns the (file_id, build_id) pair that will be used; unless
+        given, both are derived from the target, group path and file path.
+        """
+        target = self._target_name(phase_id)
+        group_path = self._group_path(group_id)
+        file_id = file_id or self.allocator.derive(target, group_path, path, 'ref')
+        if phase_id is not None:
+            build_id = build_id or self.allocator.derive(target, group_path, path, 'build')
+        else:
+            build_id = None
+        self.adds.append((path, group_id, phase_id, source_tree, name, file_id, build_id))
+        return file_id, build_id
+
+    def add_group(self, path, parent_id, group_path=None):
+        """Queues a new `<group>`-relative PBXGroup under `parent_id` and returns its ID."""
+        parent_path = group_path if group_path is not None else self._group_path(parent_id)
+        group_id = self.allocator.derive('', parent_path, path, 'group')
+        self.groups.append((group_id, path, parent_id))
+        self.pending_paths[group_id] = f"{parent_path}/{path}" if parent_path else path
+        return group_id
+
+    def add_to_phase(self, file_id, phase_id, display=None):
+        """Queues a PBXBuildFile for an existing file reference."""
+        ref = self.project[file_id]
+        display = display or ref.comment
+        build_id = self.allocator.derive(self._target_name(phase_id), file_id, display, 'build')
+        self.phase_adds.append((build_id, file_id, phase_id, display))
+        return build_id
+
+    def remove_file(self, object_id):
+        """
+        Queues removal of a file reference and every build file pointing at it.
+        Passing a build file ID removes just that build file and its phase entries.
+        """
+        self.removes.append(object_id)
+
+    def move_file(self, file_id, group_id):
+        """Queues moving a file reference into another group."""
+        self.moves.append((file_id, group_id))
+
+    def __len__(self):
+        return len(self.groups) + len(self.adds) + len(self.phase_adds) + len(self.removes) + len(self.moves)
+
+    def _index(self):
+        if self.refs is None:
+            self.refs = ReferenceIndex(self.project)
+        return self.refs
+
+    def _group_path(self, group_id):
+        """Slash-joined names of the groups from the main group down to `group_id`."""
+        if group_id in self.pending_paths:
+            return self.pending_paths[group_id]
+        parts = []
+        parents = self._index().parents
+        seen = set()
+        while group_id is not None and group_id not in seen:
+            seen.add(group_id)
+            group = self.project.get(group_id)
+            if group is None:
+                break
+            name = group.get('name') or group.get('path')
+            if name:
+                parts.append(name)
+            owners = parents.get(group_id)
+            group_id = min(owners) if owners else None
+        return '/'.join(reversed(parts))
+
+    def _target_name(self, phase_id):
+        if phase_id is None:
+            return ''
+        if self.targets is None:
+            self.targets = {}
+            for target in self.project.iter_isa('PBXNativeTarget'):
+                for build_phase in target.get('buildPhases', ()):
+                    self.targets[build_phase] = target.get('name', '')
+        return self.targets.get(phase_id, '')
+
+    # Applying
+
+    def apply(self):
+        """Applies the queued operations to the object graph without saving."""
+        project = self.project
+        refs = self._index()
+        refs.remove_many(self.removes)
+        parents = refs.parents
+        dropped = {}
+        appended = {}
+
+        for file_id, group_id in self.moves:
+            for old_group in parents.get(file_id, ()):
+                if old_group != group_id:
+                    dropped.setdefault(old_group, set()).add(file_id)
+            if group_id not in parents.get(file_id, ()):
+                appended.setdefault(group_id, []).append(file_id)
+
+        for group_id, path, parent_id in self.groups:
+            project.add(group_id, {'isa': 'PBXGroup', 'children': [], 'path': path, 'sourceTree': '<group>'})
+            appended.setdefault(parent_id, []).append(group_id)
+
+        for build_id, file_id, phase_id, display in self.phase_adds:
+            phase = project[phase_id]
+            project.add(build_id, {'isa': 'PBXBuildFile', 'fileRef': file_id},
+                        comment=f"{display} in {phase.comment}")
+            appended.setdefault(phase_id, []).append(build_id)
+
+        for path, group_id, phase_id, source_tree, name, file_id, build_id in self.adds:
+            display = name or os.path.basename(path)
+            fields = {
+                'isa': 'PBXFileReference',
+                'lastKnownFileType': file_type_for(path),
+                'path': path,
+                'sourceTree': source_tree,
+            }
+            if name is not None:
+                fields['name'] = name
+            project.add(file_id, fields, comment=display)
+            appended.setdefault(group_id, []).append(file_id)
+            if build_id is not None:
+                phase = project[phase_id]
+                project.add(build_id, {'isa': 'PBXBuildFile', 'fileRef': file_id},
+                            comment=f"{display} in {phase.comment}")
+                appended.setdefault(phase_id, []).append(build_id)
+
+        for container_id in set(dropped) | set(appended):
+            if container_id not in project:
+                continue
+            container = project[container_id]
+            key = 'children' if 'children' in container else 'files'
+            removed = dropped.get(container_id, ())
+            items = [item for item in container[key] if item not in removed]
+            items.extend(appended.get(container_id, ()))
+            container[key] = items
+
+    def edit_script(self):
+        """Returns the planned edits as unified-diff style hunks with line numbers."""
+        text = self.project.text
+        script = []
+        line, pos = 1, 0
+        for start, end, replacement in self.project.edits():
+            line += text.count('\n', pos, start)
+            pos = start
+            removed = text[start:end].splitlines()
+            added = replacement.splitlines()
+            script.append(f"@@ line {line}: -{len(removed)} +{len(added)} @@")
+            script.extend('-' + l for l in removed)
+            script.extend('+' + l for l in added)
+        return script
+
+    def commit(self, dry_run=False):
+        """
+        Applies the queued operations and writes the project once. With
+        `dry_run` the edit script is printed and nothing is written.
+        """
+        self.apply()
+        self.committed = True
+        if dry_run:
+            for line in self.edit_script():
+                print(line)
+            return False
+        return self.project.save()
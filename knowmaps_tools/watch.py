@@ -0,0 +1,792 @@
+"""
+watch.py
+
+Watch mode: keeps project.pbxproj and the Swift syntax check results
+consistent with the source tree while files are edited, added, moved and
+deleted, instead of running fix_project.py and check_braces.py by hand.
+
+The daemon puts an inotify watch on every directory under the source
+directories declared in project.yml (directories created later are watched
+as they appear) and collects events until the tree has been quiet for QUIET
+seconds, or MAX_DELAY has passed since the first one. The batch is then
+processed without rescanning the tree:
+
+  - only the touched paths are stat'ed; the listing of the tree lives in
+    memory and is updated from the events,
+  - touched Swift files are hashed and, when their content changed, checked
+    again with the swift_syntax lexer in-process,
+  - the project diff is computed for the touched paths alone
+    (`ProjectSync.compute(only=...)`) and applied in one transaction; a
+    file moved to another directory keeps its reference and build file IDs.
+
+project.yml and project.pbxproj are watched too: a changed spec, or a
+project edited by Xcode, is reloaded and reconciled against the in-memory
+listing. After every batch the state is written atomically to a JSON
+status file (.knowmaps-cache/watch-status.json) that `status` prints and
+editors or build scripts can read.
+
+The diff found at startup covers whatever drifted while no watcher was
+running, so it is only reported as pending: those paths are held back, also
+from later full reconciles, until an event touches them. --apply-initial
+applies it at startup instead.
+
+Where inotify is unavailable (macOS) or with --poll, the watched
+directories are listed and stat'ed every POLL_INTERVAL seconds instead.
+
+Prerequisites:
+    - PyYAML (`pip install pyyaml`)
+
+Usage:
+    python -m knowmaps_tools.watch [run] [--dry-run] [--apply-initial] [--poll] [--status PATH] [Know-Maps]
+    python -m knowmaps_tools.watch status [--status PATH]
+    python -m knowmaps_tools.watch bench
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import json
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from .common import option
+from .disk_index import CACHE_DIR, default_cache_path
+from .swift_syntax import SwiftSyntaxIssue, check_paths, check_text, load_cache, save_cache
+from .sync import PBXPROJ_NAME, PROJECT_DIR, SPEC_NAME, ProjectSync, declared, load_spec, target_sources
+
+STATUS_PATH = os.path.join(CACHE_DIR, 'watch-status.json')
+STATUS_VERSION = 1
+QUIET = 0.025
+MAX_DELAY = 0.2
+POLL_INTERVAL = 0.1
+# Longest sleep while idle, so a stop request is noticed.
+HEARTBEAT = 0.5
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+_EVENT = struct.Struct('iIII')
+
+
+def _plan_paths(plan):
+    return {path for _, inserts, deletes in plan.values() for path in inserts + [p for p, _ in deletes]}
+
+
+def _split_plan(plan, paths):
+    """Splits a ProjectSync plan into (entries for other paths, entries for `paths`)."""
+    parts = ({}, {})
+    for target_name, (phase_id, inserts, deletes) in plan.items():
+        for part, inside in zip(parts, (False, True)):
+            part_inserts = [p for p in inserts if (p in paths) == inside]
+            part_deletes = [d for d in deletes if (d[0] in paths) == inside]
+            if part_inserts or part_deletes:
+                part[target_name] = (phase_id, part_inserts, part_deletes)
+    return parts
+
+
+class Inotify:
+    """Per-directory inotify watches through libc; events come back as (path, mask, cookie)."""
+
+    mode = 'inotify'
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.paths = {}
+        self.wds = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(code, os.strerror(code), path)
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def moved(self, src, dst):
+        """A watched directory was renamed; its watches follow it, their paths must too."""
+        prefix = os.path.join(src, '')
+        for path in [p for p in self.wds if p == src or p.startswith(prefix)]:
+            wd = self.wds.pop(path)
+            self.paths[wd] = dst + path[len(src):]
+            self.wds[self.paths[wd]] = wd
+
+    def __len__(self):
+        return len(self.wds)
+
+    def read(self):
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask, 0))
+                continue
+            base = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                if base is not None and self.wds.get(base) == wd:
+                    del self.wds[base]
+                self.paths.pop(wd, None)
+                continue
+            if base is not None:
+                events.append((os.path.join(base, os.fsdecode(name)) if name else base, mask, cookie))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """Stat-based stand-in for Inotify: lists each watched directory every interval."""
+
+    mode = 'poll'
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.listings = {}
+
+    def fileno(self):
+        return None
+
+    @staticmethod
+    def _list(path):
+        listing = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    st = entry.stat(follow_symlinks=False)
+                    listing[entry.name] = (entry.is_dir(follow_symlinks=False), st.st_mtime_ns, st.st_size, st.st_ino)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return listing
+
+    def add(self, path):
+        listing = self._list(path)
+        if listing is not None:
+            self.listings[path] = listing
+
+    def moved(self, src, dst):
+        pass
+
+    def __len__(self):
+        return len(self.listings)
+
+    def read(self):
+        events = []
+        for path, old in list(self.listings.items()):
+            new = self._list(path)
+            if new is None:
+                del self.listings[path]
+                continue
+            self.listings[path] = new
+            for name in old.keys() | new.keys():
+                before, after = old.get(name), new.get(name)
+                if before == after:
+                    continue
+                if after is None:
+                    mask = IN_DELETE | (IN_ISDIR if before[0] else 0)
+                elif before is None or before[0] != after[0]:
+                    mask = IN_CREATE | (IN_ISDIR if after[0] else 0)
+                else:
+                    mask = IN_CLOSE_WRITE
+                events.append((os.path.join(path, name), mask, 0))
+        return events
+
+    def close(self):
+        pass
+
+
+def event_source(poll=False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return Inotify()
+        except (OSError, AttributeError):
+            pass
+    return Poller()
+
+
+def source_roots(spec):
+    """Project-relative source directories of every target, nested ones dropped."""
+    paths = sorted({path for sources in target_sources(spec).values() for path, _ in sources})
+    roots = []
+    for path in paths:
+        if not any(path.startswith(os.path.join(root, '')) for root in roots):
+            roots.append(path)
+    return roots
+
+
+class WatchedSync(ProjectSync):
+    """ProjectSync that reads the tree from the watcher's in-memory listing instead of the disk."""
+
+    def __init__(self, project_dir, listing):
+        self.listing = listing
+        super().__init__(project_dir)
+
+    def sources(self, source_path, excludes):
+        prefix = len(os.path.join(self.project_dir, ''))
+        return sorted(p for p in (path[prefix:] for path in self.listing) if declared(p, source_path, excludes))
+
+    def exists(self, path):
+        return os.path.join(self.project_dir, path) in self.listing
+
+
+class Watcher:
+    """Keeps project membership and syntax results up to date from file system events."""
+
+    def __init__(self, project_dir=PROJECT_DIR, dry_run=False, poll=False, status_path=STATUS_PATH,
+                 use_cache=True, on_flush=None, apply_initial=False):
+        self.project_dir = project_dir
+        self.dry_run = dry_run
+        self.apply_initial = apply_initial
+        self.status_path = status_path
+        self.use_cache = use_cache
+        self.on_flush = on_flush
+        self.spec_path = os.path.join(project_dir, SPEC_NAME)
+        self.pbxproj_path = os.path.join(project_dir, PBXPROJ_NAME)
+        self.source = event_source(poll)
+        # path -> is_dir for everything under the roots
+        self.listing = {}
+        self.sync = WatchedSync(project_dir, self.listing)
+        self.roots = []
+        # Swift path -> {'sha1', 'issues'}, in the swift_syntax cache format
+        self.syntax = {}
+        self.pending = []
+        # The part of the startup diff that was not applied, and its paths.
+        self.held = {}
+        self.held_paths = set()
+        self.error = None
+        self.written = 0
+        self.last_edit = []
+        self.last_batch = {}
+        self.stopping = False
+        self._own_write = None
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self.first = self.last = None
+        self.events = 0
+        self.touched = set()
+        self.moves = []
+        self.moved_from = {}
+        self.spec_changed = False
+        self.project_changed = False
+        self.overflow = False
+
+    # Tree
+
+    def _add_tree(self, top):
+        """Watches and lists a directory tree; returns the paths it added."""
+        added = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            self.source.add(path)
+            if path not in self.listing:
+                self.listing[path] = True
+                added.append(path)
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.path not in self.listing:
+                    self.listing[entry.path] = False
+                    added.append(entry.path)
+        return added
+
+    def _drop_tree(self, top):
+        prefix = os.path.join(top, '')
+        removed = [p for p in self.listing if p == top or p.startswith(prefix)]
+        for path in removed:
+            del self.listing[path]
+        return removed
+
+    def _under_roots(self, path):
+        return any(path == root or path.startswith(os.path.join(root, '')) for root in self.roots)
+
+    def _watch_roots(self):
+        self.roots = [os.path.join(self.project_dir, root) for root in source_roots(self.sync.spec)]
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _project_stat(self):
+        try:
+            st = os.stat(self.pbxproj_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    # Syntax
+
+    def _check_syntax(self, path):
+        """Re-checks one Swift file if its content changed; returns True when it was lexed."""
+        if self.listing.get(path) is not False:
+            self.syntax.pop(path, None)
+            return False
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.syntax.pop(path, None)
+            return False
+        digest = hashlib.sha1(data).hexdigest()
+        cached = self.syntax.get(path)
+        if cached is not None and cached['sha1'] == digest:
+            return False
+        self.syntax[path] = {'sha1': digest, 'issues': check_text(data.decode('utf-8', errors='replace'), path)}
+        return True
+
+    def issues(self):
+        found = [SwiftSyntaxIssue(issue) for entry in self.syntax.values() for issue in entry['issues']]
+        found.sort(key=lambda issue: (issue['path'], issue['line'], issue['column']))
+        return found
+
+    def _save_syntax(self):
+        if not self.use_cache:
+            return
+        roots = tuple(os.path.join(root, '') for root in self.roots)
+        cache = {path: entry for path, entry in load_cache().items() if not path.startswith(roots)}
+        cache.update(self.syntax)
+        save_cache(cache)
+
+    # Project
+
+    def _reconcile(self, only=None, hold=False):
+        """
+        Computes the plan for `only` (or everything) and applies it unless this
+        is a dry run. With `hold` the whole plan is held back instead; held
+        paths stay out of every later plan until `only` includes them.
+        """
+        self.sync.compute(only)
+        if hold:
+            self.held_paths = _plan_paths(self.sync.plan)
+        elif only is not None:
+            self.held_paths.difference_update(only)
+        self.sync.plan, held = _split_plan(self.sync.plan, self.held_paths)
+        self.held = held if only is None else _split_plan(self.held, self.held_paths)[1]
+        held_report = self.sync.report(self.held)
+        if not self.sync.plan or self.dry_run:
+            self.pending = held_report + self.sync.report()
+            return
+        report = self.sync.report()
+        if self.sync.apply():
+            self.written += 1
+            self.last_edit = report
+            self._own_write = self._project_stat()
+        self.sync.reload()
+        self.pending = held_report
+
+    # Lifecycle
+
+    def start(self):
+        self.source.add(self.project_dir)
+        self.source.add(os.path.dirname(self.pbxproj_path))
+        self._watch_roots()
+        cache = load_cache() if self.use_cache else {}
+        for path, is_dir in self.listing.items():
+            if not is_dir and path.endswith('.swift'):
+                if path in cache:
+                    self.syntax[path] = cache[path]
+                self._check_syntax(path)
+        self._save_syntax()
+        self._reconcile(hold=not self.apply_initial)
+        self.write_status()
+
+    def collect(self, events, now=None):
+        """
+        Adds raw (path, mask, cookie) events to the current batch. Events for
+        other files next to project.yml and for the watcher's own project
+        writes are dropped and do not start a batch.
+        """
+        relevant = 0
+        for path, mask, cookie in events:
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+            elif path == self.spec_path:
+                self.spec_changed = True
+            elif path == self.pbxproj_path:
+                if self._project_stat() == self._own_write:
+                    continue
+                self.project_changed = True
+            elif not self._under_roots(path):
+                continue
+            elif mask & IN_MOVED_FROM:
+                self.moved_from[cookie] = (path, bool(mask & IN_ISDIR))
+            elif mask & IN_MOVED_TO and cookie in self.moved_from:
+                src, is_dir = self.moved_from.pop(cookie)
+                self.moves.append((src, path, is_dir))
+            else:
+                self.touched.add(path)
+            relevant += 1
+        if relevant:
+            now = time.perf_counter() if now is None else now
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.events += relevant
+
+    def due(self, now=None):
+        if self.first is None:
+            return False
+        now = time.perf_counter() if now is None else now
+        return now - self.last >= QUIET or now - self.first >= MAX_DELAY
+
+    def timeout(self, now=None):
+        if self.first is None:
+            return HEARTBEAT
+        now = time.perf_counter() if now is None else now
+        return max(0.0, min(self.last + QUIET, self.first + MAX_DELAY) - now)
+
+    def flush(self):
+        """Processes the current batch and writes the status file."""
+        start = time.perf_counter()
+        first = self.first
+        written = self.written
+        changed = set()
+        touched = self.touched | {src for src, _ in self.moved_from.values()}
+        for src, dst, is_dir in self.moves:
+            if is_dir:
+                self.source.moved(src, dst)
+                prefix = os.path.join(src, '')
+                for path in [p for p in self.listing if p == src or p.startswith(prefix)]:
+                    new_path = dst + path[len(src):]
+                    self.listing[new_path] = self.listing.pop(path)
+                    changed.update((path, new_path))
+            else:
+                self.listing.pop(src, None)
+                changed.add(src)
+                touched.add(dst)
+        for path in touched:
+            try:
+                is_dir = os.path.isdir(path) and not os.path.islink(path)
+                exists = is_dir or os.path.lexists(path)
+            except OSError:
+                exists = False
+            if not exists:
+                changed.update(self._drop_tree(path) if path in self.listing else (path,))
+            elif is_dir:
+                changed.update(self._add_tree(path))
+            else:
+                self.listing[path] = False
+                changed.add(path)
+        if self.overflow:
+            # Events were lost: list the tree again once.
+            before = set(self.listing)
+            self.listing.clear()
+            self._watch_roots()
+            changed.update(before.symmetric_difference(self.listing))
+            changed.update(p for p in self.listing if p.endswith('.swift'))
+
+        checked = sum(self._check_syntax(path) for path in sorted(changed) if path.endswith('.swift'))
+        if checked or any(p.endswith('.swift') and p not in self.listing for p in changed):
+            self._save_syntax()
+
+        try:
+            if self.spec_changed:
+                self.sync.spec = load_spec(self.spec_path)
+                self._watch_roots()
+                self.sync.reload()
+                self._reconcile()
+            elif self.project_changed and self._project_stat() != self._own_write:
+                self.sync.reload()
+                self._reconcile()
+            elif changed or self.overflow:
+                prefix = len(os.path.join(self.project_dir, ''))
+                self._reconcile(None if self.overflow else {path[prefix:] for path in changed})
+            self.error = None
+        except Exception as exc:  # a half-written project.yml or pbxproj; retried with the next batch
+            self.error = f"{type(exc).__name__}: {exc}"
+            self.spec_changed = self.project_changed = False
+            self.sync.plan = {}
+
+        done = time.perf_counter()
+        self.last_batch = {
+            'events': self.events,
+            'paths': len(changed),
+            'lexed': checked,
+            'edits': self.last_edit if self.written != written else [],
+            'latency ms': round((done - first) * 1000, 2) if first is not None else None,
+            'process ms': round((done - start) * 1000, 2),
+        }
+        self._reset_batch()
+        self.write_status()
+        if self.on_flush is not None:
+            self.on_flush(self)
+
+    def run(self):
+        """Watches until `stop()` or SIGINT/SIGTERM."""
+        self.start()
+        self.loop()
+
+    def loop(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        fd = self.source.fileno()
+        try:
+            while not self.stopping:
+                timeout = self.timeout()
+                if fd is not None:
+                    ready, _, _ = select.select([fd], [], [], timeout)
+                    events = self.source.read() if ready else []
+                else:
+                    time.sleep(min(timeout, self.source.interval) if self.first is not None else self.source.interval)
+                    events = self.source.read()
+                if events:
+                    self.collect(events)
+                if self.due():
+                    self.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.source.close()
+            self._save_syntax()
+            self.write_status(running=False)
+
+    def stop(self):
+        self.stopping = True
+
+    # Status
+
+    def state(self, running=True):
+        issues = self.issues()
+        project_ok = not self.pending and self.error is None
+        prefix = len(os.path.join(self.project_dir, ''))
+        return {
+            'version': STATUS_VERSION,
+            'pid': os.getpid(),
+            'running': running,
+            'updated': time.time(),
+            'mode': self.source.mode,
+            'dry run': self.dry_run,
+            'project dir': self.project_dir,
+            'roots': [root[prefix:] for root in self.roots],
+            'watches': len(self.source),
+            'files': sum(1 for is_dir in self.listing.values() if not is_dir),
+            'consistent': project_ok and not issues,
+            'project': {
+                'consistent': project_ok,
+                'pending': self.pending,
+                'error': self.error,
+                'writes': self.written,
+                'last edit': self.last_edit,
+            },
+            'syntax': {
+                'consistent': not issues,
+                'files': len(self.syntax),
+                'issues': [str(issue) for issue in issues],
+            },
+            'last batch': self.last_batch,
+        }
+
+    def write_status(self, running=True):
+        if self.status_path is None:
+            return
+        os.makedirs(os.path.dirname(self.status_path), exist_ok=True)
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state(running), f, indent=1)
+        os.replace(tmp_path, self.status_path)
+
+
+def read_status(path=STATUS_PATH):
+    """The last status a watcher wrote, or None. `running` is cleared when its process is gone."""
+    try:
+        with open(path, 'r') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if status.get('version') != STATUS_VERSION:
+        return None
+    if status['running']:
+        try:
+            os.kill(status['pid'], 0)
+        except ProcessLookupError:
+            status['running'] = False
+        except PermissionError:
+            pass
+    return status
+
+
+def _copy_project(project_dir, target):
+    spec = load_spec(os.path.join(project_dir, SPEC_NAME))
+    shutil.copy2(os.path.join(project_dir, SPEC_NAME), os.path.join(target, SPEC_NAME))
+    os.makedirs(os.path.dirname(os.path.join(target, PBXPROJ_NAME)))
+    shutil.copy2(os.path.join(project_dir, PBXPROJ_NAME), os.path.join(target, PBXPROJ_NAME))
+    for root in source_roots(spec):
+        shutil.copytree(os.path.join(project_dir, root), os.path.join(target, root), symlinks=True)
+    return source_roots(spec)
+
+
+def bench(project_dir=PROJECT_DIR, poll=False):
+    """
+    Runs a watcher over a scratch copy of the project, performs a series of
+    edits and returns [(step, latency ms, batch, consistent)]. Consistency is
+    checked independently after every step: a full disk-based sync must find
+    nothing to do and a full syntax check must report the watcher's issues.
+    """
+    results = []
+    roots = []
+    scratch = tempfile.mkdtemp(prefix='knowmaps-watch-')
+    try:
+        roots = _copy_project(project_dir, scratch)
+        flushed = threading.Event()
+        watcher = Watcher(scratch, poll=poll, status_path=os.path.join(scratch, 'status.json'),
+                          use_cache=False, on_flush=lambda _: flushed.set(), apply_initial=True)
+        watcher.start()
+        thread = threading.Thread(target=watcher.loop)
+        thread.start()
+        prod = os.path.join(scratch, roots[0])
+        subdirs = sorted(d for d in os.listdir(prod) if os.path.isdir(os.path.join(prod, d)) and '.' not in d)
+        sample = sorted(p for p in watcher.listing if p.startswith(os.path.join(prod, subdirs[0], '')) and p.endswith('.swift'))[0]
+        with open(sample, 'r') as f:
+            original = f.read()
+        new_file = os.path.join(prod, subdirs[0], 'WatchBenchView.swift')
+        moved_file = os.path.join(prod, subdirs[1], 'WatchBenchView.swift')
+        burst_dir = os.path.join(prod, 'WatchBench')
+
+        def write(path, text):
+            with open(path, 'w') as f:
+                f.write(text)
+
+        def burst():
+            os.mkdir(burst_dir)
+            for i in range(20):
+                write(os.path.join(burst_dir, f"Generated{i}.swift"), f"struct Generated{i} {{ }}\n")
+
+        steps = [
+            ('break syntax', lambda: write(sample, original + '\n}\n')),
+            ('fix syntax', lambda: write(sample, original)),
+            ('add file', lambda: write(new_file, 'struct WatchBenchView { }\n')),
+            ('move file', lambda: os.rename(new_file, moved_file)),
+            ('delete file', lambda: os.remove(moved_file)),
+            ('add 20 files', burst),
+            ('rename directory', lambda: os.rename(burst_dir, burst_dir + 'Renamed')),
+            ('delete directory', lambda: shutil.rmtree(burst_dir + 'Renamed')),
+        ]
+        for name, step in steps:
+            flushed.clear()
+            start = time.perf_counter()
+            step()
+            latency = float('nan')
+            # A step can land in more than one batch; wait until the tree is quiet.
+            while flushed.wait(5):
+                latency = time.perf_counter() - start
+                flushed.clear()
+                if not flushed.wait(MAX_DELAY + QUIET):
+                    break
+            status = watcher.last_batch
+            check = ProjectSync(scratch)
+            disk_issues, _, _ = check_paths([os.path.join(scratch, root) for root in roots], use_cache=False, workers=1)
+            consistent = not check.compute() and [str(i) for i in disk_issues] == [str(i) for i in watcher.issues()]
+            results.append((name, latency * 1000, status, consistent))
+        watcher.stop()
+        thread.join()
+    finally:
+        for root in roots:
+            # The disk index ProjectSync saved for the scratch copy.
+            try:
+                os.remove(default_cache_path(os.path.join(scratch, root)))
+            except OSError:
+                pass
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def _print_status(status):
+    state = 'running' if status['running'] else 'stopped'
+    verdict = 'consistent' if status['consistent'] else 'inconsistent'
+    print(f"{status['project dir']}: {verdict} ({state}, {status['mode']}, pid {status['pid']}, "
+          f"{status['files']} files, {status['watches']} watches)")
+    project = status['project']
+    if project['error']:
+        print(f"  project error: {project['error']}")
+    for line in project['pending']:
+        print(f"  pending {line}")
+    for line in status['syntax']['issues']:
+        print(f"  {line}")
+    batch = status['last batch']
+    if batch:
+        print(f"  last batch: {batch['events']} event(s), {batch['paths']} path(s), {batch['lexed']} lexed, "
+              f"{batch['latency ms']} ms after the first event")
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else list(argv)
+    status_path = option(args, '--status', STATUS_PATH)
+    command = args[0] if args and args[0] in ('run', 'status', 'bench') else 'run'
+    if command == 'status':
+        status = read_status(status_path)
+        if status is None:
+            print(f"No watcher status at {status_path}")
+            return 2
+        _print_status(status)
+        return 0 if status['running'] and status['consistent'] else 1
+    if command == 'bench':
+        for name, latency, batch, consistent in bench(poll='--poll' in args):
+            print(f"{name:18} {latency:7.1f} ms  {batch['events']:>3} event(s) {batch['paths']:>3} path(s)  "
+                  f"{'consistent' if consistent else 'INCONSISTENT'}")
+        return 0
+    positional = [a for a in args[1 if args[:1] == ['run'] else 0:] if not a.startswith('--') and a != status_path]
+    watcher = Watcher(positional[0] if positional else PROJECT_DIR, dry_run='--dry-run' in args,
+                      poll='--poll' in args, status_path=status_path, apply_initial='--apply-initial' in args)
+
+    def report(w):
+        state = w.state()
+        batch = state['last batch']
+        print(f"{batch['events']} event(s), {batch['paths']} path(s), {batch['latency ms']} ms: "
+              f"{'consistent' if state['consistent'] else 'inconsistent'}, "
+              f"{len(state['syntax']['issues'])} syntax issue(s)", flush=True)
+        for line in batch['edits']:
+            print(f"  {line}")
+        for line in state['project']['pending']:
+            print(f"  pending {line}")
+
+    watcher.start()
+    _print_status(watcher.state())
+    for line in watcher.last_edit:
+        print(f"  {line}")
+    if watcher.held:
+        print("The startup diff is held back until its files change; --apply-initial applies it.")
+    print(f"Watching {watcher.project_dir} (status in {status_path}); Ctrl-C to stop.", flush=True)
+    watcher.on_flush = report
+    watcher.loop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
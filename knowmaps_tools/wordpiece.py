@@ -0,0 +1,351 @@
+"""
+wordpiece.py
+
+Python port of MiniLMTokenizer.swift (BERT WordPiece for MiniLM-L12-v2).
+
+The output matches `MiniLMTokenizer.encode(_:maxLength:)` id for id,
+including its quirks:
+    - the text is lowercased and split on whitespace only; punctuation stays
+      attached and becomes "##" continuation pieces;
+    - a word that cannot be finished keeps the pieces matched so far and
+      ends with [UNK];
+    - [SEP] is cut off along with everything else past `max_length`;
+    - pieces are Swift Characters (grapheme clusters) compared by canonical
+      equivalence, so words and vocab entries are NFC-normalized and a match
+      never ends inside a cluster.
+
+Longest-match lookup walks a character trie (one for word starts, one for
+"##" continuations) instead of probing every prefix, and whole words are
+memoized in an LRU cache. Batches are written into preallocated int32 NumPy
+arrays, either padded to `max_length` like the app or grouped into length
+buckets.
+
+Prerequisites:
+    - numpy (`pip install numpy`) for the batch APIs
+
+Usage:
+    python -m knowmaps_tools.wordpiece encode "coffee shops near me"
+    python -m knowmaps_tools.wordpiece parity
+    python -m knowmaps_tools.wordpiece bench
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from functools import lru_cache
+
+VOCAB_PATH = 'Know-Maps/Know Maps Prod/Model/Models/vocab.txt'
+ML_DIR = 'Know-Maps/Know Maps Prod/Model/ML'
+PARITY_CORPUS = os.path.join(ML_DIR, 'QueryClassifierTrainingData.json')
+MAX_LENGTH = 256
+BUCKETS = (16, 32, 64, 128, 256)
+WORD_CACHE_SIZE = 1 << 16
+
+UNK, CLS, SEP, PAD = '[UNK]', '[CLS]', '[SEP]', '[PAD]'
+_TERMINAL = ''
+
+# Foundation's CharacterSet.whitespacesAndNewlines: Unicode Zs plus the
+# line and paragraph separators and the ASCII/C1 controls below.
+_WHITESPACE_RE = re.compile('[\t\n\x0b\x0c\r \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+')
+
+
+def load_vocab(path=VOCAB_PATH):
+    """Token -> id, with ids counted over non-empty lines like String.split(separator:)."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = [line for line in f.read().split('\n') if line]
+    vocab = {}
+    for i, token in enumerate(lines):
+        vocab[unicodedata.normalize('NFC', token)] = i
+    return vocab
+
+
+def _extends_cluster(char, previous):
+    """Approximates the grapheme-cluster rules relevant to lowercased words."""
+    code = ord(char)
+    if unicodedata.category(char) in ('Mn', 'Me', 'Mc') or code == 0x200D or previous == '\u200d':
+        return True
+    if 0xFE00 <= code <= 0xFE0F or 0x1F3FB <= code <= 0x1F3FF or 0xE0020 <= code <= 0xE007F:
+        return True
+    # Hangul medial vowels and final consonants join the preceding jamo.
+    return 0x1160 <= code <= 0x11FF
+
+
+def cluster_ends(word):
+    """Offsets at which a grapheme cluster ends, or None when every code point is one."""
+    if word.isascii():
+        return None
+    ends = set()
+    regional = 0
+    for i, char in enumerate(word):
+        previous = word[i - 1] if i else ''
+        is_regional = 0x1F1E6 <= ord(char) <= 0x1F1FF
+        joins = i and (_extends_cluster(char, previous) or (is_regional and regional % 2 == 1))
+        regional = regional + 1 if is_regional else 0
+        if i and not joins:
+            ends.add(i)
+    ends.add(len(word))
+    return ends
+
+
+def _build_trie(tokens):
+    root = {}
+    for token, token_id in tokens:
+        node = root
+        for char in token:
+            node = node.setdefault(char, {})
+        node[_TERMINAL] = token_id
+    return root
+
+
+class WordPieceTokenizer:
+    """Greedy longest-match WordPiece over a character trie."""
+
+    def __init__(self, vocab=None, cache_size=WORD_CACHE_SIZE):
+        self.vocab = load_vocab() if vocab is None else vocab
+        self.unk_id = self.vocab[UNK]
+        self.cls_id = self.vocab[CLS]
+        self.sep_id = self.vocab[SEP]
+        self.pad_id = self.vocab[PAD]
+        self._start = _build_trie(self.vocab.items())
+        self._continuation = _build_trie((t[2:], i) for t, i in self.vocab.items() if t.startswith('##') and len(t) > 2)
+        self.word_ids = lru_cache(maxsize=cache_size)(self._word_ids)
+
+    def _longest(self, trie, word, start, ends):
+        node = trie
+        best = None
+        for k in range(start, len(word)):
+            node = node.get(word[k])
+            if node is None:
+                break
+            token_id = node.get(_TERMINAL)
+            if token_id is not None and (ends is None or k + 1 in ends):
+                best = (k + 1, token_id)
+        return best
+
+    def _word_ids(self, word):
+        """WordPiece ids for one whitespace-separated, lowercased word."""
+        word = unicodedata.normalize('NFC', word)
+        whole = self.vocab.get(word)
+        if whole is not None:
+            return (whole,)
+        ends = cluster_ends(word)
+        ids = []
+        i = 0
+        while i < len(word):
+            match = self._longest(self._start if i == 0 else self._continuation, word, i, ends)
+            if match is None:
+                ids.append(self.unk_id)
+                break
+            i, token_id = match
+            ids.append(token_id)
+        return tuple(ids)
+
+    def words(self, text):
+        return [word for word in _WHITESPACE_RE.split(text.lower()) if word]
+
+    def token_ids(self, text):
+        """[CLS] + word pieces + [SEP], untruncated."""
+        ids = [self.cls_id]
+        word_ids = self.word_ids
+        for word in self.words(text):
+            ids.extend(word_ids(word))
+        ids.append(self.sep_id)
+        return ids
+
+    def encode(self, text, max_length=MAX_LENGTH):
+        """Same (ids, mask) lists as MiniLMTokenizer.encode(_:maxLength:)."""
+        ids = self.token_ids(text)[:max_length]
+        mask = [1] * len(ids)
+        padding = max_length - len(ids)
+        if padding > 0:
+            ids += [self.pad_id] * padding
+            mask += [0] * padding
+        return ids, mask
+
+    def _fill(self, sequences, width):
+        import numpy as np
+
+        ids = np.full((len(sequences), width), self.pad_id, dtype=np.int32)
+        mask = np.zeros((len(sequences), width), dtype=np.int32)
+        for row, sequence in enumerate(sequences):
+            length = min(len(sequence), width)
+            ids[row, :length] = sequence[:length]
+            mask[row, :length] = 1
+        return ids, mask
+
+    def encode_batch(self, texts, max_length=MAX_LENGTH):
+        """(ids, mask) int32 arrays of shape (len(texts), max_length), as the app pads them."""
+        return self._fill([self.token_ids(text) for text in texts], max_length)
+
+    def encode_buckets(self, texts, max_length=MAX_LENGTH, buckets=BUCKETS):
+        """
+        Groups texts by padded length. Returns [(row indexes, ids, mask)], one
+        entry per used bucket, where every sequence in a bucket is padded only
+        to that bucket's width (capped at max_length).
+        """
+        widths = sorted({min(width, max_length) for width in buckets} | {max_length})
+        grouped = {}
+        for row, text in enumerate(texts):
+            sequence = self.token_ids(text)
+            width = next((w for w in widths if len(sequence) <= w), max_length)
+            grouped.setdefault(width, ([], []))
+            grouped[width][0].append(row)
+            grouped[width][1].append(sequence)
+        result = []
+        for width in sorted(grouped):
+            rows, sequences = grouped[width]
+            ids, mask = self._fill(sequences, width)
+            result.append((rows, ids, mask))
+        return result
+
+
+# Reference semantics
+#
+# Written independently of the tokenizer above (no shared helpers), so that
+# parity checks compare two implementations rather than one with itself.
+
+def _reference_components(text):
+    """String.components(separatedBy: .whitespacesAndNewlines) without the empty strings."""
+    words = []
+    current = ''
+    for char in text:
+        # whitespacesAndNewlines: the Z categories, tab, LF, VT, FF, CR and NEL.
+        if unicodedata.category(char) in ('Zs', 'Zl', 'Zp') or char in '\t\n\x0b\x0c\r\x85':
+            if current:
+                words.append(current)
+            current = ''
+        else:
+            current += char
+    if current:
+        words.append(current)
+    return words
+
+
+def _reference_characters(word):
+    """Array(word): one string per grapheme cluster."""
+    clusters = []
+    for char in word:
+        code = ord(char)
+        joins = clusters and (
+            unicodedata.category(char) in ('Mn', 'Me', 'Mc')  # Extend and SpacingMark
+            or char == '\u200d'  # ZWJ
+            or clusters[-1].endswith('\u200d')  # whatever follows a ZWJ
+            or 0xFE00 <= code <= 0xFE0F  # variation selectors
+            or 0x1F3FB <= code <= 0x1F3FF  # emoji skin tones
+            or 0xE0020 <= code <= 0xE007F  # emoji tag sequences
+            or 0x1160 <= code <= 0x11FF  # Hangul V and T jamo
+            # Regional indicators pair up into flags.
+            or (0x1F1E6 <= code <= 0x1F1FF and len(clusters[-1]) == 1 and 0x1F1E6 <= ord(clusters[-1]) <= 0x1F1FF))
+        if joins:
+            clusters[-1] += char
+        else:
+            clusters.append(char)
+    return clusters
+
+
+def reference_encode(vocab, text, max_length=MAX_LENGTH):
+    """Line-by-line transliteration of MiniLMTokenizer.encode, for parity checks."""
+    tokens = _reference_components(text.lower())
+    pieces = []
+    for token in tokens:
+        token = unicodedata.normalize('NFC', token)
+        if token in vocab:
+            pieces.append(token)
+            continue
+        chars = _reference_characters(token)
+        i = 0
+        while i < len(chars):
+            j = len(chars)
+            sub = None
+            while i < j:
+                piece = ('##' if i > 0 else '') + ''.join(chars[i:j])
+                if piece in vocab:
+                    sub = piece
+                    break
+                j -= 1
+            if sub is not None:
+                pieces.append(sub)
+                i = j
+            else:
+                pieces.append(UNK)
+                break
+    ids = [vocab[CLS]] + [vocab.get(p, vocab[UNK]) for p in pieces] + [vocab[SEP]]
+    ids = ids[:max_length]
+    mask = [1] * len(ids)
+    padding = max_length - len(ids)
+    if padding > 0:
+        ids += [vocab[PAD]] * padding
+        mask += [0] * padding
+    return ids, mask
+
+
+def corpus_texts(path=PARITY_CORPUS):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [record['text'] for record in json.load(f)]
+
+
+def parity(tokenizer, texts):
+    """Returns the texts whose encoding differs from the reference transliteration."""
+    import numpy as np
+
+    mismatches = []
+    ids, mask = tokenizer.encode_batch(texts)
+    for row, text in enumerate(texts):
+        expected_ids, expected_mask = reference_encode(tokenizer.vocab, text)
+        if tokenizer.encode(text) != (expected_ids, expected_mask) \
+                or not np.array_equal(ids[row], expected_ids) or not np.array_equal(mask[row], expected_mask):
+            mismatches.append(text)
+    return mismatches
+
+
+def bench(tokenizer, texts, repeat=20):
+    """Returns (tokens per second cold, tokens per second warm, batch tokens per second)."""
+    tokens = sum(len(tokenizer.token_ids(text)) for text in texts)
+    tokenizer.word_ids.cache_clear()
+    start = time.perf_counter()
+    for text in texts:
+        tokenizer.token_ids(text)
+    cold = tokens / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            tokenizer.token_ids(text)
+    warm = tokens * repeat / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tokenizer.encode_buckets(texts)
+    batched = tokens * repeat / (time.perf_counter() - start)
+    return cold, warm, batched
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    command = args[0] if args else 'parity'
+    tokenizer = WordPieceTokenizer()
+    if command == 'encode':
+        for text in args[1:]:
+            ids = tokenizer.token_ids(text)
+            print(f"{text!r}: {ids}")
+        return 0
+    texts = corpus_texts()
+    if command == 'parity':
+        texts = texts + [text.upper() for text in texts[::10]] + ['', '   ', 'Café   crème\tbrûlée', '🇻🇳 phở']
+        mismatches = parity(tokenizer, texts)
+        for text in mismatches:
+            print(f"Mismatch: {text!r}")
+        print(f"{len(texts)} texts checked, {len(mismatches)} mismatch(es).")
+        return 1 if mismatches else 0
+    if command == 'bench':
+        cold, warm, batched = bench(tokenizer, texts)
+        print(f"{len(texts)} texts: {cold:,.0f} tokens/s cold, {warm:,.0f} tokens/s cached, "
+              f"{batched:,.0f} tokens/s into bucketed int32 arrays")
+        return 0
+    print("Usage: python -m knowmaps_tools.wordpiece encode|parity|bench [texts...]")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
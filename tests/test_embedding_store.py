@@ -0,0 +1,29 @@
+import threading
+
+from knowmaps_tools.embedding_store import MIN_COMPACT_ROWS, EmbeddingStore
+
+
+def test_inline_compact_waits_for_background_compaction(tmp_path):
+    store = EmbeddingStore(str(tmp_path / 'store'), dim=4)
+    # Hold the background compaction back until the inline compact() is waiting on it.
+    release = threading.Event()
+    copy = store._compact
+    store._compact = lambda *args: (release.wait(), copy(*args))
+    for i in range(MIN_COMPACT_ROWS + 1):
+        store.set('key', [i, 0, 0, 0])
+        if store._compactor is not None:
+            break
+    assert store._compactor is not None
+    store.set('other', [1, 2, 3, 4])
+
+    inline = threading.Thread(target=store.compact, daemon=True)
+    inline.start()
+    threading.Timer(0.2, release.set).start()
+    inline.join(10)
+    assert not inline.is_alive()
+
+    assert store.generation == 2
+    assert store.garbage == 0
+    assert store.get('key').tolist() == [i, 0, 0, 0]
+    assert store.get('other').tolist() == [1, 2, 3, 4]
+    store.close()
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from knowmaps_tools.disk_index import REPO_ROOT
+from knowmaps_tools.taxonomy_index import TAXONOMY_PATH, TaxonomyIndex, _probe_labels, build_index, \
+    linear_category_id, load_taxonomy
+
+# Ties the compiled label table has to break the way the linear scan does.
+TAXONOMY = {
+    '100': {'labels': {'en': 'Dining', 'vi': 'Ăn uống'}, 'full_label': ['Dining'], 'parents': []},
+    # A full_label match comes first in the JSON, but the English label below wins.
+    '110': {'labels': {'en': 'Espresso Bar'}, 'full_label': ['Dining', 'Cafe', 'Espresso Bar'], 'parents': ['100']},
+    '120': {'labels': {'en': 'Cafe', 'th': 'ร้านกาแฟ'}, 'full_label': ['Dining', 'Café'], 'parents': ['100']},
+    # Duplicate English labels: the first category in the JSON wins.
+    '130': {'labels': {'en': 'Bar'}, 'full_label': ['Dining', 'Bar'], 'parents': ['100']},
+    '131': {'labels': {'en': 'BAR'}, 'full_label': ['Nightlife', 'Bar'], 'parents': ['999']},
+    # Only a non-English label.
+    '140': {'labels': {'km': 'ហាងកាហ្វេ'}, 'full_label': [], 'parents': ['100']},
+}
+
+
+def _index(tmp_path, taxonomy):
+    source = tmp_path / 'taxonomy.json'
+    source.write_text(json.dumps(taxonomy, ensure_ascii=False), encoding='utf-8')
+    return TaxonomyIndex(build_index(str(source), str(tmp_path / 'taxonomy.idx')))
+
+
+def test_ties_match_linear_scan(tmp_path):
+    with _index(tmp_path, TAXONOMY) as index:
+        for label in _probe_labels(TAXONOMY) + ['cafe', 'CAFÉ', 'bar', 'Nightlife', 'Missing']:
+            assert index.category_id(label) == linear_category_id(TAXONOMY, label), label
+        assert index.category_id('cafe') == '120'
+        assert index.category_id('bar') == '130'
+
+
+def test_any_language(tmp_path):
+    with _index(tmp_path, TAXONOMY) as index:
+        assert index.category_id('ហាងកាហ្វេ') is None
+        assert index.category_id('ហាងកាហ្វេ', any_language=True) == '140'
+        # English and full_label matches still come first.
+        assert index.category_id('cafe', any_language=True) == '120'
+        assert index.category_ids(['Dining', 'Missing', 'Ăn uống'], any_language=True) == ['100', '100']
+
+
+def test_records_round_trip(tmp_path):
+    with _index(tmp_path, TAXONOMY) as index:
+        assert len(index) == len(TAXONOMY)
+        for category_id, details in TAXONOMY.items():
+            assert index.labels(category_id) == details['labels']
+            assert index.full_label(category_id) == details['full_label']
+            # Parents outside the taxonomy are dropped.
+            assert index.parents(category_id) == [p for p in details['parents'] if p in TAXONOMY]
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(REPO_ROOT, TAXONOMY_PATH)), reason='taxonomy not checked out')
+def test_matches_linear_scan_on_taxonomy(tmp_path):
+    source = os.path.join(REPO_ROOT, TAXONOMY_PATH)
+    taxonomy = load_taxonomy(source)
+    with TaxonomyIndex(build_index(source, str(tmp_path / 'taxonomy.idx'))) as index:
+        # Every fifth probe keeps the linear scan to a couple of seconds.
+        for label in _probe_labels(taxonomy)[::5]:
+            assert index.category_id(label) == linear_category_id(taxonomy, label), label
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from knowmaps_tools.disk_index import REPO_ROOT
+from knowmaps_tools.wordpiece import PARITY_CORPUS, VOCAB_PATH, WordPieceTokenizer, corpus_texts, load_vocab, \
+    reference_encode
+
+
+@pytest.fixture(scope='module')
+def tokenizer():
+    return WordPieceTokenizer(load_vocab(os.path.join(REPO_ROOT, VOCAB_PATH)))
+
+
+# Ids from the MiniLM vocab.txt; 100 is [UNK], 101 [CLS], 102 [SEP].
+EXPECTED_IDS = {
+    'coffee shops near me': [101, 4157, 7340, 2379, 2033, 102],
+    "Brooklyn's best pizza!": [101, 6613, 29618, 2015, 2190, 10733, 29612, 102],
+    'sushi': [101, 10514, 6182, 102],
+    'qzxqzx': [101, 1053, 2480, 2595, 4160, 2480, 2595, 102],
+    # Unmatched accented letters end the word with [UNK].
+    'Café   crème\tbrûlée': [101, 24689, 100, 13675, 100, 7987, 100, 102],
+    'Thủy cung': [101, 16215, 100, 12731, 3070, 102],
+    # A flag is one Character, so it is never split into its two code points.
+    '🇻🇳 phở': [101, 100, 6887, 100, 102],
+    '': [101, 102],
+    ' 　 ': [101, 102],
+}
+
+
+@pytest.mark.parametrize('text', sorted(EXPECTED_IDS))
+def test_token_ids(tokenizer, text):
+    expected = EXPECTED_IDS[text]
+    assert tokenizer.token_ids(text) == expected
+    assert reference_encode(tokenizer.vocab, text, max_length=len(expected))[0] == expected
+
+
+def test_encode_pads_and_truncates(tokenizer):
+    assert tokenizer.encode('coffee', max_length=5) == ([101, 4157, 102, 0, 0], [1, 1, 1, 0, 0])
+    # [SEP] is cut off with everything else past max_length.
+    assert tokenizer.encode('coffee shops near me', max_length=4) == ([101, 4157, 7340, 2379], [1, 1, 1, 1])
+
+
+def test_matches_reference_on_corpus(tokenizer):
+    texts = corpus_texts(os.path.join(REPO_ROOT, PARITY_CORPUS))
+    texts += [text.upper() for text in texts[::10]]
+    for text in texts:
+        assert tokenizer.encode(text) == reference_encode(tokenizer.vocab, text), text
+
+
+def test_batches_match_single_encodings(tokenizer):
+    texts = sorted(EXPECTED_IDS) + ['coffee ' * 40]
+    ids, mask = tokenizer.encode_batch(texts, max_length=32)
+    for row, text in enumerate(texts):
+        assert (ids[row].tolist(), mask[row].tolist()) == tokenizer.encode(text, max_length=32)
+    for rows, ids, mask in tokenizer.encode_buckets(texts, max_length=64):
+        for i, row in enumerate(rows):
+            assert (ids[i].tolist(), mask[i].tolist()) == tokenizer.encode(texts[row], max_length=ids.shape[1])